@@ -1,18 +1,22 @@
 """
 Alembic migration script configuration
 """
+from asyncio import run
 from logging.config import fileConfig
 
 from alembic import context
+from asyncpg.exceptions import InvalidCatalogNameError
+from asyncpg.exceptions import PostgresError
 from demo.core.config import core_config
 from demo.core.config import core_logger as logger
+from demo.database import async_database_url
+from demo.database import connect_args
 from demo.database import Base
-from demo.database import engine_default
-from demo.database import engine_generic
-from sqlalchemy import engine_from_config
 from sqlalchemy import pool
-from sqlalchemy.engine import Engine
-from sqlalchemy.exc import OperationalError
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.sql.schema import MetaData
 
 # this is the Alembic Config object, which provides
@@ -32,56 +36,76 @@ target_metadata: MetaData = Base.metadata
 # ... etc.
 
 
-def detect_and_create_new_db(a_engine: Engine, a_database: str) -> None:
+async def detect_and_create_new_db(a_engine: AsyncEngine, a_database: str) -> None:
     """
     Attempt to connect to the <a_database> database. If it doesn't exist (likely if this is
     the first time connecting or running tests), create it.
     """
     try:
-        with a_engine.connect():
+        async with a_engine.connect():
             pass
-    except OperationalError:
+    except InvalidCatalogNameError:
         logger.info(f"Database {a_database} wasn't found. Attempting to create it.")
-        # NOTE: We're using the engine_generic here. See the notes in core_config.
+        # NOTE: We're using the DATABASE_URI_GENERIC here. See the notes in core_config.
+        l_engine_generic: AsyncEngine = create_async_engine(
+            async_database_url(core_config.DATABASE_URI_GENERIC),
+            isolation_level="AUTOCOMMIT",
+            poolclass=pool.NullPool,
+            connect_args=connect_args(),
+        )
         try:
-            with engine_generic.connect() as l_connection:
-                l_connection.execute(f"CREATE DATABASE {a_database}")
+            async with l_engine_generic.connect() as l_connection:
+                await l_connection.execute(text(f"CREATE DATABASE {a_database}"))
                 logger.info(f"Created database {a_database}")
-        except OperationalError as e:
+        except (OSError, PostgresError) as e:
             logger.error(
-                f"Failed to create database {a_database} using generic URI {str(engine_generic)}: {e}"
+                f"Failed to create database {a_database} using generic URI {str(l_engine_generic.url)}: {e}"
             )
+        finally:
+            await l_engine_generic.dispose()
 
 
-def run_migrations_online() -> None:
+def do_run_migrations(a_connection: Connection) -> None:
+    """
+    Run the migrations on a_connection. AsyncConnection.run_sync calls this with a
+    synchronous facade over the asyncpg connection, as Alembic itself is synchronous.
+    """
+    context.configure(
+        connection=a_connection,
+        target_metadata=target_metadata,
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_migrations_online() -> None:
     """Run migrations in 'online' mode.
 
     In this scenario we need to create an Engine
     and associate a connection with the context.
 
+    The same asyncpg driver the API uses is used here, but migrations run once per
+    deployment so a single unpooled connection is opened rather than the API's pool.
+    Behind a transaction pooler every migration runs in one transaction, and so on one
+    server connection, except those using autocommit_block.
     """
     logger.info("Running Alembic migration online.")
     logger.info(f"SQLAlchemy metadata tables: {list(target_metadata.tables)}")
 
-    # Ensure the primary database is created if it doesn't already exist
-    detect_and_create_new_db(engine_default, core_config.POSTGRES_DB)
-
-    l_engine: Engine = engine_from_config(
-        config.get_section(config.config_ini_section),
-        prefix="sqlalchemy.",
+    l_engine: AsyncEngine = create_async_engine(
+        async_database_url(core_config.DATABASE_URI),
         poolclass=pool.NullPool,
-        url=core_config.DATABASE_URI,
-        echo=True,
+        connect_args=connect_args(),
     )
 
-    with l_engine.connect() as connection:
-        context.configure(
-            connection=connection,
-            target_metadata=target_metadata,
-        )
+    # Ensure the primary database is created if it doesn't already exist
+    await detect_and_create_new_db(l_engine, core_config.POSTGRES_DB)
+
+    async with l_engine.connect() as connection:
+        await connection.run_sync(do_run_migrations)
 
-        with context.begin_transaction():
-            context.run_migrations()
+    await l_engine.dispose()
 
 
 def run_migrations_offline() -> None:
@@ -115,4 +139,4 @@ def run_migrations_offline() -> None:
 if context.is_offline_mode():
     run_migrations_offline()
 else:
-    run_migrations_online()
+    run(run_migrations_online())
@@ -0,0 +1,25 @@
+"""Added users time_created id index
+
+Revision ID: 5b1f0c9e7a21
+Revises: 17e8aa9d283a
+Create Date: 2026-10-18 02:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "5b1f0c9e7a21"
+down_revision = "17e8aa9d283a"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_users_time_created_id", "users", ["time_created", "id"], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_users_time_created_id", table_name="users")
@@ -0,0 +1,73 @@
+"""Reworked users indexes
+
+Revision ID: 8c3d2e4f6a17
+Revises: 5b1f0c9e7a21
+Create Date: 2026-10-18 04:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "8c3d2e4f6a17"
+down_revision = "5b1f0c9e7a21"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Build the new indexes without blocking writes to users. CONCURRENTLY can't run
+    # inside a transaction.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_users_lower_email",
+            "users",
+            [sa.text("lower(email)")],
+            unique=True,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_users_username_id",
+            "users",
+            ["username", "id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_users_email_domain_time_created_id",
+            "users",
+            [sa.text("split_part(email, '@', 2)"), "time_created", "id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_users_active_time_created_id",
+            "users",
+            ["time_created", "id"],
+            unique=False,
+            postgresql_where=sa.text("is_active"),
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_users_superuser_time_created_id",
+            "users",
+            ["time_created", "id"],
+            unique=False,
+            postgresql_where=sa.text("is_superuser"),
+            postgresql_concurrently=True,
+        )
+    # ix_users_lower_email enforces uniqueness instead and the primary key already
+    # indexes id
+    op.drop_constraint("users_email_key", "users", type_="unique")
+    op.drop_index("ix_users_id", table_name="users")
+
+
+def downgrade() -> None:
+    op.create_index("ix_users_id", "users", ["id"], unique=False)
+    op.create_unique_constraint("users_email_key", "users", ["email"])
+    op.drop_index("ix_users_superuser_time_created_id", table_name="users")
+    op.drop_index("ix_users_active_time_created_id", table_name="users")
+    op.drop_index("ix_users_email_domain_time_created_id", table_name="users")
+    op.drop_index("ix_users_username_id", table_name="users")
+    op.drop_index("ix_users_lower_email", table_name="users")
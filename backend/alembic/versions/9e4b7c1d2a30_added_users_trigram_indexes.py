@@ -0,0 +1,46 @@
+"""Added users trigram indexes
+
+Revision ID: 9e4b7c1d2a30
+Revises: 8c3d2e4f6a17
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "9e4b7c1d2a30"
+down_revision = "8c3d2e4f6a17"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # Build the indexes without blocking writes to users. CONCURRENTLY can't run
+    # inside a transaction.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_users_email_trgm",
+            "users",
+            ["email"],
+            unique=False,
+            postgresql_using="gin",
+            postgresql_ops={"email": "gin_trgm_ops"},
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_users_username_trgm",
+            "users",
+            ["username"],
+            unique=False,
+            postgresql_using="gin",
+            postgresql_ops={"username": "gin_trgm_ops"},
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_users_username_trgm", table_name="users")
+    op.drop_index("ix_users_email_trgm", table_name="users")
+    # pg_trgm is left installed as other objects in the database may depend on it
@@ -0,0 +1,48 @@
+"""Added login bookkeeping
+
+Revision ID: b7f3a9c2e5d8
+Revises: 9e4b7c1d2a30
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "b7f3a9c2e5d8"
+down_revision = "9e4b7c1d2a30"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # A constant default is stored in the catalog, so adding login_count doesn't
+    # rewrite users
+    op.add_column("users", sa.Column("last_login", sa.DateTime(), nullable=True))
+    op.add_column(
+        "users",
+        sa.Column("login_count", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.create_table(
+        "login_events",
+        sa.Column("id", sa.BigInteger(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("time_created", sa.DateTime(), nullable=False),
+        sa.Column("ip_address", sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_login_events_user_id_time_created",
+        "login_events",
+        ["user_id", "time_created"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_login_events_user_id_time_created", table_name="login_events")
+    op.drop_table("login_events")
+    op.drop_column("users", "login_count")
+    op.drop_column("users", "last_login")
@@ -0,0 +1,29 @@
+"""Added user version
+
+Revision ID: c4e8d2f6a1b3
+Revises: b7f3a9c2e5d8
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "c4e8d2f6a1b3"
+down_revision = "b7f3a9c2e5d8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # A constant default is stored in the catalog, so adding version doesn't rewrite
+    # users
+    op.add_column(
+        "users",
+        sa.Column("version", sa.Integer(), nullable=False, server_default="1"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("users", "version")
@@ -0,0 +1,4 @@
+"""
+Standalone micro-benchmarks for demo. Run them from the backend directory with the
+same environment variables used by pytest, e.g. `python -m benchmarks.schema_parse`
+"""
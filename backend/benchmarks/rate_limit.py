@@ -0,0 +1,91 @@
+"""
+Measure the per-request overhead the login rate limiter adds before any form parsing or
+hashing. Redis is replaced by an in-memory fakeredis instance unless --redis is given,
+in which case the configured REDIS_URI is used and the network round trip is included.
+fakeredis emulates the script in an embedded Lua runtime, so its figure is dominated by
+that emulation; use --redis for numbers representative of production.
+"""
+from argparse import ArgumentParser
+from asyncio import run
+from time import perf_counter
+from typing import Awaitable
+from typing import Callable
+
+from demo.core.config import core_config
+from demo.core.rate_limit import LocalTokenBuckets
+from demo.core.rate_limit import RateLimiter
+from demo.core.redis_client import close_redis
+from demo.core.redis_client import set_redis
+from fakeredis.aioredis import FakeRedis
+from redis.asyncio import Redis
+
+
+async def us_per_call(
+    a_func: Callable[[int], Awaitable[float]], a_number: int
+) -> float:
+    """
+    Time a_func and convert the result into a per call latency
+    :param a_func: The operation to time. It receives the iteration number.
+    :param a_number: How many times to run it
+    :return: Microseconds per call
+    """
+    l_start: float = perf_counter()
+    for i in range(a_number):
+        await a_func(i)
+    return (perf_counter() - l_start) / a_number * 1e6
+
+
+async def benchmark(a_number: int, a_use_redis: bool) -> None:
+    """
+    Print the per check latency of each rate limiter path
+    :param a_number: How many checks to time per path
+    :param a_use_redis: Whether to use REDIS_URI rather than fakeredis
+    :return: Nothing
+    """
+    if a_use_redis:
+        set_redis(Redis.from_url(str(core_config.REDIS_URI), decode_responses=True))
+        l_redis_label: str = "redis script"
+    else:
+        set_redis(FakeRedis(decode_responses=True))
+        l_redis_label = "fakeredis script"
+
+    # Buckets large enough that every check is allowed, which is the common case
+    l_capacity: int = a_number * 10
+    l_local: LocalTokenBuckets = LocalTokenBuckets(l_capacity, 1.0)
+
+    async def local_take(i: int) -> float:
+        return l_local.take(f"10.0.{i % 256}.1")
+
+    l_limiter: RateLimiter = RateLimiter("benchmark", l_capacity, 60)
+    l_redis_us: float = await us_per_call(
+        lambda i: l_limiter.take(f"10.0.{i % 256}.1"), a_number
+    )
+
+    # Point the limiter at a closed port so it falls back to its per-worker buckets
+    set_redis(Redis(port=1, decode_responses=True))
+    l_fallback: RateLimiter = RateLimiter("benchmark", l_capacity, 60)
+    await l_fallback.take("warm up")
+    l_fallback_us: float = await us_per_call(
+        lambda i: l_fallback.take(f"10.0.{i % 256}.1"), a_number
+    )
+
+    print(f"{'path':<24}{'us/check':>12}")
+    print(f"{'local buckets':<24}{await us_per_call(local_take, a_number):>12.1f}")
+    print(f"{l_redis_label:<24}{l_redis_us:>12.1f}")
+    print(f"{'fallback (Redis down)':<24}{l_fallback_us:>12.1f}")
+    await close_redis()
+
+
+def main() -> None:
+    """
+    Parse the command line and run the benchmark
+    """
+    l_parser = ArgumentParser(description=__doc__)
+    l_parser.add_argument("-n", "--number", type=int, default=5000)
+    l_parser.add_argument("--redis", action="store_true")
+    l_args = l_parser.parse_args()
+    run(benchmark(l_args.number, l_args.redis))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Compare the cost of parsing a user request body when the password is hashed inside a
+Pydantic validator versus the deferred SecretPassword type.
+"""
+from argparse import ArgumentParser
+from timeit import timeit
+from typing import Any
+from typing import Dict
+
+from demo.core.hashing import Hasher
+from demo.schemas import BaseModel
+from demo.schemas import generic_str
+from demo.schemas.users import UserCreateUpdateSchema
+from pydantic import EmailStr
+from pydantic import validator
+
+l_body: Dict[str, Any] = {
+    "username": "benchmark",
+    "password": "correct horse battery staple",
+    "email": "benchmark@example.com",
+}
+
+
+class EagerHashUserSchema(BaseModel):
+    """
+    The previous UserCreateUpdateSchema behavior which hashed while validating
+    """
+
+    username: generic_str
+    password: generic_str
+    email: EmailStr
+
+    _hash_pass = validator("password", allow_reuse=True)(Hasher.get_password_hash)
+
+
+def main() -> None:
+    """
+    Time both schemas and report the per-parse cost and relative speedup
+    """
+    l_parser = ArgumentParser(description=__doc__)
+    l_parser.add_argument("-n", "--number", type=int, default=50)
+    l_args = l_parser.parse_args()
+
+    l_eager: float = timeit(lambda: EagerHashUserSchema(**l_body), number=l_args.number)
+    l_deferred: float = timeit(
+        lambda: UserCreateUpdateSchema(**l_body), number=l_args.number
+    )
+    print(f"{'eager hash parse':<24}{l_eager / l_args.number * 1e6:12.1f} us/parse")
+    print(
+        f"{'SecretPassword parse':<24}{l_deferred / l_args.number * 1e6:12.1f} us/parse"
+    )
+    print(f"{'speedup':<24}{l_eager / l_deferred:12.1f}x")
+
+
+if __name__ == "__main__":
+    main()
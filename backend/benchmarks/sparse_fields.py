@@ -0,0 +1,106 @@
+"""
+Compare full and sparse (fields=) admin user listings: the bytes each user adds to a
+response, the time spent serializing them, and the time Postgres spends reading a page
+with every column versus only the requested ones. Pages are read from the users seeded
+by benchmarks.user_search into <POSTGRES_DB>_search_benchmark.
+"""
+from argparse import ArgumentParser
+from asyncio import run
+from datetime import datetime
+from time import perf_counter
+from typing import FrozenSet
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from benchmarks.user_search import seed
+from demo.api.v1.route_users import user_listing_dict
+from demo.core.config import core_config
+from demo.database import async_database_url
+from demo.database import connect_args
+from demo.database.repository.users import list_users_db
+from sqlalchemy.engine import RowMapping
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import create_async_engine
+from ujson import dumps
+
+# The fieldsets compared; None is the full listing
+FIELDSETS: List[Tuple[str, Optional[FrozenSet[str]]]] = [
+    ("full", None),
+    ("fields=email", frozenset({"email"})),
+    ("fields=id,username", frozenset({"id", "username"})),
+]
+
+
+async def read_pages(
+    a_db: AsyncEngine, a_fields: Optional[FrozenSet[str]], a_pages: int, a_limit: int
+) -> Tuple[float, List[RowMapping]]:
+    """
+    Walk a_pages consecutive pages of the listing
+    :param a_db: The benchmark database's engine
+    :param a_fields: The fields requested, or None for every field
+    :param a_pages: Pages to read
+    :param a_limit: Users per page
+    :return: Milliseconds per page and the rows read
+    """
+    l_after: Optional[Tuple[datetime, int]] = None
+    l_rows: List[RowMapping] = []
+    l_start: float = perf_counter()
+    for _ in range(a_pages):
+        l_page = await list_users_db(a_db, a_limit, l_after, a_fields=a_fields)
+        if not l_page:
+            break
+        l_rows.extend(l_page)
+        l_after = (l_page[-1]["time_created"], l_page[-1]["id"])
+    return (perf_counter() - l_start) * 1000 / a_pages, l_rows
+
+
+async def benchmark(a_users: int, a_pages: int, a_limit: int) -> None:
+    """
+    Print per-user payload size and serialization time and per-page read time
+    :param a_users: Users to seed
+    :param a_pages: Pages to read for each fieldset
+    :param a_limit: Users per page
+    :return: Nothing
+    """
+    l_url: URL = async_database_url(core_config.DATABASE_URI).set(
+        database=f"{core_config.POSTGRES_DB}_search_benchmark"
+    )
+    await seed(l_url, a_users)
+
+    l_db: AsyncEngine = create_async_engine(l_url, connect_args=connect_args())
+    print(f"{a_pages} pages of {a_limit} users")
+    print(f"{'':<20}{'bytes/user':>12}{'us/user':>10}{'ms/page':>10}")
+    try:
+        for l_name, l_fields in FIELDSETS:
+            # Warm the pool and the buffer cache before timing
+            await read_pages(l_db, l_fields, a_pages, a_limit)
+            l_page_ms, l_rows = await read_pages(l_db, l_fields, a_pages, a_limit)
+            l_start: float = perf_counter()
+            l_bytes: int = sum(
+                len(dumps(user_listing_dict(l_row, l_fields))) + 1 for l_row in l_rows
+            )
+            l_us: float = (perf_counter() - l_start) * 1e6 / len(l_rows)
+            print(
+                f"{l_name:<20}{l_bytes / len(l_rows):>12.1f}{l_us:>10.2f}"
+                f"{l_page_ms:>10.2f}"
+            )
+    finally:
+        await l_db.dispose()
+
+
+def main() -> None:
+    """
+    Parse the command line and run the benchmark
+    """
+    l_parser = ArgumentParser(description=__doc__)
+    l_parser.add_argument("-u", "--users", type=int, default=3_000_000)
+    l_parser.add_argument("-p", "--pages", type=int, default=50)
+    l_parser.add_argument("-l", "--limit", type=int, default=1000)
+    l_args = l_parser.parse_args()
+    run(benchmark(l_args.users, l_args.pages, l_args.limit))
+
+
+if __name__ == "__main__":
+    main()
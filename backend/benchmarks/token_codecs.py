@@ -0,0 +1,99 @@
+"""
+Compare JWT encode and decode throughput across the demo.core.tokens backends and
+signing algorithms. The "jose (per call key)" row reproduces the previous behavior of
+handing python-jose the raw SECRET_KEY string on every call.
+"""
+from argparse import ArgumentParser
+from datetime import datetime
+from datetime import timedelta
+from timeit import timeit
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from demo.core.config import core_config
+from demo.core.tokens import JoseCodec
+from demo.core.tokens import KeyRing
+from demo.core.tokens import PyJWTCodec
+from demo.core.tokens import TokenError
+from jose import jwt as jose_jwt
+
+l_algorithms: List[str] = ["HS256", "EdDSA", "ES256"]
+l_claims: Dict[str, Any] = {
+    "sub": "12345",
+    "exp": datetime.utcnow() + timedelta(days=1),
+}
+
+
+def generate_keys(a_algorithm: str) -> Tuple[Any, Any]:
+    """
+    Create throwaway key material for a_algorithm
+    :param a_algorithm: A JWS algorithm name
+    :return: A (signing key, verifying key) tuple
+    """
+    if a_algorithm == "HS256":
+        return core_config.SECRET_KEY.encode(), core_config.SECRET_KEY.encode()
+    if a_algorithm == "ES256":
+        l_private_key = ec.generate_private_key(ec.SECP256R1())
+    else:
+        l_private_key = ed25519.Ed25519PrivateKey.generate()
+    return l_private_key, l_private_key.public_key()
+
+
+def ops_per_second(a_func: Callable[[], Any], a_number: int) -> float:
+    """
+    Time a_func and convert the result into a throughput
+    :param a_func: The operation to time
+    :param a_number: How many times to run it
+    :return: Operations per second
+    """
+    return a_number / timeit(a_func, number=a_number)
+
+
+def main() -> None:
+    """
+    Print an encode/decode throughput table for every backend and algorithm
+    """
+    l_parser = ArgumentParser(description=__doc__)
+    l_parser.add_argument("-n", "--number", type=int, default=5000)
+    l_args = l_parser.parse_args()
+
+    print(f"{'backend':<24}{'algorithm':<10}{'encode/s':>12}{'decode/s':>12}")
+    for l_algorithm in l_algorithms:
+        l_key_ring: KeyRing = KeyRing(l_algorithm, *generate_keys(l_algorithm))
+        for l_codec_class in (PyJWTCodec, JoseCodec):
+            try:
+                l_codec = l_codec_class(l_key_ring)
+                l_token: str = l_codec.encode(l_claims)
+            except TokenError:
+                print(f"{l_codec_class.name:<24}{l_algorithm:<10}{'unsupported':>24}")
+                continue
+            l_encode: float = ops_per_second(
+                lambda: l_codec.encode(l_claims), l_args.number
+            )
+            l_decode: float = ops_per_second(
+                lambda: l_codec.decode(l_token), l_args.number
+            )
+            print(
+                f"{l_codec_class.name:<24}{l_algorithm:<10}"
+                f"{l_encode:>12.0f}{l_decode:>12.0f}"
+            )
+
+    l_token = jose_jwt.encode(l_claims, core_config.SECRET_KEY, algorithm="HS256")
+    l_encode = ops_per_second(
+        lambda: jose_jwt.encode(l_claims, core_config.SECRET_KEY, algorithm="HS256"),
+        l_args.number,
+    )
+    l_decode = ops_per_second(
+        lambda: jose_jwt.decode(l_token, core_config.SECRET_KEY, algorithms=["HS256"]),
+        l_args.number,
+    )
+    print(f"{'jose (per call key)':<24}{'HS256':<10}{l_encode:>12.0f}{l_decode:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
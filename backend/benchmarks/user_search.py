@@ -0,0 +1,177 @@
+"""
+Measure admin user search latency over a few million users. They're seeded into a
+separate <POSTGRES_DB>_search_benchmark database, created on the first run and kept so
+later runs only seed users it's missing. Each search is for a random three to eight
+character piece of a seeded e-mail or username, run by --concurrency clients at once.
+"""
+from argparse import ArgumentParser
+from asyncio import gather
+from asyncio import run
+from math import ceil
+from random import choice
+from random import randint
+from time import perf_counter
+from typing import List
+
+from demo.core.config import core_config
+from demo.database import async_database_url
+from demo.database import Base
+from demo.database import connect_args
+from demo.database.repository.users import search_users_db
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+# Users inserted per statement while seeding
+SEED_BATCH: int = 250_000
+
+# Varied e-mail local parts and usernames so, like real ones, their trigrams differ
+SEED_USERS = text(
+    """
+    INSERT INTO users
+        (email, username, password, is_active, is_superuser, time_created)
+    SELECT left(md5(i::text), 10) || '.' || i || '@' || (ARRAY[
+            'gmail.com', 'yahoo.com', 'outlook.com', 'example.org', 'corp.example.com'
+        ])[1 + i % 5],
+        'user_' || left(md5((i * 7)::text), 8), 'x', i % 10 <> 0, false,
+        timestamp '2020-01-01' + i * interval '1 second'
+    FROM generate_series(CAST(:first AS integer), CAST(:last AS integer)) AS i
+    """
+)
+SAMPLE_USERS = text(
+    "SELECT email, username FROM users TABLESAMPLE SYSTEM (1) LIMIT :count"
+)
+
+
+def percentile(a_sorted: List[float], a_fraction: float) -> float:
+    """
+    :param a_sorted: Measurements in ascending order
+    :param a_fraction: The percentile as a fraction, e.g. 0.99
+    :return: The smallest measurement at least a_fraction of them don't exceed
+    """
+    return a_sorted[max(0, ceil(a_fraction * len(a_sorted)) - 1)]
+
+
+async def seed(a_url: URL, a_users: int) -> None:
+    """
+    Create the benchmark database if necessary and seed it with a_users users
+    :param a_url: The benchmark database's URL
+    :param a_users: How many users it should hold
+    :return: Nothing
+    """
+    l_server: AsyncEngine = create_async_engine(
+        a_url.set(database="postgres"), poolclass=NullPool, isolation_level="AUTOCOMMIT"
+    )
+    try:
+        async with l_server.connect() as l_connection:
+            if not await l_connection.scalar(
+                text("SELECT 1 FROM pg_database WHERE datname = :name"),
+                {"name": a_url.database},
+            ):
+                await l_connection.execute(text(f'CREATE DATABASE "{a_url.database}"'))
+    finally:
+        await l_server.dispose()
+
+    l_db: AsyncEngine = create_async_engine(a_url, poolclass=NullPool)
+    try:
+        async with l_db.begin() as l_connection:
+            await l_connection.run_sync(Base.metadata.create_all)
+            l_count: int = await l_connection.scalar(text("SELECT count(*) FROM users"))
+        if l_count >= a_users:
+            return
+        for l_first in range(l_count + 1, a_users + 1, SEED_BATCH):
+            l_last: int = min(l_first + SEED_BATCH - 1, a_users)
+            print(f"Seeding users {l_first:,} to {l_last:,}")
+            async with l_db.begin() as l_connection:
+                await l_connection.execute(
+                    SEED_USERS, {"first": l_first, "last": l_last}
+                )
+        print("Vacuuming")
+        async with l_db.connect() as l_connection:
+            l_connection = await l_connection.execution_options(
+                isolation_level="AUTOCOMMIT"
+            )
+            await l_connection.execute(text("VACUUM ANALYZE users"))
+    finally:
+        await l_db.dispose()
+
+
+async def benchmark(a_users: int, a_number: int, a_concurrency: int) -> None:
+    """
+    Print search latency percentiles
+    :param a_users: Users to seed
+    :param a_number: Searches to run
+    :param a_concurrency: Searches in flight at once
+    :return: Nothing
+    """
+    l_url: URL = async_database_url(core_config.DATABASE_URI).set(
+        database=f"{core_config.POSTGRES_DB}_search_benchmark"
+    )
+    await seed(l_url, a_users)
+
+    l_db: AsyncEngine = create_async_engine(
+        l_url, pool_size=a_concurrency, max_overflow=0, connect_args=connect_args()
+    )
+    try:
+        async with l_db.connect() as l_connection:
+            l_sample = (await l_connection.execute(SAMPLE_USERS, {"count": 1000})).all()
+        l_terms: List[str] = []
+        for _ in range(a_number):
+            l_value: str = choice(choice(l_sample))
+            l_length: int = randint(3, 8)
+            l_offset: int = randint(0, max(0, len(l_value) - l_length))
+            l_terms.append(l_value[l_offset : l_offset + l_length])
+
+        l_latencies: List[float] = []
+        l_timeouts: int = 0
+
+        async def client(a_terms: List[str]) -> None:
+            nonlocal l_timeouts
+            for l_term in a_terms:
+                l_began: float = perf_counter()
+                try:
+                    await search_users_db(l_db, l_term)
+                except HTTPException:
+                    l_timeouts += 1
+                l_latencies.append((perf_counter() - l_began) * 1000)
+
+        # Warm the pool and the planner's caches before timing
+        await gather(*(client(l_terms[:1]) for _ in range(a_concurrency)))
+        l_latencies.clear()
+        l_timeouts = 0
+        l_start: float = perf_counter()
+        await gather(*(client(l_terms[i::a_concurrency]) for i in range(a_concurrency)))
+        l_seconds: float = perf_counter() - l_start
+    finally:
+        await l_db.dispose()
+
+    l_latencies.sort()
+    print(
+        f"{a_number:,} searches of {a_users:,} users by {a_concurrency} clients, "
+        f"{a_number / l_seconds:,.0f} per second"
+    )
+    print(f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'timeouts':>10}")
+    print(
+        f"{percentile(l_latencies, 0.5):>10.1f}{percentile(l_latencies, 0.95):>10.1f}"
+        f"{percentile(l_latencies, 0.99):>10.1f}{l_latencies[-1]:>10.1f}"
+        f"{l_timeouts:>10}"
+    )
+
+
+def main() -> None:
+    """
+    Parse the command line and run the benchmark
+    """
+    l_parser = ArgumentParser(description=__doc__)
+    l_parser.add_argument("-u", "--users", type=int, default=3_000_000)
+    l_parser.add_argument("-n", "--number", type=int, default=2000)
+    l_parser.add_argument("-c", "--concurrency", type=int, default=1)
+    l_args = l_parser.parse_args()
+    run(benchmark(l_args.users, l_args.number, l_args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 """
 A FastAPI demonstration module
 """
+from demo.database.models.login_events_model import LoginEvent  # noqa: F401
 from demo.database.models.users_model import User  # noqa: F401
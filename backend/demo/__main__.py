@@ -1,4 +1,286 @@
 """
 CLI or script entrypoint
+
+Usage: python -m demo <command> [options]
 """
+from argparse import ArgumentParser
+from argparse import Namespace
+from asyncio import run
+from contextlib import nullcontext
+from pathlib import Path
+from sys import stdout
+from typing import AsyncIterator
+from typing import BinaryIO
+from typing import List
+from typing import Optional
+from typing import TextIO
+
+from demo.core.config import core_config
+from demo.core.config import PasswordHashScheme
+from demo.core.hashing import calibrate_argon2_time_cost
+from demo.core.hashing import calibrate_bcrypt_rounds
+from demo.core.tokens import generate_signing_key_pem
+from demo.database import engine
+from demo.database.repository.user_export import export_users_db
+from demo.database.repository.user_export import ExportFormat
+from demo.database.repository.user_import import ImportFormat
+from demo.database.repository.user_import import import_users_db
 from demo.main import app  # noqa: F401
+from demo.schemas.users import UserImportErrorSchema
+from demo.schemas.users import UserImportReportSchema
+from passlib.hash import argon2
+
+
+def calibrate_hash_command(a_args: Namespace) -> None:
+    """
+    Measure password hash latency on this host and print the .env settings which fit
+    the requested per-login latency budget.
+    :param a_args: The parsed command line arguments
+    :return: Nothing
+    """
+    print(f"Calibrating password hashing for a {a_args.target_ms}ms budget per login")
+
+    l_rounds, l_ms = calibrate_bcrypt_rounds(a_args.target_ms)
+    print(f"bcrypt: {l_rounds} rounds measured at {l_ms:.1f}ms")
+    if l_ms > a_args.target_ms:
+        print(f"WARNING: bcrypt can't meet the budget above {l_rounds} minimum rounds")
+    l_settings: List[str] = [f"BCRYPT_ROUNDS={l_rounds}"]
+
+    if a_args.scheme == PasswordHashScheme.argon2:
+        if not argon2.has_backend():
+            raise SystemExit("argon2 calibration requires argon2-cffi to be installed")
+        l_memory_cost: int = a_args.argon2_memory_mib * 1024
+        l_time_cost, l_ms = calibrate_argon2_time_cost(
+            a_args.target_ms, l_memory_cost, a_args.argon2_parallelism
+        )
+        print(
+            f"argon2: time cost {l_time_cost}, {a_args.argon2_memory_mib}MiB, "
+            f"parallelism {a_args.argon2_parallelism} measured at {l_ms:.1f}ms"
+        )
+        if l_ms > a_args.target_ms:
+            print("WARNING: argon2 can't meet the budget; reduce --argon2-memory-mib")
+        l_settings.extend(
+            [
+                f"ARGON2_TIME_COST={l_time_cost}",
+                f"ARGON2_MEMORY_COST={l_memory_cost}",
+                f"ARGON2_PARALLELISM={a_args.argon2_parallelism}",
+            ]
+        )
+
+    print("\nAdd the following to your .env file:")
+    print(f"PASSWORD_HASH_SCHEME={a_args.scheme.value}")
+    print(f"PASSWORD_HASH_TARGET_MS={a_args.target_ms}")
+    for l_setting in l_settings:
+        print(l_setting)
+
+
+def generate_signing_key_command(a_args: Namespace) -> None:
+    """
+    Write a new JWT signing key pair for use with JWT_PRIVATE_KEY_FILE.
+
+    To rotate keys, add the current public key to JWT_PUBLIC_KEY_FILES and point
+    JWT_PRIVATE_KEY_FILE at the new private key. Remove the old public key once every
+    token it signed has expired.
+    :param a_args: The parsed command line arguments
+    :return: Nothing
+    """
+    l_private_pem, l_public_pem = generate_signing_key_pem(a_args.algorithm)
+    l_private_path: Path = a_args.output
+    l_public_path: Path = l_private_path.with_suffix(".pub.pem")
+    l_private_path.touch(mode=0o600, exist_ok=False)
+    l_private_path.write_bytes(l_private_pem)
+    l_public_path.write_bytes(l_public_pem)
+    print(f"Wrote {l_private_path} and {l_public_path}")
+    print("\nAdd the following to your .env file:")
+    print(f"HASH_ALGORITHM={a_args.algorithm}")
+    if a_args.algorithm == "EdDSA":
+        # python-jose, the default TOKEN_BACKEND for other algorithms, can't use EdDSA
+        print("TOKEN_BACKEND=pyjwt")
+    print(f"JWT_PRIVATE_KEY_FILE={l_private_path}")
+
+
+async def read_lines(a_file: TextIO) -> AsyncIterator[str]:
+    """
+    :param a_file: An open text file
+    :return: Each line without its line ending
+    """
+    for l_line in a_file:
+        yield l_line.rstrip("\r\n")
+
+
+async def import_users(a_args: Namespace, a_errors: TextIO) -> UserImportReportSchema:
+    """
+    Run a bulk import then release the engine's connections
+    :param a_args: The parsed command line arguments
+    :param a_errors: Where each rejected row is written as a line of JSON
+    :return: The import's report
+    """
+
+    def write_error(a_error: UserImportErrorSchema) -> None:
+        a_errors.write(a_error.json() + "\n")
+
+    try:
+        with a_args.input.open(newline="", encoding="utf-8-sig") as l_input:
+            return await import_users_db(
+                engine,
+                read_lines(l_input),
+                a_args.format,
+                write_error,
+                a_batch_size=a_args.batch_size,
+                a_hash_workers=a_args.hash_workers,
+            )
+    finally:
+        await engine.dispose()
+
+
+def import_users_command(a_args: Namespace) -> None:
+    """
+    Create users from a CSV or NDJSON file. Rows which are invalid or whose e-mail is
+    already in use are written to the error file.
+    :param a_args: The parsed command line arguments
+    :return: Nothing
+    """
+    if a_args.format is None:
+        a_args.format = (
+            ImportFormat.csv
+            if a_args.input.suffix.lower() == ".csv"
+            else ImportFormat.ndjson
+        )
+    l_errors_path: Path = a_args.errors or a_args.input.with_suffix(".errors.ndjson")
+    with l_errors_path.open("w") as l_errors:
+        try:
+            l_report: UserImportReportSchema = run(import_users(a_args, l_errors))
+        except ValueError as e:
+            raise SystemExit(f"Import failed: {e}")
+    print(
+        f"Imported {l_report.rows_imported} of {l_report.rows_read} rows in "
+        f"{l_report.seconds:.1f}s ({l_report.rows_per_second:.0f} rows/s)"
+    )
+    if l_report.rows_rejected:
+        print(f"{l_report.rows_rejected} rejected rows were written to {l_errors_path}")
+
+
+async def export_users(a_args: Namespace, a_output: BinaryIO) -> int:
+    """
+    Run a bulk export then release the engine's connections
+    :param a_args: The parsed command line arguments
+    :param a_output: Where the export is written
+    :return: The number of bytes written
+    """
+    l_bytes: int = 0
+    try:
+        async for l_chunk in export_users_db(engine, a_args.format, a_args.gzip):
+            a_output.write(l_chunk)
+            l_bytes += len(l_chunk)
+    finally:
+        await engine.dispose()
+    return l_bytes
+
+
+def export_users_command(a_args: Namespace) -> None:
+    """
+    Write every user, less their password hash, to a file or standard output
+    :param a_args: The parsed command line arguments
+    :return: Nothing
+    """
+    if a_args.output is not None and a_args.output.suffix == ".gz":
+        a_args.gzip = True
+    with (
+        a_args.output.open("wb")
+        if a_args.output is not None
+        else nullcontext(stdout.buffer)
+    ) as l_output:
+        l_bytes: int = run(export_users(a_args, l_output))
+    if a_args.output is not None:
+        print(f"Wrote {l_bytes} bytes to {a_args.output}")
+
+
+def get_parser() -> ArgumentParser:
+    """
+    Build the command line parser with one sub-command per administrative task
+    :return: An ArgumentParser
+    """
+    l_parser = ArgumentParser(prog="python -m demo", description=__doc__)
+    l_commands = l_parser.add_subparsers(dest="command", required=True)
+
+    l_calibrate = l_commands.add_parser(
+        "calibrate-hash",
+        help="Choose password hash costs which meet a per-login latency budget",
+    )
+    l_calibrate.add_argument(
+        "--target-ms", type=int, default=core_config.PASSWORD_HASH_TARGET_MS
+    )
+    l_calibrate.add_argument(
+        "--scheme",
+        type=PasswordHashScheme,
+        default=core_config.PASSWORD_HASH_SCHEME,
+    )
+    l_calibrate.add_argument("--argon2-memory-mib", type=int, default=64)
+    l_calibrate.add_argument(
+        "--argon2-parallelism", type=int, default=core_config.ARGON2_PARALLELISM
+    )
+    l_calibrate.set_defaults(func=calibrate_hash_command)
+
+    l_keygen = l_commands.add_parser(
+        "generate-signing-key", help="Create a key pair for asymmetric JWT signing"
+    )
+    l_keygen.add_argument(
+        "--algorithm",
+        default="EdDSA",
+        choices=["EdDSA", "ES256", "ES384", "ES512", "RS256", "RS384", "RS512"],
+    )
+    l_keygen.add_argument("--output", type=Path, required=True)
+    l_keygen.set_defaults(func=generate_signing_key_command)
+
+    l_import = l_commands.add_parser(
+        "import-users", help="Create users in bulk from a CSV or NDJSON file"
+    )
+    l_import.add_argument("input", type=Path)
+    l_import.add_argument(
+        "--format",
+        type=ImportFormat,
+        default=None,
+        help="Defaults to csv for .csv files and ndjson otherwise",
+    )
+    l_import.add_argument(
+        "--errors",
+        type=Path,
+        default=None,
+        help="Where to write rejected rows. Defaults to <input>.errors.ndjson",
+    )
+    l_import.add_argument(
+        "--batch-size", type=int, default=core_config.BULK_IMPORT_BATCH_SIZE
+    )
+    l_import.add_argument(
+        "--hash-workers", type=int, default=core_config.BULK_IMPORT_HASH_WORKERS
+    )
+    l_import.set_defaults(func=import_users_command)
+
+    l_export = l_commands.add_parser(
+        "export-users", help="Write every user, less password hashes, to a file"
+    )
+    l_export.add_argument("--format", type=ExportFormat, default=ExportFormat.csv)
+    l_export.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help="Defaults to standard output. Files ending in .gz are gzipped.",
+    )
+    l_export.add_argument("--gzip", action="store_true")
+    l_export.set_defaults(func=export_users_command)
+
+    return l_parser
+
+
+def main(a_argv: Optional[List[str]] = None) -> None:
+    """
+    Parse the command line and run the requested command
+    :param a_argv: Optional argument list; sys.argv is used if not provided
+    :return: Nothing
+    """
+    l_args: Namespace = get_parser().parse_args(a_argv)
+    l_args.func(l_args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Well-known discovery routes which live outside of the versioned API
+"""
+from hashlib import sha256
+from json import dumps
+
+from demo.core.config import core_config
+from demo.core.tokens import token_codec
+from fastapi import APIRouter
+from fastapi import Request
+from fastapi import Response
+from fastapi import status
+
+router = APIRouter()
+
+# The key set only changes when the service restarts with new keys so the response
+# body and its validators are rendered once.
+jwks_body: bytes = dumps(token_codec.key_ring.jwks, separators=(",", ":")).encode()
+jwks_headers = {
+    "Cache-Control": f"public, max-age={core_config.JWKS_MAX_AGE_SECONDS}",
+    "ETag": f'"{sha256(jwks_body).hexdigest()}"',
+}
+
+
+@router.get("/.well-known/jwks.json", response_class=Response)
+async def get_jwks(request: Request) -> Response:
+    """Publish the public keys which verify access tokens as a JSON Web Key Set.
+
+    Args:
+        request (Request): The HTTP request, checked for a matching If-None-Match
+
+    Returns:
+        Response: The JWKS and 200, or an empty 304 if the client's copy is current
+    """
+    if request.headers.get("If-None-Match") == jwks_headers["ETag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=jwks_headers)
+    return Response(
+        content=jwks_body, media_type="application/json", headers=jwks_headers
+    )
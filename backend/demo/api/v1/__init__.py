@@ -9,4 +9,7 @@ api_router_v1 = APIRouter(prefix="/v1")
 
 # Demo v1 REST Endpoints
 api_router_v1.include_router(route_users.router, prefix="/users", tags=["User"])
+api_router_v1.include_router(
+    route_users.router_admin, prefix="/admin/users", tags=["Admin"]
+)
 api_router_v1.include_router(route_login.router, prefix="/login", tags=["Login"])
@@ -2,29 +2,41 @@
 Login routes and JWT logic
 """
 from datetime import timedelta
+from functools import partial
 from typing import Any
 from typing import Dict
 from typing import Optional
+from typing import Tuple
 
+from demo.core.cache import user_cache
 from demo.core.config import core_config
 from demo.core.config import core_logger as logger
+from demo.core.principal import Principal
+from demo.core.rate_limit import client_ip_rate_limited_route
+from demo.core.rate_limit import login_ip_rate_limiter
+from demo.core.rate_limit import login_username_rate_limiter
+from demo.core.refresh_tokens import refresh_token_store
+from demo.core.revocation import revocation_list
 from demo.core.security import create_access_token
 from demo.core.security import OAuth2PasswordBearerWithCookie
+from demo.core.token_cache import verified_token_cache
+from demo.core.tokens import token_codec
+from demo.core.tokens import TokenError
+from demo.database import get_async_db
+from demo.database.login_recorder import login_recorder
+from demo.database.repository.users import authenticate_user_db
+from demo.database.repository.users import get_user_by_id_db
 from demo.schemas.users import UserSchema
 from fastapi import APIRouter
+from fastapi import BackgroundTasks
 from fastapi import Depends
+from fastapi import Form
 from fastapi import HTTPException
+from fastapi import Request
 from fastapi import Response
 from fastapi import status
 from fastapi.security import OAuth2PasswordRequestForm
-from jose import jwt
-from jose import JWTError
-
-# from demo.database import get_db
-# from demo.database.repository.users import authenticate_user_db
-# from demo.database.repository.users import get_user_by_id_db
-
-# from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncEngine
 
 router = APIRouter()
 
@@ -39,81 +51,143 @@ credentials_exception = HTTPException(
 )
 
 
-@router.post("/token")
-def login_for_access_token(
+async def login_for_access_token(
+    request: Request,
     response: Response,
+    background_tasks: BackgroundTasks,
     form_data: OAuth2PasswordRequestForm = Depends(),
-    # db: Session = Depends(get_db),
+    db: AsyncEngine = Depends(get_async_db),
 ) -> Dict[str, str]:
     """
     Route for receiving a login/pass from the client and returning a JWT if the
     credentials correspond to an existing l_user.
+    :param request: The incoming request
     :param response: An HTTP response object
+    :param background_tasks: Work to run after the response is sent
     :param form_data: The provided Oauth2 form data
-    # :param db: A SQLAlchemy database Session
+    :param db: The engine whose pool the worker shares
     :return: An new access_token for the l_user
     """
     logger.info(f"login attempt for: {form_data.username}")
+    # The per IP limit was already applied by the route class before the form was read
+    await login_username_rate_limiter.check(form_data.username.strip().lower())
 
-    # TODO: Move away from a trivial login JWT data payload
-    l_user: UserSchema = UserSchema(
-        id=5,
-        username=form_data.username,
-        email="todo@github.com",
-        is_active=False,
-        is_superuser=False,
+    l_user: Optional[UserSchema] = await authenticate_user_db(
+        form_data.username, form_data.password, db, background_tasks
     )
-    # l_user: UserSchema = authenticate_user_db(
-    #     form_data.username, form_data.password, db
-    # )
+    if l_user is None:
+        logger.debug(f"Invalid credentials provided for {form_data.username}")
+        raise credentials_exception
+
+    if not l_user.is_active:
+        logger.debug(f"{form_data.username} account is deactivated.")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User account is disabled. Please contact an administrator.",
+        )
+
+    # Buffered and written in a batch later so the login doesn't wait on the database
+    login_recorder.record(l_user.id, request.client.host if request.client else None)
+
+    l_return: Dict[str, str] = issue_access_token(response, str(l_user.id))
+    # Later access tokens are minted from the refresh token without a password check
+    l_refresh_token: Optional[str] = await refresh_token_store.issue(str(l_user.id))
+    if l_refresh_token is not None:
+        l_return["refresh_token"] = l_refresh_token
+    logger.debug(f"Generated tokens for l_user {l_user.email}")
+    return l_return
+
+
+# Registered explicitly so the per IP rate limit runs before the form is parsed
+router.add_api_route(
+    "/token",
+    login_for_access_token,
+    methods=["POST"],
+    route_class_override=client_ip_rate_limited_route(login_ip_rate_limiter),
+)
+
+
+@router.post("/refresh")
+async def refresh_access_token(
+    response: Response,
+    grant_type: str = Form(..., regex="^refresh_token$"),
+    refresh_token: str = Form(...),
+) -> Dict[str, str]:
+    """
+    Route for exchanging a refresh token for a new access token and a replacement
+    refresh token. No password hash is involved, so this is far cheaper than a login.
+    :param response: An HTTP response object
+    :param grant_type: The OAuth2 grant type which must be 'refresh_token'
+    :param refresh_token: A refresh token from a login or earlier refresh
+    :return: A new access_token and refresh_token for the user
+    """
+    try:
+        l_subject, l_refresh_token = await refresh_token_store.rotate(refresh_token)
+    except TokenError as e:
+        logger.debug(f"Refresh token rejected: {e}")
+        raise credentials_exception
+
+    l_return: Dict[str, str] = issue_access_token(response, l_subject)
+    l_return["refresh_token"] = l_refresh_token
+    return l_return
 
-    # if not l_user.is_active:
-    #     logger.debug(f"{form_data.username} account is deactivated.")
-    #     raise HTTPException(
-    #         status_code=status.HTTP_401_UNAUTHORIZED,
-    #         detail="User account is disabled. Please contact an administrator.",
-    #     )
 
+def issue_access_token(a_response: Response, a_subject: str) -> Dict[str, str]:
+    """
+    Create an access token and set it as the access_token cookie
+    :param a_response: The HTTP response which will carry the cookie
+    :param a_subject: The 'sub' claim identifying the user
+    :return: The OAuth2 token response body
+    """
     access_token_expire = timedelta(minutes=core_config.ACCESS_TOKEN_EXPIRE_MINUTES)
     # What is placed in the data dict is what will be present in decoded JWTs
     access_token = create_access_token(
-        data={"sub": str(l_user.id)}, expires_delta=access_token_expire
+        data={"sub": a_subject}, expires_delta=access_token_expire
     )
     # This cookie is what will be expected to be provided by clients in the future when
     # attempting to access 'protected' routes.
-    response.set_cookie(
+    a_response.set_cookie(
         key="access_token", value=f"Bearer {access_token}", httponly=True
     )
-
-    l_return: Dict[str, str] = {"access_token": access_token, "token_type": "bearer"}
-    logger.debug(f"Generated token for l_user {l_user.email}: {l_return}")
-    return l_return
+    return {"access_token": access_token, "token_type": "bearer"}
 
 
-def get_current_user_from_token(
-    token: str = Depends(oauth2_scheme),
-    # db: Session = Depends(get_db),
-) -> UserSchema:
+def decode_token_claims(a_token: str) -> Dict[str, Any]:
     """
-    Function to take a provided JWT and attempt to retrieve user information
-    :param token: A JWT passed in from a REST endpoint
-    # :param db: A SQLAlchemy database session
-    :return: User information if valid; HTTP exception otherwise
+    Verify a JWT and return its claims
+    :param a_token: A JWT passed in from a REST endpoint
+    :return: The decoded claims; HTTP exception if the token isn't valid
     """
-    # Ensure the JWT may be properly decoded and contains the expected 'sub' field
     try:
-        payload = jwt.decode(
-            token, core_config.SECRET_KEY, algorithms=[core_config.HASH_ALGORITHM]
-        )
-        l_sub: Optional[Any] = payload.get("sub")
-        if l_sub is None:
-            logger.debug("JWT token did not contain a 'sub' field")
-            raise credentials_exception
-        else:
-            logger.debug(f"JWT successfully decoded 'sub' field containing: {l_sub}")
-    except JWTError:
+        return token_codec.decode(a_token)
+    except TokenError:
         logger.debug("JWT is not a valid format")
         raise credentials_exception
+
+
+def verified_claims(a_token: str) -> Tuple[int, Optional[str]]:
+    """
+    Verify a JWT, or find it in verified_token_cache, and return the claims which
+    identify its user. Only claims are cached, never details of the user, which can
+    change while the token is still valid.
+    :param a_token: A JWT passed in from a REST endpoint
+    :return: The user ID from the 'sub' claim and the 'jti' claim, if any; HTTP
+    exception if the token isn't valid
+    """
+    l_cached_claims: Optional[Tuple[int, Optional[str]]] = verified_token_cache.get(
+        a_token
+    )
+    if l_cached_claims is not None:
+        return l_cached_claims
+
+    # Ensure the JWT may be properly decoded and contains the expected 'sub' field
+    payload: Dict[str, Any] = decode_token_claims(a_token)
+    l_sub: Optional[Any] = payload.get("sub")
+    if l_sub is None:
+        logger.debug("JWT token did not contain a 'sub' field")
+        raise credentials_exception
+    else:
+        logger.debug(f"JWT successfully decoded 'sub' field containing: {l_sub}")
     # Ensure the 'sub' field in the JWT is a valid integer
     try:
         l_user_id: int = int(l_sub)
@@ -121,28 +195,106 @@ def get_current_user_from_token(
         logger.debug("JWT 'sub' field didn't contain an integer user ID")
         raise credentials_exception
 
-    # TODO: Move towards a database enabled user login. Return trivial response for now
-    l_user: UserSchema = UserSchema(
-        id=l_user_id,
-        username="todo",
-        email="todo@github.com",
-        is_active=False,
-        is_superuser=False,
-    )
-    return l_user
+    l_claims: Tuple[int, Optional[str]] = (l_user_id, payload.get("jti"))
+    l_exp: Optional[Any] = payload.get("exp")
+    if isinstance(l_exp, (int, float)):
+        verified_token_cache.put(a_token, l_claims, float(l_exp))
+    return l_claims
+
+
+async def get_current_user_from_token(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncEngine = Depends(get_async_db),
+) -> Principal:
+    """
+    Function to take a provided JWT and attempt to retrieve user information.
+
+    Tokens which were already verified by this worker are served from
+    verified_token_cache, skipping the decode and signature check. Every token, cached
+    or not, is checked against the revocation_list, and its user is read through the
+    user_cache, whose invalidations reach every worker, so changes such as
+    deactivating a user apply to tokens which are already cached.
+    :param token: A JWT passed in from a REST endpoint
+    :param db: The engine whose pool the worker shares
+    :return: The Principal the token represents if valid; HTTP exception otherwise
+    """
+    l_user_id, l_jti = verified_claims(token)
+    if await revocation_list.is_revoked(l_jti):
+        logger.debug("Revoked JWT presented")
+        verified_token_cache.evict(token)
+        raise credentials_exception
 
     # Verify that the provided ID corresponds to a user and that the user is active.
-    # try:
-    #     l_user: UserSchema = get_user_by_id_db(a_id=l_user_id, a_db=db)
-    #     if not l_user.is_active:
-    #         logger.debug(f"Disabled user attempted to connect: {l_user.email}")
-    #
-    #     logger.debug(f"Successfully authenticated {l_user.email}")
-    #     return l_user
-    # except HTTPException:
-    #     # Interrupt the default exception (which provides too much info) with a more
-    #     # generic response.
-    #     raise HTTPException(
-    #         status_code=status.HTTP_404_NOT_FOUND,
-    #         detail="Credentials are no longer associated with an existing user.",
-    #     )
+    # Records are cached for every worker so they're read from the primary; a lagging
+    # replica could put back a record which was just invalidated.
+    l_record: Optional[UserSchema] = await user_cache.get(
+        l_user_id, partial(get_user_by_id_db, l_user_id, db)
+    )
+    if l_record is None:
+        # Use a generic response which doesn't reveal more than necessary
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Credentials are no longer associated with an existing user.",
+        )
+    if not l_record.is_active:
+        logger.debug(f"Disabled user attempted to connect: {l_record.email}")
+        raise credentials_exception
+
+    return Principal(
+        a_id=l_record.id,
+        a_username=l_record.username,
+        a_email=l_record.email,
+        a_is_active=l_record.is_active,
+        a_is_superuser=l_record.is_superuser,
+        a_version=l_record.version,
+        a_jti=l_jti,
+    )
+
+
+async def get_current_admin_from_token(
+    current_user: Principal = Depends(get_current_user_from_token),
+) -> Principal:
+    """
+    Require the authenticated user to be an administrator
+    :param current_user: The user the presented JWT represents
+    :return: The Principal if it's a superuser; HTTP 403 exception otherwise
+    """
+    if not current_user.is_superuser:
+        logger.debug(f"Non-admin user {current_user.id} requested an admin route")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Administrator privileges are required.",
+        )
+    return current_user
+
+
+@router.post("/revoke")
+async def revoke_access_token(
+    response: Response,
+    token: str = Depends(oauth2_scheme),
+    current_user: Principal = Depends(get_current_user_from_token),
+    refresh_token: Optional[str] = Form(None),
+) -> Dict[str, str]:
+    """
+    Route for a client to revoke the access token it presents, e.g. when logging out.
+    The token is rejected by every worker from then on, even before it expires.
+    :param response: An HTTP response object
+    :param token: The JWT to revoke
+    :param current_user: The user the JWT represents
+    :param refresh_token: Optionally, a refresh token whose token family to revoke
+    :return: A confirmation message
+    """
+    payload: Dict[str, Any] = decode_token_claims(token)
+    l_jti: Optional[str] = payload.get("jti")
+    l_exp: Optional[Any] = payload.get("exp")
+    if l_jti is None or not isinstance(l_exp, (int, float)):
+        logger.debug("JWT without 'jti' or 'exp' claims can't be revoked")
+        raise credentials_exception
+
+    await revocation_list.revoke(l_jti, float(l_exp))
+    if refresh_token is not None:
+        await refresh_token_store.revoke(refresh_token)
+    verified_token_cache.evict(token)
+    response.delete_cookie(key="access_token")
+    logger.info(f"Revoked an access token for user {current_user.id}")
+    return {"detail": "Access token revoked"}
@@ -1,82 +1,648 @@
 """
 CRUD routes for Users
 """
+import re
+from datetime import datetime
+from enum import Enum
+from functools import partial
+from typing import Any
+from typing import AsyncIterator
+from typing import Callable
+from typing import Dict
+from typing import FrozenSet
+from typing import List
+from typing import Mapping
+from typing import Optional
+from typing import Tuple
+
+from demo.api.v1.route_login import get_current_admin_from_token
 from demo.api.v1.route_login import get_current_user_from_token
+from demo.core.cache import user_cache
+from demo.core.config import core_config
 from demo.core.config import core_logger as logger
+from demo.core.pagination import decode_cursor
+from demo.core.pagination import encode_cursor
+from demo.core.principal import Principal
+from demo.core.token_cache import verified_token_cache
+from demo.database import get_async_db
+from demo.database.replicas import replica_router
+from demo.database.repository.user_export import export_users_db
+from demo.database.repository.user_export import ExportFormat
+from demo.database.repository.user_import import ImportFormat
+from demo.database.repository.user_import import import_users_db
+from demo.database.repository.user_import import iter_lines
+from demo.database.repository.users import create_user_db
+from demo.database.repository.users import get_users_by_emails_db
+from demo.database.repository.users import get_users_by_ids_db
+from demo.database.repository.users import list_users_db
+from demo.database.repository.users import search_users_db
+from demo.database.repository.users import update_user_db
+from demo.database.repository.users import version_conflict_exception
+from demo.schemas import BaseModel
+from demo.schemas import parse_fields
+from demo.schemas import with_fields
+from demo.schemas.users import UserBatchRequestSchema
+from demo.schemas.users import UserBatchSchema
 from demo.schemas.users import UserCreateUpdateSchema
+from demo.schemas.users import UserImportErrorSchema
+from demo.schemas.users import UserImportReportSchema
 from demo.schemas.users import UserSchema
+from demo.schemas.users import UserSearchResultSchema
+from demo.schemas.users import UserSearchSchema
 from fastapi import APIRouter
 from fastapi import Depends
+from fastapi import Header
+from fastapi import HTTPException
+from fastapi import Query
+from fastapi import Request
+from fastapi import Response
 from fastapi import status
-
-# from demo.api.v1.route_login import get_current_admin_from_token
-# from demo.api.v1.route_login import get_current_user_from_token
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncEngine
+from ujson import dumps
 
 router = APIRouter()
 router_admin = APIRouter()
 
 
+user_not_found_exception = HTTPException(
+    status_code=status.HTTP_404_NOT_FOUND,
+    detail="Credentials are no longer associated with an existing user.",
+)
+
+# Request Content-Types accepted by the bulk import and the format each one implies
+import_content_types: Dict[str, ImportFormat] = {
+    "text/csv": ImportFormat.csv,
+    "application/x-ndjson": ImportFormat.ndjson,
+}
+# Response Content-Types of uncompressed bulk exports
+export_media_types: Dict[ExportFormat, str] = {
+    ExportFormat.csv: "text/csv",
+    ExportFormat.ndjson: "application/x-ndjson",
+}
+
+# Fields each read route's fields= parameter may name, in the order they're returned
+user_fields: Tuple[str, ...] = tuple(UserSchema.__fields__)
+user_listing_fields: Tuple[str, ...] = (*user_fields, "time_created")
+user_search_fields: Tuple[str, ...] = tuple(UserSearchResultSchema.__fields__)
+
+
+def fields_query(
+    a_allowed: Tuple[str, ...]
+) -> Callable[[Optional[str]], Optional[FrozenSet[str]]]:
+    """
+    Create a dependency for a fields= query parameter which limits a read route's
+    response to some of a_allowed, e.g. ?fields=id,email
+    :param a_allowed: The field names which may be requested
+    :return: The dependency, which provides the requested field names, or None for
+    every field
+    """
+
+    def fields_dependency(
+        fields: Optional[str] = Query(
+            None,
+            max_length=256,
+            description=f"Comma separated fields to return from: {', '.join(a_allowed)}",
+        )
+    ) -> Optional[FrozenSet[str]]:
+        return parse_fields(fields, a_allowed) if fields is not None else None
+
+    return fields_dependency
+
+
+def fields_response(
+    a_model: BaseModel,
+    a_fields: Optional[FrozenSet[str]],
+    a_headers: Optional[Mapping[str, str]] = None,
+) -> Any:
+    """
+    Return a read route's response, trimmed by with_fields() if a_fields is provided.
+    FastAPI validates returned models against a copy of the route's response_model,
+    which would reject one with fields missing, so a trimmed model is serialized here
+    instead, with only the fields set on it and on the models nested in it.
+    :param a_model: The route's response
+    :param a_fields: The fields requested with fields=; None for every field
+    :param a_headers: Headers the route set on its Response parameter, which aren't
+    added to a Response it returns itself
+    :return: a_model if a_fields is None; otherwise a serialized Response
+    """
+    if a_fields is None:
+        return a_model
+    return Response(
+        a_model.json(exclude_unset=True),
+        media_type="application/json",
+        headers=a_headers,
+    )
+
+
+# A strong ETag from user_etag(). Only ASCII digits, which int() always accepts, match.
+etag_pattern: re.Pattern = re.compile(r'"(\d+)"', re.ASCII)
+
+
+def user_etag(a_version: int) -> str:
+    """
+    :param a_version: A user's version
+    :return: The ETag of the user's record at that version
+    """
+    return f'"{a_version}"'
+
+
+def if_match_version(a_if_match: Optional[str]) -> Optional[int]:
+    """
+    Parse an If-Match header sent with an update
+    :param a_if_match: The header's value, if sent
+    :return: The version the client last read; None to update unconditionally;
+    HTTP 412 exception if the header can't match any version
+    """
+    if a_if_match is None or a_if_match.strip() == "*":
+        return None
+    l_match: Optional[re.Match] = etag_pattern.fullmatch(a_if_match.strip())
+    if l_match is None:
+        raise version_conflict_exception
+    return int(l_match[1])
+
+
+class UserListFormat(str, Enum):
+    """
+    Explicit enumerated class for the response bodies the admin user listing can
+    stream.
+    """
+
+    # {"users": [...], "next_cursor": ...}
+    json = "json"
+    # One user per line, each with the cursor to resume after it
+    ndjson = "ndjson"
+
+
 @router.post("/create", response_model=UserSchema, status_code=status.HTTP_201_CREATED)
-def create_user_route(a_user: UserCreateUpdateSchema):
+async def create_user_route(
+    a_user: UserCreateUpdateSchema, db: AsyncEngine = Depends(get_async_db)
+):
     """Attempt to create a new user record in the database.
 
     Args:
         a_user (UserCreateUpdateSchema): The requested new user details
+        db (AsyncEngine): The engine whose pool the worker shares
 
     Returns:
         UserSchema: A populated ShowUser schema and 201 on success; HTTPException on
         conflict or error
     """
-    logger.info(f"The hashed password is: {a_user.password}")
-    l_return: UserSchema = UserSchema(
-        id=1,
-        is_active=False,
-        is_superuser=False,
-        **a_user.dict(),
-    )
-    return l_return
+    return await create_user_db(a_user, db)
 
 
 @router.put("/update", response_model=UserSchema, status_code=status.HTTP_202_ACCEPTED)
-def update_user_route(
+async def update_user_route(
     a_user: UserCreateUpdateSchema,
-    a_current_user: UserSchema = Depends(get_current_user_from_token),
+    response: Response,
+    if_match: Optional[str] = Header(None, max_length=64),
+    a_current_user: Principal = Depends(get_current_user_from_token),
+    db: AsyncEngine = Depends(get_async_db),
 ):
     """Attempt to update a user record in the database.
 
     Args:
         a_user (UserUpdateSchema): The requested new user details
+        response (Response): Carries the updated record's ETag
+        if_match (str): If sent, the ETag from when the client read the record. The
+        update is only made if nobody else has updated the record since.
         a_current_user: The currently authenticated user persona
+        db (AsyncEngine): The engine whose pool the worker shares
 
     Returns:
         UserSchema: A populated UserSchema and 201 on success; HTTPException on
-        conflict or error.
+        conflict, a stale If-Match or error.
     """
-    logger.debug(
-        f"User ID {a_current_user.id} is updating their account info to "
-        f"{a_user.dict()}"
+    logger.debug(f"User ID {a_current_user.id} is updating their account info")
+    l_user: Optional[UserSchema] = await update_user_db(
+        a_current_user.id, a_user, db, if_match_version(if_match)
     )
-    l_return: UserSchema = UserSchema(
-        id=1,
-        is_active=False,
-        is_superuser=False,
-        **a_user.dict(),
-    )
-    return l_return
+    if l_user is None:
+        raise user_not_found_exception
+    # Every worker re-reads the updated details the next time any of the user's tokens
+    # is presented
+    await user_cache.invalidate(a_current_user.id)
+    await replica_router.record_write(a_current_user.id)
+    response.headers["ETag"] = user_etag(l_user.version)
+    return l_user
 
 
 @router.get("/get", response_model=UserSchema, status_code=status.HTTP_200_OK)
-def get_my_info(
-    a_current_user: UserSchema = Depends(get_current_user_from_token),
+async def get_my_info(
+    response: Response,
+    a_current_user: Principal = Depends(get_current_user_from_token),
+    fields: Optional[FrozenSet[str]] = Depends(fields_query(user_fields)),
 ):
     """Attempt to get the logged in user record from the database.
 
     Args:
-        a_current_user (UserModel): The user currently logged in making this request
-        # db (Session): Database session dependency injection.
+        response (Response): Carries the record's ETag, to send back as If-Match when
+        updating it
+        a_current_user (Principal): The user currently logged in making this request.
+        It was read through the user cache when its token was presented.
+        fields (FrozenSet[str]): If provided, only these fields are returned
 
     Returns:
         UserSchema: A populated UserSchema and 200 on success; HTTPException on
         conflict or error.
     """
-    return a_current_user
+    response.headers["ETag"] = user_etag(a_current_user.version)
+    return fields_response(
+        with_fields(a_current_user.to_schema(), fields), fields, response.headers
+    )
+
+
+@router.post("/batch", response_model=UserBatchSchema, status_code=status.HTTP_200_OK)
+async def get_users_batch_route(
+    a_request: UserBatchRequestSchema,
+    a_current_user: Principal = Depends(get_current_admin_from_token),
+    fields: Optional[FrozenSet[str]] = Depends(fields_query(user_fields)),
+    db: AsyncEngine = Depends(get_async_db),
+):
+    """Look up many users at once, e.g. for a service resolving user IDs to profiles.
+    IDs are read through the user cache and those it misses with a single query, as
+    are e-mail addresses, so the batch costs at most two queries whatever its size.
+    Cache misses are read from the primary since what's read is cached for every
+    worker. E-mail addresses, which aren't cached, are read from a replica.
+
+    Args:
+        a_request (UserBatchRequestSchema): The IDs and e-mail addresses to look up
+        a_current_user (Principal): The administrator making the request
+        fields (FrozenSet[str]): If provided, only these fields of each user are
+        returned
+        db (AsyncEngine): The engine whose pool the worker shares
+
+    Returns:
+        UserBatchSchema: The users found, in request order, with null for any ID or
+        e-mail address without a user
+    """
+    l_by_id: Dict[int, UserSchema] = (
+        await user_cache.get_many(a_request.ids, partial(get_users_by_ids_db, a_db=db))
+        if a_request.ids
+        else {}
+    )
+    l_by_email: Dict[str, UserSchema] = (
+        await get_users_by_emails_db(
+            a_request.emails, replica_router.reader(db, a_current_user.id)
+        )
+        if a_request.emails
+        else {}
+    )
+    logger.debug(
+        f"User ID {a_current_user.id} looked up {len(a_request.ids)} IDs and "
+        f"{len(a_request.emails)} e-mail addresses"
+    )
+    l_batch: UserBatchSchema = UserBatchSchema.construct(
+        ids=[
+            with_fields(l_by_id[l_id], fields) if l_id in l_by_id else None
+            for l_id in a_request.ids
+        ],
+        emails=[
+            with_fields(l_by_email[l_email.lower()], fields)
+            if l_email.lower() in l_by_email
+            else None
+            for l_email in a_request.emails
+        ],
+    )
+    return fields_response(l_batch, fields)
+
+
+def user_listing_dict(
+    a_row: Mapping[str, Any], a_fields: Optional[FrozenSet[str]] = None
+) -> Dict[str, Any]:
+    """
+    Convert a row from list_users_db into its JSON representation
+    :param a_row: A row from list_users_db
+    :param a_fields: If provided, only these of the user_listing_fields are included
+    :return: A dict ready for serializing
+    """
+    if a_fields is not None:
+        return {
+            l_field: a_row[l_field].isoformat()
+            if l_field == "time_created"
+            else a_row[l_field]
+            for l_field in user_listing_fields
+            if l_field in a_fields
+        }
+    return {
+        "id": a_row["id"],
+        "username": a_row["username"],
+        "email": a_row["email"],
+        "is_active": a_row["is_active"],
+        "is_superuser": a_row["is_superuser"],
+        "version": a_row["version"],
+        "time_created": a_row["time_created"].isoformat(),
+    }
+
+
+def row_cursor(a_row: Mapping[str, Any]) -> str:
+    """
+    :param a_row: A row from list_users_db
+    :return: The cursor which continues the listing after a_row
+    """
+    return encode_cursor(a_row["time_created"], a_row["id"])
+
+
+def listing_page_size(a_page_size: int, a_remaining: Optional[int]) -> int:
+    """
+    :param a_page_size: The most rows read per query
+    :param a_remaining: The rows still to be returned; None if unlimited
+    :return: The number of rows to request for the next page
+    """
+    return a_page_size if a_remaining is None else min(a_page_size, a_remaining)
+
+
+async def user_listing_pages(
+    a_db: AsyncEngine,
+    a_first_page: List[Mapping[str, Any]],
+    a_page_size: int,
+    a_limit: Optional[int],
+    a_filters: Dict[str, Any],
+) -> AsyncIterator[Tuple[List[Mapping[str, Any]], bool]]:
+    """
+    Read the listing one keyset page at a time so only a single page is ever held in
+    memory, whatever the total number of users.
+    :param a_db: The engine the first page was read from, possibly a replica's
+    :param a_first_page: The page already read by the route
+    :param a_page_size: The most rows read per query
+    :param a_limit: The most rows to return in total; None for every row
+    :param a_filters: Keyword arguments for list_users_db's filters
+    :return: Each page with whether more rows may follow it
+    """
+    l_page: List[Mapping[str, Any]] = a_first_page
+    l_remaining: Optional[int] = a_limit
+    l_requested: int = listing_page_size(a_page_size, l_remaining)
+    while True:
+        if l_remaining is not None:
+            l_remaining -= len(l_page)
+        # A short page means the listing is exhausted
+        l_more: bool = len(l_page) == l_requested
+        yield l_page, l_more
+        if not l_more or l_remaining == 0:
+            return
+        l_requested = listing_page_size(a_page_size, l_remaining)
+        l_page = await list_users_db(
+            a_db,
+            l_requested,
+            (l_page[-1]["time_created"], l_page[-1]["id"]),
+            **a_filters,
+        )
+
+
+async def ndjson_user_listing(
+    a_pages: AsyncIterator[Tuple[List[Mapping[str, Any]], bool]],
+    a_fields: Optional[FrozenSet[str]] = None,
+) -> AsyncIterator[str]:
+    """
+    Serialize the listing as newline delimited JSON, one chunk per page
+    :param a_pages: The output of user_listing_pages
+    :param a_fields: If provided, only these fields of each user are included
+    :return: The response body chunks
+    """
+    async for l_page, _ in a_pages:
+        yield "".join(
+            dumps({**user_listing_dict(l_row, a_fields), "cursor": row_cursor(l_row)})
+            + "\n"
+            for l_row in l_page
+        )
+
+
+async def json_user_listing(
+    a_pages: AsyncIterator[Tuple[List[Mapping[str, Any]], bool]],
+    a_fields: Optional[FrozenSet[str]] = None,
+) -> AsyncIterator[str]:
+    """
+    Serialize the listing as one JSON object, one chunk per page
+    :param a_pages: The output of user_listing_pages
+    :param a_fields: If provided, only these fields of each user are included
+    :return: The response body chunks
+    """
+    yield '{"users":['
+    l_separator: str = ""
+    l_next_cursor: Optional[str] = None
+    async for l_page, l_more in a_pages:
+        for l_row in l_page:
+            yield l_separator + dumps(user_listing_dict(l_row, a_fields))
+            l_separator = ","
+        l_next_cursor = row_cursor(l_page[-1]) if l_more and l_page else None
+    yield f'],"next_cursor":{dumps(l_next_cursor)}}}'
+
+
+@router_admin.get("/list", response_class=StreamingResponse)
+async def list_users_route(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    page_size: int = Query(500, ge=1, le=5000),
+    is_active: Optional[bool] = None,
+    is_superuser: Optional[bool] = None,
+    email_domain: Optional[str] = Query(
+        None, max_length=253, regex=r"^[A-Za-z0-9]([A-Za-z0-9.-]*[A-Za-z0-9])?$"
+    ),
+    format: UserListFormat = UserListFormat.json,
+    fields: Optional[FrozenSet[str]] = Depends(fields_query(user_listing_fields)),
+    a_current_admin: Principal = Depends(get_current_admin_from_token),
+    db: AsyncEngine = Depends(get_async_db),
+):
+    """List users oldest first, streaming the response one page at a time.
+
+    Args:
+        cursor (str): Continue after the user this opaque cursor came from
+        limit (int): The most users to return; every remaining user if omitted
+        page_size (int): The most users read from the database per query
+        is_active (bool): If provided, only users with this is_active value
+        is_superuser (bool): If provided, only users with this is_superuser value
+        email_domain (str): If provided, only users with an e-mail at this domain
+        format (UserListFormat): Whether to stream one JSON object or NDJSON lines
+        fields (FrozenSet[str]): If provided, only these fields of each user are read
+        and returned
+        a_current_admin (Principal): The administrator making this request
+        db (AsyncEngine): The engine whose pool the worker shares
+
+    Returns:
+        StreamingResponse: The users and 200 on success; HTTPException if the cursor
+        is invalid or the user isn't an administrator
+    """
+    l_after: Optional[Tuple[datetime, int]] = (
+        decode_cursor(cursor) if cursor is not None else None
+    )
+    l_filters: Dict[str, Any] = {
+        "a_is_active": is_active,
+        "a_is_superuser": is_superuser,
+        "a_email_domain": email_domain,
+        "a_fields": fields,
+    }
+    # Every page is read from the same replica
+    l_reader: AsyncEngine = replica_router.reader(db, a_current_admin.id)
+    # Read the first page before the response starts so database errors still produce
+    # an error status rather than a truncated 200
+    l_first_page: List[Mapping[str, Any]] = await list_users_db(
+        l_reader, listing_page_size(page_size, limit), l_after, **l_filters
+    )
+    logger.debug(f"Admin {a_current_admin.id} is listing users")
+    l_pages = user_listing_pages(l_reader, l_first_page, page_size, limit, l_filters)
+    if format == UserListFormat.ndjson:
+        return StreamingResponse(
+            ndjson_user_listing(l_pages, fields), media_type="application/x-ndjson"
+        )
+    return StreamingResponse(
+        json_user_listing(l_pages, fields), media_type="application/json"
+    )
+
+
+@router_admin.get(
+    "/search", response_model=UserSearchSchema, status_code=status.HTTP_200_OK
+)
+async def search_users_route(
+    q: str = Query(..., min_length=3, max_length=254),
+    limit: int = Query(
+        core_config.USER_SEARCH_MAX_RESULTS,
+        ge=1,
+        le=core_config.USER_SEARCH_MAX_RESULTS,
+    ),
+    fields: Optional[FrozenSet[str]] = Depends(fields_query(user_search_fields)),
+    a_current_admin: Principal = Depends(get_current_admin_from_token),
+    db: AsyncEngine = Depends(get_async_db),
+):
+    """Find users by part of their e-mail address or username, best matches first.
+
+    Args:
+        q (str): The text to look for, case insensitively. At least three characters.
+        limit (int): The most users to return
+        fields (FrozenSet[str]): If provided, only these fields of each user are
+        returned
+        a_current_admin (Principal): The administrator making this request
+        db (AsyncEngine): The engine whose pool the worker shares
+
+    Returns:
+        UserSearchSchema: The matching users and 200 on success; HTTPException if the
+        user isn't an administrator or the search took too long
+    """
+    logger.debug(f"Admin {a_current_admin.id} is searching users")
+    l_result: UserSearchSchema = await search_users_db(
+        replica_router.reader(db, a_current_admin.id), q, limit
+    )
+    return fields_response(
+        UserSearchSchema.construct(
+            users=[with_fields(l_user, fields) for l_user in l_result.users],
+            truncated=l_result.truncated,
+        ),
+        fields,
+    )
+
+
+@router_admin.get("/cache-stats", status_code=status.HTTP_200_OK)
+async def cache_stats_route(
+    a_current_admin: Principal = Depends(get_current_admin_from_token),
+) -> Dict[str, Dict[str, float]]:
+    """Report how effective the user and verified token caches are.
+
+    Args:
+        a_current_admin (Principal): The administrator making this request
+
+    Returns:
+        Dict: The stats of each cache and 200 on success. The caches are per worker,
+        so the counts are those of whichever worker served the request.
+    """
+    return {
+        "user_cache": user_cache.stats(),
+        "token_cache": verified_token_cache.stats(),
+    }
+
+
+@router_admin.post(
+    "/import", response_model=UserImportReportSchema, status_code=status.HTTP_200_OK
+)
+async def import_users_route(
+    request: Request,
+    max_errors: int = Query(1000, ge=0),
+    a_current_admin: Principal = Depends(get_current_admin_from_token),
+    db: AsyncEngine = Depends(get_async_db),
+):
+    """Create users from a CSV or NDJSON request body, which is read as it streams in.
+
+    CSV bodies begin with a header row naming the columns. Rows are committed in
+    batches, so users from earlier batches remain if the import is interrupted.
+
+    Args:
+        request (Request): The incoming request with a text/csv or
+        application/x-ndjson body
+        max_errors (int): The most rejected rows described in the response
+        a_current_admin (Principal): The administrator making this request
+        db (AsyncEngine): The engine whose pool the worker shares
+
+    Returns:
+        UserImportReportSchema: Counts, throughput and rejected rows and 200 on success;
+        HTTPException if the body's type or CSV header is invalid
+    """
+    l_content_type: str = request.headers.get("content-type", "").split(";")[0]
+    l_format: Optional[ImportFormat] = import_content_types.get(l_content_type.strip())
+    if l_format is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Send one of: {', '.join(import_content_types)}",
+        )
+
+    l_errors: List[UserImportErrorSchema] = []
+
+    def keep_error(a_error: UserImportErrorSchema) -> None:
+        if len(l_errors) < max_errors:
+            l_errors.append(a_error)
+
+    logger.info(f"Admin {a_current_admin.id} is importing users")
+    try:
+        l_report: UserImportReportSchema = await import_users_db(
+            db, iter_lines(request.stream()), l_format, keep_error
+        )
+    except ValueError as e:
+        # An invalid CSV header or a body which isn't UTF-8
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    finally:
+        # Earlier batches may have committed even if the import failed
+        await replica_router.record_write(a_current_admin.id)
+    l_report.errors = l_errors
+    l_report.errors_truncated = l_report.rows_rejected > len(l_errors)
+    return l_report
+
+
+@router_admin.get("/export", response_class=StreamingResponse)
+async def export_users_route(
+    format: ExportFormat = ExportFormat.csv,
+    gzip: bool = False,
+    a_current_admin: Principal = Depends(get_current_admin_from_token),
+    db: AsyncEngine = Depends(get_async_db),
+):
+    """Download every user, less their password hash, as a file streamed straight
+    from Postgres.
+
+    Args:
+        format (ExportFormat): CSV with a header row or NDJSON
+        gzip (bool): Whether to gzip the file
+        a_current_admin (Principal): The administrator making this request
+        db (AsyncEngine): The engine whose pool the worker shares
+
+    Returns:
+        StreamingResponse: The file as an attachment and 200 on success; HTTPException
+        if the user isn't an administrator
+    """
+    logger.info(f"Admin {a_current_admin.id} is exporting users")
+    l_chunks: AsyncIterator[bytes] = export_users_db(
+        replica_router.reader(db, a_current_admin.id), format, gzip
+    )
+    # Wait for the first chunk before the response starts so a failing export still
+    # produces an error status rather than a truncated 200
+    try:
+        l_first_chunk: bytes = await l_chunks.__anext__()
+    except StopAsyncIteration:
+        l_first_chunk = b""
+
+    async def body() -> AsyncIterator[bytes]:
+        yield l_first_chunk
+        async for l_chunk in l_chunks:
+            yield l_chunk
+
+    l_filename: str = f"users.{format.value}{'.gz' if gzip else ''}"
+    return StreamingResponse(
+        body(),
+        media_type="application/gzip" if gzip else export_media_types[format],
+        headers={"Content-Disposition": f'attachment; filename="{l_filename}"'},
+    )
@@ -0,0 +1,452 @@
+"""
+Read-through cache of user records shared by the API workers
+"""
+from asyncio import CancelledError
+from asyncio import create_task
+from asyncio import current_task
+from asyncio import shield
+from asyncio import sleep
+from asyncio import Task
+from collections import OrderedDict
+from random import uniform
+from time import monotonic
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from demo.core.config import core_config
+from demo.core.config import core_logger as logger
+from demo.core.redis_client import get_redis
+from demo.schemas.users import UserSchema
+from redis.exceptions import RedisError
+from ujson import dumps
+from ujson import loads
+
+USER_KEY_PREFIX: str = "user:"
+USER_INVALIDATION_CHANNEL: str = "user-invalidations"
+# Seconds to wait before resubscribing, or using Redis again, after a Redis failure
+RECONNECT_SECONDS: float = 5.0
+# Held in Redis in place of an invalidated record, so a worker which read the user
+# before the write can't put its outdated copy back
+USER_TOMBSTONE: str = "-"
+# Seconds a tombstone is kept. Workers only fill Redis after a database read taking
+# less than half of this, so any tombstone written since the read began is still there.
+TOMBSTONE_SECONDS: float = 5.0
+
+# Reads a user record from the database; None if the user doesn't exist
+UserLoader = Callable[[], Awaitable[Optional[UserSchema]]]
+# Reads the records for a list of user IDs from the database, keyed by ID
+UsersLoader = Callable[[List[int]], Awaitable[Dict[int, UserSchema]]]
+
+
+class UserCache:
+    """
+    Two tier cache of UserSchema records keyed by user ID.
+
+    Each worker keeps a bounded LRU of recently used records in front of Redis, which
+    holds records loaded by any worker. Concurrent misses for the same user share a
+    single load, so a popular record expiring causes one database query rather than
+    one per waiting request. Lifetimes are jittered so records cached together expire
+    at different moments.
+
+    Writers call invalidate(), which replaces the record in Redis with a short-lived
+    tombstone and announces the user ID on a pub/sub channel so every worker drops its
+    own copy. Redis is only filled where it holds nothing, so a worker which read the
+    user before the write and hasn't yet heard the announcement can't overwrite the
+    tombstone with its outdated copy. Records are never trusted beyond their TTL, which
+    bounds how stale a copy may be if an announcement is missed.
+    """
+
+    def __init__(
+        self,
+        a_max_size: int = core_config.USER_CACHE_SIZE,
+        a_ttl_seconds: int = core_config.USER_CACHE_TTL_SECONDS,
+        a_ttl_jitter: float = core_config.USER_CACHE_TTL_JITTER,
+        a_tombstone_seconds: float = TOMBSTONE_SECONDS,
+    ):
+        self.max_size: int = a_max_size
+        self.ttl_seconds: int = a_ttl_seconds
+        self.ttl_jitter: float = a_ttl_jitter
+        self.tombstone_seconds: float = a_tombstone_seconds
+        # Lookups answered by this worker's LRU, by Redis, by joining a load already
+        # in progress, and by the database
+        self.l1_hits: int = 0
+        self.l2_hits: int = 0
+        self.coalesced: int = 0
+        self.misses: int = 0
+        self._entries: OrderedDict[int, Tuple[float, UserSchema]] = OrderedDict()
+        self._loading: Dict[int, Task] = {}
+        self._redis_retry_at: float = 0.0
+        # Incremented by every evict() so get_many() can tell whether a record it read
+        # may have been invalidated before it was cached
+        self._evictions: int = 0
+        self._listener: Optional[Task] = None
+
+    @staticmethod
+    def _key(a_id: int) -> str:
+        """
+        Derive the Redis key holding a user's record
+        :param a_id: The user ID
+        :return: The Redis key
+        """
+        return f"{USER_KEY_PREFIX}{a_id}"
+
+    def _ttl(self) -> float:
+        """
+        :return: A lifetime for a newly cached record in seconds, randomly within
+        ttl_jitter of ttl_seconds
+        """
+        return self.ttl_seconds * uniform(1 - self.ttl_jitter, 1 + self.ttl_jitter)
+
+    def _may_fill(self, a_read_at: float) -> bool:
+        """
+        :param a_read_at: When the database read of the records began, by monotonic()
+        :return: Whether the records may be cached in Redis, because any tombstone
+        written since the read began hasn't expired
+        """
+        return monotonic() - a_read_at < self.tombstone_seconds / 2
+
+    def _redis_failed(self, a_action: str, a_error: Exception) -> None:
+        """
+        Stop using Redis for lookups for a while after it fails
+        :param a_action: What was being attempted, for the log
+        :param a_error: The failure
+        :return: Nothing
+        """
+        logger.warning(f"[UserCache] failed to {a_action}: {a_error}")
+        self._redis_retry_at = monotonic() + RECONNECT_SECONDS
+
+    def _get_local(self, a_id: int) -> Optional[UserSchema]:
+        """
+        :param a_id: The user ID
+        :return: The record from this worker's LRU if present and unexpired
+        """
+        l_entry: Optional[Tuple[float, UserSchema]] = self._entries.get(a_id)
+        if l_entry is None:
+            return None
+        if l_entry[0] <= monotonic():
+            del self._entries[a_id]
+            return None
+        self._entries.move_to_end(a_id)
+        return l_entry[1]
+
+    def _put_local(self, a_user: UserSchema, a_ttl: float) -> None:
+        """
+        Remember a record in this worker's LRU, evicting the least recently used
+        :param a_user: The record
+        :param a_ttl: Seconds until the record expires
+        :return: Nothing
+        """
+        if self.max_size <= 0:
+            return
+        self._entries[a_user.id] = (monotonic() + a_ttl, a_user)
+        self._entries.move_to_end(a_user.id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def _load(self, a_id: int, a_loader: UserLoader) -> Optional[UserSchema]:
+        """
+        Read a record from Redis, or else the database, and cache it. Runs as its own
+        task so a cancelled request doesn't cancel the load for the others awaiting it.
+        :param a_id: The user ID
+        :param a_loader: Reads the record from the database
+        :return: The record; None if the user doesn't exist
+        """
+        l_task: Optional[Task] = current_task()
+        try:
+            l_user: Optional[UserSchema] = None
+            l_use_redis: bool = monotonic() >= self._redis_retry_at
+            if l_use_redis:
+                try:
+                    l_value: Optional[str] = await get_redis().get(self._key(a_id))
+                    if l_value is not None and l_value != USER_TOMBSTONE:
+                        l_user = UserSchema.construct(**loads(l_value))
+                except (RedisError, OSError) as e:
+                    self._redis_failed("read a user", e)
+                    l_use_redis = False
+
+            l_from_redis: bool = l_user is not None
+            l_read_at: float = monotonic()
+            if l_from_redis:
+                self.l2_hits += 1
+            else:
+                self.misses += 1
+                l_user = await a_loader()
+                if l_user is None:
+                    return None
+
+            # The user was invalidated while this load was in progress, so what was
+            # read may already be out of date
+            if self._loading.get(a_id) is not l_task:
+                return l_user
+            l_ttl: float = self._ttl()
+            self._put_local(l_user, l_ttl)
+            if l_use_redis and not l_from_redis and self._may_fill(l_read_at):
+                try:
+                    await get_redis().set(
+                        self._key(a_id),
+                        dumps(l_user.dict()),
+                        ex=max(1, round(l_ttl)),
+                        nx=True,
+                    )
+                except (RedisError, OSError) as e:
+                    self._redis_failed("cache a user", e)
+            return l_user
+        finally:
+            if self._loading.get(a_id) is l_task:
+                del self._loading[a_id]
+
+    async def get(self, a_id: int, a_loader: UserLoader) -> Optional[UserSchema]:
+        """
+        Retrieve a user, loading and caching the record on a miss
+        :param a_id: The user ID
+        :param a_loader: Reads the record from the database
+        :return: The record; None if the user doesn't exist
+        """
+        if self.ttl_seconds <= 0:
+            self.misses += 1
+            return await a_loader()
+        l_user: Optional[UserSchema] = self._get_local(a_id)
+        if l_user is not None:
+            self.l1_hits += 1
+            return l_user
+        l_task: Optional[Task] = self._loading.get(a_id)
+        if l_task is None:
+            l_task = create_task(self._load(a_id, a_loader))
+            self._loading[a_id] = l_task
+        else:
+            self.coalesced += 1
+        return await shield(l_task)
+
+    async def _get_redis_many(
+        self, a_ids: List[int]
+    ) -> Optional[Dict[int, UserSchema]]:
+        """
+        Read many records from Redis with one MGET
+        :param a_ids: The user IDs
+        :return: Each record Redis holds by user ID; None if Redis failed
+        """
+        try:
+            l_values: List[Optional[str]] = await get_redis().mget(
+                [self._key(l_id) for l_id in a_ids]
+            )
+        except (RedisError, OSError) as e:
+            self._redis_failed("read users", e)
+            return None
+        return {
+            l_id: UserSchema.construct(**loads(l_value))
+            for l_id, l_value in zip(a_ids, l_values)
+            if l_value is not None and l_value != USER_TOMBSTONE
+        }
+
+    async def _set_redis_many(self, a_users: List[UserSchema], a_ttl: float) -> None:
+        """
+        Cache many records in Redis with one pipelined round trip, leaving any record
+        or tombstone already there
+        :param a_users: The records
+        :param a_ttl: Seconds until the records expire
+        :return: Nothing
+        """
+        try:
+            async with get_redis().pipeline(transaction=False) as l_pipe:
+                for l_user in a_users:
+                    l_pipe.set(
+                        self._key(l_user.id),
+                        dumps(l_user.dict()),
+                        ex=max(1, round(a_ttl)),
+                        nx=True,
+                    )
+                await l_pipe.execute()
+        except (RedisError, OSError) as e:
+            self._redis_failed("cache users", e)
+
+    async def get_many(
+        self, a_ids: List[int], a_loader: UsersLoader
+    ) -> Dict[int, UserSchema]:
+        """
+        Retrieve many users at once. Records missing from this worker's LRU are read
+        from Redis with one MGET, and those missing from Redis with one call to
+        a_loader, then cached in both tiers.
+        :param a_ids: The user IDs, possibly repeated
+        :param a_loader: Reads the records for a list of IDs from the database
+        :return: Each record found by user ID; users who don't exist are absent
+        """
+        l_ids: List[int] = list(dict.fromkeys(a_ids))
+        if self.ttl_seconds <= 0:
+            self.misses += len(l_ids)
+            return await a_loader(l_ids) if l_ids else {}
+
+        l_users: Dict[int, UserSchema] = {}
+        l_loading: Dict[int, Task] = {}
+        l_missing: List[int] = []
+        for l_id in l_ids:
+            l_user: Optional[UserSchema] = self._get_local(l_id)
+            if l_user is not None:
+                self.l1_hits += 1
+                l_users[l_id] = l_user
+            elif l_id in self._loading:
+                self.coalesced += 1
+                l_loading[l_id] = self._loading[l_id]
+            else:
+                l_missing.append(l_id)
+
+        # Records are only cached if no user was invalidated while they were read, as
+        # any of them may already be out of date
+        l_evictions: int = self._evictions
+        l_use_redis: bool = bool(l_missing) and monotonic() >= self._redis_retry_at
+        if l_use_redis:
+            l_cached: Optional[Dict[int, UserSchema]] = await self._get_redis_many(
+                l_missing
+            )
+            l_use_redis = l_cached is not None
+            if l_cached:
+                self.l2_hits += len(l_cached)
+                l_users.update(l_cached)
+                if l_evictions == self._evictions:
+                    l_ttl: float = self._ttl()
+                    for l_user in l_cached.values():
+                        self._put_local(l_user, l_ttl)
+                l_missing = [l_id for l_id in l_missing if l_id not in l_cached]
+
+        if l_missing:
+            self.misses += len(l_missing)
+            l_read_at: float = monotonic()
+            l_loaded: Dict[int, UserSchema] = await a_loader(l_missing)
+            l_users.update(l_loaded)
+            if l_loaded and l_evictions == self._evictions:
+                l_ttl = self._ttl()
+                for l_user in l_loaded.values():
+                    self._put_local(l_user, l_ttl)
+                if l_use_redis and self._may_fill(l_read_at):
+                    await self._set_redis_many(list(l_loaded.values()), l_ttl)
+
+        for l_id, l_task in l_loading.items():
+            l_user = await shield(l_task)
+            if l_user is not None:
+                l_users[l_id] = l_user
+        return l_users
+
+    def evict(self, a_id: int) -> None:
+        """
+        Drop this worker's copy of a record, including any load in progress
+        :param a_id: The user ID
+        :return: Nothing
+        """
+        self._evictions += 1
+        self._entries.pop(a_id, None)
+        # The load finishes for those awaiting it but its result isn't cached
+        self._loading.pop(a_id, None)
+
+    async def invalidate(self, a_id: int) -> None:
+        """
+        Drop a record from every tier and every worker, leaving a tombstone in Redis
+        which outdated copies can't replace. Call after the user's row has been
+        written.
+        :param a_id: The user ID
+        :return: Nothing
+        """
+        self.evict(a_id)
+        if self.ttl_seconds <= 0:
+            return
+        l_redis = get_redis()
+        try:
+            await l_redis.set(
+                self._key(a_id),
+                USER_TOMBSTONE,
+                px=max(1, round(self.tombstone_seconds * 1000)),
+            )
+            await l_redis.publish(USER_INVALIDATION_CHANNEL, str(a_id))
+        except (RedisError, OSError) as e:
+            # The write already succeeded so don't fail it. Other workers' copies
+            # expire within the TTL.
+            self._redis_failed("invalidate a user", e)
+
+    def clear(self) -> None:
+        """
+        Forget every record cached by this worker and reset the counters
+        :return: Nothing
+        """
+        self._entries.clear()
+        self._loading.clear()
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Report this worker's cache occupancy and effectiveness
+        :return: A dict of size, max_size, l1_hits, l2_hits, coalesced, misses,
+        l1_hit_ratio, and hit_ratio, the fraction of lookups which didn't reach the
+        database
+        """
+        l_lookups: int = self.l1_hits + self.l2_hits + self.coalesced + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "l1_hits": self.l1_hits,
+            "l2_hits": self.l2_hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "l1_hit_ratio": self.l1_hits / l_lookups if l_lookups else 0.0,
+            "hit_ratio": 1 - self.misses / l_lookups if l_lookups else 0.0,
+        }
+
+    async def _listen(self) -> None:
+        """
+        Drop records other workers announce as invalidated, resubscribing whenever the
+        connection to Redis is lost
+        :return: Nothing
+        """
+        while True:
+            try:
+                l_pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+                try:
+                    await l_pubsub.subscribe(USER_INVALIDATION_CHANNEL)
+                    # Announcements may have been missed while unsubscribed
+                    self._entries.clear()
+                    while True:
+                        l_message = await l_pubsub.get_message(timeout=1.0)
+                        if l_message is None:
+                            continue
+                        try:
+                            self.evict(int(l_message["data"]))
+                        except ValueError:
+                            logger.warning(
+                                f"[UserCache] ignored invalid announcement: "
+                                f"{l_message['data']!r}"
+                            )
+                finally:
+                    await l_pubsub.reset()
+            except CancelledError:
+                raise
+            except (RedisError, OSError) as e:
+                logger.warning(f"[UserCache] lost invalidation announcements: {e}")
+                await sleep(RECONNECT_SECONDS)
+
+    def start(self) -> None:
+        """
+        Begin dropping records invalidated by other workers in a background task
+        :return: Nothing
+        """
+        if self._listener is None and self.ttl_seconds > 0:
+            self._listener = create_task(self._listen())
+
+    async def stop(self) -> None:
+        """
+        Stop listening for invalidations
+        :return: Nothing
+        """
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except CancelledError:
+                pass
+            self._listener = None
+
+
+user_cache = UserCache()
@@ -23,6 +23,7 @@ from dotenv import load_dotenv
 from pydantic import AnyHttpUrl
 from pydantic import BaseSettings
 from pydantic import Field
+from pydantic import FilePath
 from pydantic import PostgresDsn
 from pydantic import RedisDsn
 from pydantic import SecretStr
@@ -74,6 +75,48 @@ class LogLevel(str, Enum):
     debug = "debug"
 
 
+class HashPoolKind(str, Enum):
+    """
+    Explicit enumerated class for the worker pool types used to run password hashing
+    off of the event loop. bcrypt releases the GIL so threads are normally sufficient.
+    """
+
+    thread = "thread"
+    process = "process"
+
+
+class ReplicaSelection(str, Enum):
+    """
+    Explicit enumerated class for the ways demo.database.replicas chooses which read
+    replica serves a query
+    """
+
+    # Each replica in turn
+    round_robin = "round_robin"
+    # The replica with the fewest connections checked out of this worker's pools
+    least_connections = "least_connections"
+
+
+class TokenBackend(str, Enum):
+    """
+    Explicit enumerated class for the libraries which may encode and decode JWTs.
+    This type is primarily consumed by demo.core.tokens.
+    """
+
+    pyjwt = "pyjwt"
+    jose = "jose"
+
+
+class PasswordHashScheme(str, Enum):
+    """
+    Explicit enumerated class for the password hashing schemes new hashes may use.
+    Hashes made with any other scheme are verified then transparently upgraded.
+    """
+
+    bcrypt = "bcrypt"
+    argon2 = "argon2"
+
+
 class CoreConfig(BaseSettings):
     """
     Primary Pydantic parser for environment variables used throughout the API layer.
@@ -93,12 +136,75 @@ class CoreConfig(BaseSettings):
     DEFAULT_EMAIL: str = Field(..., env="DEFAULT_EMAIL")
 
     SECRET_KEY: str = Field(..., env="SECRET_KEY")
+    # The JWS algorithm used to sign access tokens, e.g. HS256, EdDSA, or ES256
     HASH_ALGORITHM: str = Field(..., env="HASH_ALGORITHM")
+    # Defaults to pyjwt for EdDSA, which python-jose can't sign with, and to jose
+    # otherwise
+    TOKEN_BACKEND: TokenBackend = Field(None, env="TOKEN_BACKEND")
+    # PEM encoded private key required by asymmetric HASH_ALGORITHM values
+    JWT_PRIVATE_KEY_FILE: Optional[FilePath] = Field(None, env="JWT_PRIVATE_KEY_FILE")
+    # PEM encoded public keys of retired signing keys. Tokens they signed still verify
+    # and the keys remain in the JWKS until removed from this list.
+    JWT_PUBLIC_KEY_FILES: List[FilePath] = Field([], env="JWT_PUBLIC_KEY_FILES")
+    JWKS_MAX_AGE_SECONDS: int = Field(300, env="JWKS_MAX_AGE_SECONDS", ge=0)
     ACCESS_TOKEN_EXPIRE_MINUTES: int = Field(
         ..., env="ACCESS_TOKEN_EXPIRE_MINUTES", gt=0
     )
+    # Lifetime of each opaque refresh token. Every refresh issues a new one.
+    REFRESH_TOKEN_EXPIRE_MINUTES: int = Field(
+        43200, env="REFRESH_TOKEN_EXPIRE_MINUTES", gt=0
+    )
+    # Number of verified tokens each worker remembers. 0 disables the cache.
+    TOKEN_CACHE_SIZE: int = Field(4096, env="TOKEN_CACHE_SIZE", ge=0)
+    # Number of user records each worker remembers in front of the Redis user cache.
+    # 0 disables the per-worker tier.
+    USER_CACHE_SIZE: int = Field(10000, env="USER_CACHE_SIZE", ge=0)
+    # Lifetime of a cached user record in both tiers. 0 disables the cache.
+    USER_CACHE_TTL_SECONDS: int = Field(300, env="USER_CACHE_TTL_SECONDS", ge=0)
+    # Each lifetime is randomly shortened or lengthened by up to this fraction so
+    # records cached together don't all expire together
+    USER_CACHE_TTL_JITTER: float = Field(0.1, env="USER_CACHE_TTL_JITTER", ge=0, lt=1)
     BACKEND_CORS_ORIGINS: List[AnyHttpUrl] = []
 
+    # Worker pool used by demo.core.hashing to keep bcrypt off of the event loop
+    HASH_POOL_KIND: HashPoolKind = Field(HashPoolKind.thread, env="HASH_POOL_KIND")
+    HASH_POOL_WORKERS: int = Field(2, env="HASH_POOL_WORKERS", gt=0)
+    # Hashes running or waiting for a worker beyond this count are rejected with a 503
+    HASH_POOL_MAX_PENDING: int = Field(64, env="HASH_POOL_MAX_PENDING", gt=0)
+
+    # Password hash cost. Run `python -m demo calibrate-hash` on the production host to
+    # choose values which meet PASSWORD_HASH_TARGET_MS. Stored hashes made with another
+    # scheme or cost are rehashed after the user's next successful login.
+    PASSWORD_HASH_SCHEME: PasswordHashScheme = Field(
+        PasswordHashScheme.bcrypt, env="PASSWORD_HASH_SCHEME"
+    )
+    PASSWORD_HASH_TARGET_MS: int = Field(250, env="PASSWORD_HASH_TARGET_MS", gt=0)
+    BCRYPT_ROUNDS: int = Field(12, env="BCRYPT_ROUNDS", ge=4, le=31)
+    ARGON2_TIME_COST: int = Field(3, env="ARGON2_TIME_COST", ge=1)
+    # Argon2 memory cost is in KiB
+    ARGON2_MEMORY_COST: int = Field(65536, env="ARGON2_MEMORY_COST", ge=8)
+    ARGON2_PARALLELISM: int = Field(4, env="ARGON2_PARALLELISM", ge=1)
+
+    # Bulk user imports hash passwords in a dedicated pool of this many processes; 0
+    # starts one per CPU. Rows are validated, hashed and copied in batches of
+    # BULK_IMPORT_BATCH_SIZE.
+    BULK_IMPORT_HASH_WORKERS: int = Field(0, env="BULK_IMPORT_HASH_WORKERS", ge=0)
+    BULK_IMPORT_BATCH_SIZE: int = Field(1000, env="BULK_IMPORT_BATCH_SIZE", gt=0)
+
+    # Token buckets limiting login attempts. Each bucket holds up to BURST attempts and
+    # regains PER_MINUTE attempts every minute. Buckets are shared by every worker via
+    # Redis and fall back to per-worker buckets while Redis is unavailable.
+    LOGIN_RATE_LIMIT_IP_BURST: int = Field(30, env="LOGIN_RATE_LIMIT_IP_BURST", gt=0)
+    LOGIN_RATE_LIMIT_IP_PER_MINUTE: float = Field(
+        30, env="LOGIN_RATE_LIMIT_IP_PER_MINUTE", gt=0
+    )
+    LOGIN_RATE_LIMIT_USERNAME_BURST: int = Field(
+        10, env="LOGIN_RATE_LIMIT_USERNAME_BURST", gt=0
+    )
+    LOGIN_RATE_LIMIT_USERNAME_PER_MINUTE: float = Field(
+        5, env="LOGIN_RATE_LIMIT_USERNAME_PER_MINUTE", gt=0
+    )
+
     POSTGRES_SERVER: str = Field(..., env="POSTGRES_SERVER")
     POSTGRES_USER: str = Field(..., env="POSTGRES_USER")
     # Note: Pydantic SecretStr requires an explicit call to the .get_secret_value()
@@ -109,9 +215,78 @@ class CoreConfig(BaseSettings):
     POSTGRES_PORT: str = Field(..., env="POSTGRES_PORT")
     DATABASE_URI: Optional[PostgresDsn] = None
     DATABASE_URI_GENERIC: Optional[PostgresDsn] = None
+    # Connections every API worker together may hold. Each worker's pool gets an equal
+    # share, so keep this below Postgres' max_connections less what migrations, Celery
+    # and administrative sessions need.
+    DATABASE_MAX_CONNECTIONS: int = Field(60, env="DATABASE_MAX_CONNECTIONS", gt=0)
+    # Seconds a query waits for a pooled connection before failing
+    DATABASE_POOL_TIMEOUT: float = Field(10, env="DATABASE_POOL_TIMEOUT", gt=0)
+    # Number of gunicorn workers sharing DATABASE_MAX_CONNECTIONS. gunicorn_conf.py
+    # exports the count it chose so workers don't need to repeat its calculation.
+    WEB_CONCURRENCY: int = Field(1, env="WEB_CONCURRENCY", gt=0)
+    # Set when DATABASE_URI and the replicas point at a pooler such as PgBouncer in
+    # transaction mode, which may give each transaction a different server connection.
+    # DATABASE_MAX_CONNECTIONS then limits connections to the pooler, not Postgres.
+    DATABASE_TRANSACTION_POOLER: bool = Field(False, env="DATABASE_TRANSACTION_POOLER")
+    # Read only replicas of DATABASE_URI as a JSON list. Each gets a pool sized like
+    # the primary's. Reads which may go to a replica use the primary when this is empty.
+    DATABASE_REPLICA_URIS: List[PostgresDsn] = Field([], env="DATABASE_REPLICA_URIS")
+    DATABASE_REPLICA_SELECTION: ReplicaSelection = Field(
+        ReplicaSelection.round_robin, env="DATABASE_REPLICA_SELECTION"
+    )
+    # Replicas further than this behind the primary aren't read from until they catch
+    # up. Each worker measures the lag this often.
+    DATABASE_REPLICA_MAX_LAG_SECONDS: float = Field(
+        5, env="DATABASE_REPLICA_MAX_LAG_SECONDS", ge=0
+    )
+    DATABASE_REPLICA_LAG_CHECK_SECONDS: float = Field(
+        1, env="DATABASE_REPLICA_LAG_CHECK_SECONDS", gt=0
+    )
+    # Time each request's SQL statements, logging those slower than
+    # DATABASE_SLOW_QUERY_MS and warning about requests which run one statement
+    # DATABASE_REPEATED_QUERY_THRESHOLD or more times, a sign of N+1 queries
+    DATABASE_INSTRUMENTATION: bool = Field(False, env="DATABASE_INSTRUMENTATION")
+    DATABASE_SLOW_QUERY_MS: float = Field(100, env="DATABASE_SLOW_QUERY_MS", ge=0)
+    DATABASE_REPEATED_QUERY_THRESHOLD: int = Field(
+        10, env="DATABASE_REPEATED_QUERY_THRESHOLD", ge=2
+    )
+    # After a user writes, their reads go to the primary for this long so they see
+    # their own changes before the replicas have them
+    DATABASE_READ_YOUR_WRITES_SECONDS: float = Field(
+        5, env="DATABASE_READ_YOUR_WRITES_SECONDS", ge=0
+    )
+    # The most users one admin search returns, and how long its query may run before
+    # it's cancelled so a broad term can't tie up a connection
+    USER_SEARCH_MAX_RESULTS: int = Field(50, env="USER_SEARCH_MAX_RESULTS", ge=1)
+    USER_SEARCH_TIMEOUT_MS: int = Field(500, env="USER_SEARCH_TIMEOUT_MS", ge=1)
+    # The most IDs and e-mail addresses together one batch user lookup may ask for
+    USER_BATCH_MAX_ITEMS: int = Field(1000, env="USER_BATCH_MAX_ITEMS", ge=1)
+    # Each worker buffers logins in memory and writes them in one batch this often, or
+    # sooner once LOGIN_RECORDER_BATCH_SIZE are waiting. Logins beyond
+    # LOGIN_RECORDER_MAX_PENDING are dropped, and counted, while Postgres falls behind.
+    LOGIN_RECORDER_FLUSH_SECONDS: float = Field(
+        1, env="LOGIN_RECORDER_FLUSH_SECONDS", gt=0
+    )
+    LOGIN_RECORDER_BATCH_SIZE: int = Field(500, env="LOGIN_RECORDER_BATCH_SIZE", ge=1)
+    LOGIN_RECORDER_MAX_PENDING: int = Field(
+        10_000, env="LOGIN_RECORDER_MAX_PENDING", ge=1
+    )
 
     CELERY_BROKER_URL: RedisDsn = Field(..., env="CELERY_BROKER_URL")
     CELERY_RESULT_BACKEND: RedisDsn = Field(..., env="CELERY_RESULT_BACKEND")
+    # Redis used by the API itself, e.g. for token revocation. Defaults to the broker.
+    REDIS_URI: Optional[RedisDsn] = Field(None, env="REDIS_URI")
+    # Each worker mirrors revoked token IDs in a Bloom filter sized for this many
+    # entries at this false positive rate. Positives are confirmed against Redis.
+    REVOCATION_BLOOM_CAPACITY: int = Field(
+        100_000, env="REVOCATION_BLOOM_CAPACITY", gt=0
+    )
+    REVOCATION_BLOOM_ERROR_RATE: float = Field(
+        0.001, env="REVOCATION_BLOOM_ERROR_RATE", gt=0, lt=1
+    )
+    # Rebuild the Bloom filter from Redis this often to drop expired revocations and
+    # recover any pub/sub messages missed while disconnected
+    REVOCATION_REBUILD_SECONDS: int = Field(300, env="REVOCATION_REBUILD_SECONDS", gt=0)
     celery_concurrency_count: int = 0
     celery_worker_count: int = 0
 
@@ -128,6 +303,25 @@ class CoreConfig(BaseSettings):
             return v
         raise ValueError(v)
 
+    @validator("TOKEN_BACKEND", always=True)
+    def choose_token_backend(cls, v: Optional[str], values: Dict[str, Any]) -> Any:
+        """
+        Choose a JWT library able to use HASH_ALGORITHM when TOKEN_BACKEND isn't
+        provided, and reject one which can't
+        :param v: The TOKEN_BACKEND environment variable, if any
+        :param values: Dict of currently processed environment variables
+        :return: The TokenBackend to use
+        """
+        l_eddsa: bool = values.get("HASH_ALGORITHM") == "EdDSA"
+        if v is None:
+            return TokenBackend.pyjwt if l_eddsa else TokenBackend.jose
+        if l_eddsa and v == TokenBackend.jose:
+            raise ValueError(
+                "python-jose can't use EdDSA keys. Set TOKEN_BACKEND=pyjwt or use "
+                "another HASH_ALGORITHM."
+            )
+        return v
+
     # Pydantic field ordering rules should ensure that POSTGRES_DB is updated prior to
     # DATABASE_URI. Thus, we can append testing_postfix to POSTGRES_DB here and all
     # areas that would use the modified string, such as Alembic's env.py, automatically
@@ -198,6 +392,18 @@ class CoreConfig(BaseSettings):
                 path=f"/{quote_plus(values.get('POSTGRES_DB'))}",
             )
 
+    @validator("REDIS_URI", always=True)
+    def default_redis_uri(cls, v: Optional[str], values: Dict[str, Any]) -> Any:
+        """
+        Fall back to the Celery broker's Redis instance when REDIS_URI isn't provided
+        :param v: The REDIS_URI environment variable, if any
+        :param values: Dict of currently processed environment variables
+        :return: A Redis URI
+        """
+        if v is not None:
+            return v
+        return values.get("CELERY_BROKER_URL")
+
     @validator("DATABASE_URI_GENERIC")
     def generate_db_uri_generic(cls, v: Optional[str], values: Dict[str, Any]) -> Any:
         """It's possible (likely even) that the test database doesn't exist yet.
@@ -3,15 +3,24 @@ FastAPI Middleware startup and shutdown handlers
 """
 from typing import Callable
 
-from databases import Database
-from databases import DatabaseURL
+from demo.api.route_well_known import router as well_known_router
 from demo.api.v1 import api_router_v1
+from demo.core.cache import user_cache
 from demo.core.config import core_config
 from demo.core.config import core_logger as logger
+from demo.core.hashing import hashing_engine
+from demo.core.redis_client import close_redis
+from demo.core.revocation import revocation_list
+from demo.database import engine
+from demo.database.instrumentation import query_instrumentation
+from demo.database.instrumentation import QueryInstrumentationMiddleware
+from demo.database.login_recorder import login_recorder
+from demo.database.replicas import replica_router
+from demo.database.repository.users import create_default_admin_db
+from demo.schemas.users import UserAdminCreateUpdateSchema
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseSettings
-from starlette.config import Config
 
 
 def create_start_app_handler(
@@ -34,6 +43,7 @@ def create_start_app_handler(
         :return: Nothing
         """
         a_app.include_router(api_router_v1)
+        a_app.include_router(well_known_router, tags=["Discovery"])
         a_app.add_middleware(
             CORSMiddleware,
             allow_origins=[str(origin) for origin in core_config.BACKEND_CORS_ORIGINS],
@@ -42,23 +52,54 @@ def create_start_app_handler(
             allow_headers=["*"],
         )
 
-        # Attempt to connect to the database
-        config = Config()
-        l_db_url = config(
-            "DATABASE_URL",
-            cast=DatabaseURL,
-            default=a_config.DATABASE_URI,
-        )
-        # these can be configured in config as well
-        database = Database(l_db_url)
+        # Time every SQL statement per request. Nothing is installed when disabled so
+        # there's no overhead.
+        if a_config.DATABASE_INSTRUMENTATION:
+            a_app.add_middleware(QueryInstrumentationMiddleware)
+            for l_engine in [engine, *replica_router.replicas]:
+                query_instrumentation.instrument(l_engine)
+
+        # Spin up the password hashing workers before the first request needs them
+        hashing_engine.start()
+
+        # Mirror revoked access tokens from Redis into this worker's Bloom filter
+        revocation_list.start()
 
+        # Drop cached user records as other workers announce changes to them
+        user_cache.start()
+
+        # Measure read replica lag and pin users who write to the primary
+        replica_router.start()
+
+        # Attempt to connect to the database. Routes get the engine from app.state only
+        # once a connection has succeeded.
         try:
-            await database.connect()
-            a_app.state._db = database
+            async with engine.connect():
+                pass
+            a_app.state._db = engine
         except Exception as e:
             logger.warning("--- DB CONNECTION ERROR ---")
             logger.warning(e)
             logger.warning("--- DB CONNECTION ERROR ---")
+            return
+
+        # Write successful logins in batches behind the login route
+        login_recorder.start(engine)
+
+        # Ensure the default administrator account exists
+        try:
+            await create_default_admin_db(
+                UserAdminCreateUpdateSchema(
+                    username=a_config.DEFAULT_USERNAME,
+                    password=a_config.DEFAULT_USER_PASS,
+                    email=a_config.DEFAULT_EMAIL,
+                    is_active=True,
+                    is_superuser=True,
+                ),
+                engine,
+            )
+        except Exception as e:
+            logger.warning(f"Failed to create the default admin account: {e}")
 
     return start_app
 
@@ -75,11 +116,21 @@ def create_stop_app_handler(app: FastAPI) -> Callable:
         Mutate the FastAPI app instance prior to shut down
         :return: Nothing
         """
+        # Close the pooled connections while this event loop is still running, after
+        # writing the logins still buffered
         try:
-            await app.state._db.disconnect()
+            await login_recorder.stop()
+            await replica_router.stop()
+            await engine.dispose()
         except Exception as e:
             logger.warning("--- DB DISCONNECT ERROR ---")
             logger.warning(e)
             logger.warning("--- DB DISCONNECT ERROR ---")
 
+        hashing_engine.shutdown()
+
+        await revocation_list.stop()
+        await user_cache.stop()
+        await close_redis()
+
     return stop_app
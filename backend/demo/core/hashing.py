@@ -1,11 +1,273 @@
 """
 Password hashing and comparison functions
 """
+from asyncio import get_running_loop
+from concurrent.futures import Executor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+from time import perf_counter
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
 from typing import Optional
+from typing import Tuple
 
+from demo.core.config import core_config
+from demo.core.config import core_logger as logger
+from demo.core.config import CoreConfig
+from demo.core.config import HashPoolKind
+from demo.core.config import PasswordHashScheme
+from fastapi import HTTPException
+from fastapi import status
 from passlib.context import CryptContext
+from passlib.hash import argon2
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt costs below this are no longer considered safe regardless of hardware
+BCRYPT_MIN_ROUNDS: int = 10
+# Calibration never picks a higher argon2 time cost, however fast the host hashes
+ARGON2_MAX_TIME_COST: int = 64
+
+
+def build_crypt_context(a_config: CoreConfig = core_config) -> CryptContext:
+    """
+    Create the passlib context from the configured scheme and cost.
+
+    Pinning the minimum and maximum cost to the configured cost means any stored hash
+    with a different cost, higher or lower, reports needs_update() as True. The same
+    applies to hashes made with a scheme other than PASSWORD_HASH_SCHEME.
+    :param a_config: The BaseSettings from demo.core.config
+    :return: A CryptContext for hashing and verifying passwords
+    """
+    l_schemes: List[str] = [a_config.PASSWORD_HASH_SCHEME.value]
+    if a_config.PASSWORD_HASH_SCHEME == PasswordHashScheme.argon2:
+        if not argon2.has_backend():
+            raise RuntimeError(
+                "PASSWORD_HASH_SCHEME is argon2 but argon2-cffi isn't installed"
+            )
+        # Keep bcrypt so existing hashes can still be verified and upgraded
+        l_schemes.append(PasswordHashScheme.bcrypt.value)
+    elif argon2.has_backend():
+        l_schemes.append(PasswordHashScheme.argon2.value)
+
+    l_settings: Dict[str, Any] = {
+        "bcrypt__rounds": a_config.BCRYPT_ROUNDS,
+        "bcrypt__min_rounds": a_config.BCRYPT_ROUNDS,
+        "bcrypt__max_rounds": a_config.BCRYPT_ROUNDS,
+    }
+    if PasswordHashScheme.argon2.value in l_schemes:
+        l_settings.update(
+            {
+                "argon2__rounds": a_config.ARGON2_TIME_COST,
+                "argon2__min_rounds": a_config.ARGON2_TIME_COST,
+                "argon2__max_rounds": a_config.ARGON2_TIME_COST,
+                "argon2__memory_cost": a_config.ARGON2_MEMORY_COST,
+                "argon2__parallelism": a_config.ARGON2_PARALLELISM,
+            }
+        )
+    return CryptContext(schemes=l_schemes, deprecated="auto", **l_settings)
+
+
+pwd_context = build_crypt_context()
+
+hashing_busy_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="The server is too busy to process credentials. Please try again shortly.",
+    headers={"Retry-After": "1"},
+)
+
+
+def _hash(plain_password: str) -> str:
+    """
+    Module level hashing function so it may be pickled into a worker process
+    :param plain_password: Input plaintext password
+    :return: A hashed representation
+    """
+    return pwd_context.hash(plain_password)
+
+
+def hash_many(plain_passwords: List[str]) -> List[str]:
+    """
+    Hash several passwords in one worker process call so the cost of sending work to
+    the process is shared between them
+    :param plain_passwords: Input plaintext passwords
+    :return: Hashed representations in the same order
+    """
+    return [pwd_context.hash(l_password) for l_password in plain_passwords]
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    """
+    Module level verification function so it may be pickled into a worker process
+    :param plain_password: A plaintext version of the password
+    :param hashed_password: The reference hash
+    :return: True if they match, False otherwise
+    """
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class HashingEngine:
+    """
+    Bounded worker pool which keeps password hashing off of the event loop.
+
+    The number of hashes which may be running or waiting for a worker at any moment is
+    capped at a_max_pending. Requests beyond that cap are rejected immediately with a
+    503 rather than queueing without limit behind a saturated pool.
+    """
+
+    def __init__(
+        self,
+        a_kind: HashPoolKind = core_config.HASH_POOL_KIND,
+        a_workers: int = core_config.HASH_POOL_WORKERS,
+        a_max_pending: int = core_config.HASH_POOL_MAX_PENDING,
+    ):
+        self.kind: HashPoolKind = a_kind
+        self.workers: int = a_workers
+        self.max_pending: int = a_max_pending
+        self.pending: int = 0
+        self.rejected: int = 0
+        self._executor: Optional[Executor] = None
+
+    def start(self) -> None:
+        """
+        Create the underlying executor if it doesn't already exist
+        :return: Nothing
+        """
+        if self._executor is not None:
+            return
+        if self.kind == HashPoolKind.process:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="hasher"
+            )
+        logger.info(
+            f"[HashingEngine] started {self.workers} {self.kind.value} worker(s) with "
+            f"a pending limit of {self.max_pending}"
+        )
+
+    def shutdown(self) -> None:
+        """
+        Release the underlying executor and its workers
+        :return: Nothing
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def _submit(self, a_func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Run a_func in the worker pool unless the pending limit has been reached
+        :param a_func: A picklable module level function
+        :param args: Positional arguments for a_func
+        :return: The result of a_func
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            logger.warning(
+                f"[HashingEngine] rejecting request; {self.pending} hashes pending"
+            )
+            raise hashing_busy_exception
+        self.start()
+        self.pending += 1
+        try:
+            return await get_running_loop().run_in_executor(
+                self._executor, a_func, *args
+            )
+        finally:
+            self.pending -= 1
+
+    async def hash(self, a_plain_password: str) -> str:
+        """
+        Asynchronously convert a plaintext password into a hashed representation
+        :param a_plain_password: Input plaintext password
+        :return: A hashed representation
+        """
+        return await self._submit(_hash, a_plain_password)
+
+    async def verify(self, a_plain_password: str, a_hashed_password: str) -> bool:
+        """
+        Asynchronously verify a plaintext password against an expected hash
+        :param a_plain_password: A plaintext version of the password
+        :param a_hashed_password: The reference hash
+        :return: True if they match, False otherwise
+        """
+        return await self._submit(_verify, a_plain_password, a_hashed_password)
+
+
+hashing_engine = HashingEngine()
+
+
+def measure_hash_ms(a_context: CryptContext, a_samples: int = 3) -> float:
+    """
+    Measure how long a_context takes to hash a password on this host
+    :param a_context: The CryptContext to measure
+    :param a_samples: The number of hashes to time
+    :return: The median hash latency in milliseconds
+    """
+    l_timings: List[float] = []
+    for _ in range(a_samples):
+        l_start: float = perf_counter()
+        a_context.hash("calibration password")
+        l_timings.append((perf_counter() - l_start) * 1000)
+    return median(l_timings)
+
+
+def calibrate_bcrypt_rounds(
+    a_target_ms: float, a_min_rounds: int = BCRYPT_MIN_ROUNDS
+) -> Tuple[int, float]:
+    """
+    Find the highest bcrypt cost whose hash latency fits within a_target_ms. Each
+    additional round doubles the work, so stop once the next round can't fit.
+    :param a_target_ms: The per-login latency budget in milliseconds
+    :param a_min_rounds: The lowest cost which may be returned
+    :return: The chosen rounds and its measured latency in milliseconds
+    """
+    l_rounds: int = a_min_rounds
+    l_ms: float = measure_hash_ms(
+        CryptContext(schemes=["bcrypt"], bcrypt__rounds=l_rounds)
+    )
+    while l_rounds < 31 and l_ms * 2 <= a_target_ms:
+        l_next_ms: float = measure_hash_ms(
+            CryptContext(schemes=["bcrypt"], bcrypt__rounds=l_rounds + 1)
+        )
+        if l_next_ms > a_target_ms:
+            break
+        l_rounds += 1
+        l_ms = l_next_ms
+    return l_rounds, l_ms
+
+
+def calibrate_argon2_time_cost(
+    a_target_ms: float, a_memory_cost: int, a_parallelism: int
+) -> Tuple[int, float]:
+    """
+    Find the highest argon2 time cost whose hash latency fits within a_target_ms for
+    a fixed memory cost and parallelism, up to ARGON2_MAX_TIME_COST.
+    :param a_target_ms: The per-login latency budget in milliseconds
+    :param a_memory_cost: The argon2 memory cost in KiB
+    :param a_parallelism: The argon2 degree of parallelism
+    :return: The chosen time cost and its measured latency in milliseconds
+    """
+
+    def _context(a_time_cost: int) -> CryptContext:
+        return CryptContext(
+            schemes=["argon2"],
+            argon2__rounds=a_time_cost,
+            argon2__memory_cost=a_memory_cost,
+            argon2__parallelism=a_parallelism,
+        )
+
+    l_time_cost: int = 1
+    l_ms: float = measure_hash_ms(_context(l_time_cost))
+    while l_time_cost < ARGON2_MAX_TIME_COST:
+        l_next_ms: float = measure_hash_ms(_context(l_time_cost + 1))
+        if l_next_ms > a_target_ms:
+            break
+        l_time_cost += 1
+        l_ms = l_next_ms
+    return l_time_cost, l_ms
 
 
 class Hasher:
@@ -33,3 +295,34 @@ class Hasher:
         if plain_password is None:
             return None
         return pwd_context.hash(plain_password)
+
+    @staticmethod
+    async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+        """
+        Non-blocking version of verify_password which runs in the hashing_engine pool
+        :param plain_password: A plaintext version of the password
+        :param hashed_password: The reference hash
+        :return: True if they match, False otherwise
+        """
+        return await hashing_engine.verify(plain_password, hashed_password)
+
+    @staticmethod
+    async def get_password_hash_async(plain_password: Optional[str]) -> Optional[str]:
+        """
+        Non-blocking version of get_password_hash which runs in the hashing_engine pool
+        :param plain_password: Input plaintext password
+        :return: A hashed representation; else, None if input was None
+        """
+        if plain_password is None:
+            return None
+        return await hashing_engine.hash(plain_password)
+
+    @staticmethod
+    def needs_update(hashed_password: str) -> bool:
+        """
+        Determine whether a stored hash uses an outdated scheme or cost. This only
+        parses the hash string so it's safe to call on the event loop.
+        :param hashed_password: The reference hash
+        :return: True if the password should be rehashed, False otherwise
+        """
+        return pwd_context.needs_update(hashed_password)
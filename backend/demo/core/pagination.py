@@ -0,0 +1,50 @@
+"""
+Opaque cursors for keyset pagination
+"""
+from base64 import urlsafe_b64decode
+from base64 import urlsafe_b64encode
+from binascii import Error as BinasciiError
+from datetime import datetime
+from typing import Tuple
+
+from demo.schemas import MAX_USER_ID
+from fastapi import HTTPException
+from fastapi import status
+
+invalid_cursor_exception = HTTPException(
+    status_code=status.HTTP_400_BAD_REQUEST,
+    detail="Invalid pagination cursor.",
+)
+
+
+def encode_cursor(a_time: datetime, a_id: int) -> str:
+    """
+    Encode the sort key of the last row a client received. Clients treat the result as
+    opaque and send it back to continue after that row.
+    :param a_time: The row's time_created
+    :param a_id: The row's primary key, which breaks ties between equal times
+    :return: A URL safe cursor string
+    """
+    return (
+        urlsafe_b64encode(f"{a_time.isoformat()}|{a_id}".encode()).decode().rstrip("=")
+    )
+
+
+def decode_cursor(a_cursor: str) -> Tuple[datetime, int]:
+    """
+    Decode a cursor made by encode_cursor
+    :param a_cursor: The cursor provided by the client
+    :return: The (time_created, id) to continue after; HTTP 400 exception if the cursor
+    is malformed or its ID is outside the users table's range
+    """
+    try:
+        l_time, l_id = (
+            urlsafe_b64decode(a_cursor + "=" * (-len(a_cursor) % 4)).decode().split("|")
+        )
+        l_time_created, l_user_id = datetime.fromisoformat(l_time), int(l_id)
+    except (BinasciiError, UnicodeDecodeError, ValueError):
+        raise invalid_cursor_exception
+    # An ID the users table can't hold would fail the query rather than match no rows
+    if not 1 <= l_user_id <= MAX_USER_ID:
+        raise invalid_cursor_exception
+    return l_time_created, l_user_id
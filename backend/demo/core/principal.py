@@ -0,0 +1,94 @@
+"""
+Authenticated identity passed from the auth dependencies to route handlers
+"""
+from typing import Any
+from typing import Optional
+from typing import Tuple
+
+from demo.schemas.users import UserSchema
+
+
+class Principal:
+    """
+    Compact, immutable record of who made a request.
+
+    The identity was already established by verifying a token, so unlike UserSchema no
+    field is validated on creation. Convert with to_schema() only when a response body
+    needs the user's details.
+    """
+
+    __slots__ = (
+        "id",
+        "username",
+        "email",
+        "is_active",
+        "is_superuser",
+        "version",
+        "jti",
+    )
+
+    id: int
+    username: str
+    email: str
+    is_active: bool
+    is_superuser: bool
+    version: int
+    jti: Optional[str]
+
+    def __init__(
+        self,
+        a_id: int,
+        a_username: str,
+        a_email: str,
+        a_is_active: bool = False,
+        a_is_superuser: bool = False,
+        a_version: int = 1,
+        a_jti: Optional[str] = None,
+    ):
+        l_set = object.__setattr__
+        l_set(self, "id", a_id)
+        l_set(self, "username", a_username)
+        l_set(self, "email", a_email)
+        l_set(self, "is_active", a_is_active)
+        l_set(self, "is_superuser", a_is_superuser)
+        l_set(self, "version", a_version)
+        # The 'jti' claim of the token this principal was read from, if any
+        l_set(self, "jti", a_jti)
+
+    def __setattr__(self, a_name: str, a_value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, a_name: str) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def _astuple(self) -> Tuple[Any, ...]:
+        return tuple(getattr(self, l_name) for l_name in self.__slots__)
+
+    def __eq__(self, a_other: Any) -> bool:
+        if not isinstance(a_other, Principal):
+            return NotImplemented
+        return self._astuple() == a_other._astuple()
+
+    def __hash__(self) -> int:
+        return hash(self._astuple())
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(id={self.id!r}, username={self.username!r}, "
+            f"is_active={self.is_active!r}, is_superuser={self.is_superuser!r})"
+        )
+
+    def to_schema(self) -> UserSchema:
+        """
+        Convert to the UserSchema returned by routes. The fields are trusted so they
+        aren't validated again.
+        :return: A UserSchema with the same details
+        """
+        return UserSchema.construct(
+            id=self.id,
+            username=self.username,
+            email=self.email,
+            is_active=self.is_active,
+            is_superuser=self.is_superuser,
+            version=self.version,
+        )
@@ -0,0 +1,207 @@
+"""
+Token bucket rate limiting shared by every worker through Redis
+"""
+from collections import OrderedDict
+from hashlib import sha256
+from math import ceil
+from time import monotonic
+from typing import Callable
+from typing import Coroutine
+from typing import Optional
+from typing import Tuple
+from typing import Type
+
+from demo.core.config import core_config
+from demo.core.config import core_logger as logger
+from demo.core.redis_client import get_redis
+from fastapi import HTTPException
+from fastapi import Request
+from fastapi import Response
+from fastapi import status
+from fastapi.routing import APIRoute
+from redis.asyncio import Redis
+from redis.commands.core import AsyncScript
+from redis.exceptions import RedisError
+
+RATE_LIMIT_KEY_PREFIX: str = "ratelimit:"
+# Seconds to keep using the in-process buckets after Redis fails before trying it again
+REDIS_RETRY_SECONDS: float = 5.0
+
+# Refill a bucket for the time elapsed since it was last used, then take one token from
+# it if one is available. Redis' own clock is used so workers never disagree on time.
+# KEYS[1]: bucket key; ARGV: capacity, refill rate in tokens per second
+# Returns the seconds until a token is available as a string; "0" if one was taken
+_TOKEN_BUCKET_SCRIPT: str = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate))
+return tostring(retry_after)
+"""
+
+
+class LocalTokenBuckets:
+    """
+    In-process token buckets used while Redis is unavailable. Limits are enforced per
+    worker rather than across the deployment, and the least recently used buckets are
+    dropped once a_max_keys is reached so the memory used stays bounded.
+    """
+
+    def __init__(self, a_capacity: int, a_rate: float, a_max_keys: int = 10000):
+        self.capacity: int = a_capacity
+        self.rate: float = a_rate
+        self.max_keys: int = a_max_keys
+        self._buckets: OrderedDict[str, Tuple[float, float]] = OrderedDict()
+
+    def take(self, a_key: str) -> float:
+        """
+        Take a token from a_key's bucket if one is available
+        :param a_key: The bucket to take from
+        :return: 0 if a token was taken; else, the seconds until one is available
+        """
+        l_now: float = monotonic()
+        l_tokens, l_ts = self._buckets.get(a_key, (float(self.capacity), l_now))
+        l_tokens = min(self.capacity, l_tokens + (l_now - l_ts) * self.rate)
+        l_retry_after: float = 0.0
+        if l_tokens >= 1:
+            l_tokens -= 1
+        else:
+            l_retry_after = (1 - l_tokens) / self.rate
+        self._buckets[a_key] = (l_tokens, l_now)
+        self._buckets.move_to_end(a_key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return l_retry_after
+
+    def clear(self) -> None:
+        """
+        Forget every bucket
+        :return: Nothing
+        """
+        self._buckets.clear()
+
+
+class RateLimiter:
+    """
+    Token buckets enforced atomically in Redis by a server side script, one bucket per
+    key, e.g. per client IP address.
+
+    If Redis can't be reached the limiter switches to LocalTokenBuckets for
+    REDIS_RETRY_SECONDS rather than paying a connection timeout on every request.
+    """
+
+    def __init__(self, a_name: str, a_capacity: int, a_per_minute: float):
+        self.name: str = a_name
+        self.capacity: int = a_capacity
+        self.rate: float = a_per_minute / 60
+        self.local: LocalTokenBuckets = LocalTokenBuckets(a_capacity, self.rate)
+        self._redis_retry_at: float = 0.0
+        self._script: Optional[AsyncScript] = None
+        self._script_client: Optional[Redis] = None
+
+    def _key(self, a_key: str) -> str:
+        """
+        Derive the Redis key of a_key's bucket. Keys are hashed so client supplied
+        values such as usernames can't create arbitrarily long Redis keys.
+        :param a_key: The identifier being limited
+        :return: The Redis key
+        """
+        return (
+            f"{RATE_LIMIT_KEY_PREFIX}{self.name}:{sha256(a_key.encode()).hexdigest()}"
+        )
+
+    def _get_script(self) -> AsyncScript:
+        """
+        Register the token bucket script with the current Redis client once
+        :return: A callable script which loads itself into Redis on first use
+        """
+        l_redis: Redis = get_redis()
+        if self._script is None or self._script_client is not l_redis:
+            self._script = l_redis.register_script(_TOKEN_BUCKET_SCRIPT)
+            self._script_client = l_redis
+        return self._script
+
+    async def take(self, a_key: str) -> float:
+        """
+        Take a token from a_key's bucket if one is available
+        :param a_key: The identifier being limited
+        :return: 0 if a token was taken; else, the seconds until one is available
+        """
+        if monotonic() >= self._redis_retry_at:
+            try:
+                return float(
+                    await self._get_script()(
+                        keys=[self._key(a_key)], args=[self.capacity, self.rate]
+                    )
+                )
+            except (RedisError, OSError) as e:
+                logger.warning(
+                    f"[RateLimiter] {self.name} using per-worker buckets; Redis "
+                    f"failed: {e}"
+                )
+                self._redis_retry_at = monotonic() + REDIS_RETRY_SECONDS
+        return self.local.take(a_key)
+
+    async def check(self, a_key: str) -> None:
+        """
+        Take a token from a_key's bucket or reject the request
+        :param a_key: The identifier being limited
+        :return: Nothing; HTTP 429 exception if the bucket is empty
+        """
+        l_retry_after: float = await self.take(a_key)
+        if l_retry_after > 0:
+            logger.info(f"[RateLimiter] {self.name} limit reached")
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests. Please try again later.",
+                headers={"Retry-After": str(ceil(l_retry_after))},
+            )
+
+
+def client_ip_rate_limited_route(a_limiter: RateLimiter) -> Type[APIRoute]:
+    """
+    Create an APIRoute class which applies a_limiter to each client IP address before
+    the request body is read. FastAPI parses form and JSON bodies before resolving any
+    dependency, so a dependency would be too late to spare that work.
+    :param a_limiter: The RateLimiter to apply
+    :return: An APIRoute subclass for use as a route_class
+    """
+
+    class ClientIPRateLimitedRoute(APIRoute):
+        def get_route_handler(
+            self,
+        ) -> Callable[[Request], Coroutine[None, None, Response]]:
+            l_handler = super().get_route_handler()
+
+            async def rate_limited_handler(request: Request) -> Response:
+                l_ip: str = request.client.host if request.client else "unknown"
+                await a_limiter.check(l_ip)
+                return await l_handler(request)
+
+            return rate_limited_handler
+
+    return ClientIPRateLimitedRoute
+
+
+login_ip_rate_limiter = RateLimiter(
+    "login-ip",
+    core_config.LOGIN_RATE_LIMIT_IP_BURST,
+    core_config.LOGIN_RATE_LIMIT_IP_PER_MINUTE,
+)
+login_username_rate_limiter = RateLimiter(
+    "login-username",
+    core_config.LOGIN_RATE_LIMIT_USERNAME_BURST,
+    core_config.LOGIN_RATE_LIMIT_USERNAME_PER_MINUTE,
+)
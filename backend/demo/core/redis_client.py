@@ -0,0 +1,42 @@
+"""
+Shared asyncio Redis client used by the API workers
+"""
+from typing import Optional
+
+from demo.core.config import core_config
+from redis.asyncio import Redis
+
+_redis: Optional[Redis] = None
+
+
+def get_redis() -> Redis:
+    """
+    Lazily create the worker's Redis client. Connections are opened on first use and
+    pooled, so calling this is cheap.
+    :return: An asyncio Redis client which decodes responses to str
+    """
+    global _redis
+    if _redis is None:
+        _redis = Redis.from_url(str(core_config.REDIS_URI), decode_responses=True)
+    return _redis
+
+
+def set_redis(a_client: Optional[Redis]) -> None:
+    """
+    Replace the worker's Redis client, e.g. with a local stand-in during tests
+    :param a_client: An asyncio Redis compatible client; None to recreate on next use
+    :return: Nothing
+    """
+    global _redis
+    _redis = a_client
+
+
+async def close_redis() -> None:
+    """
+    Close the worker's Redis client and its connection pool
+    :return: Nothing
+    """
+    global _redis
+    if _redis is not None:
+        await _redis.close()
+        _redis = None
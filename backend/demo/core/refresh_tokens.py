@@ -0,0 +1,158 @@
+"""
+Opaque, rotating refresh tokens which mint new access tokens without a password check
+"""
+import hmac
+from hashlib import sha256
+from secrets import token_urlsafe
+from typing import Optional
+from typing import Tuple
+
+from demo.core.config import core_config
+from demo.core.config import core_logger as logger
+from demo.core.redis_client import get_redis
+from demo.core.tokens import TokenError
+from fastapi import HTTPException
+from fastapi import status
+from redis.exceptions import RedisError
+
+REFRESH_KEY_PREFIX: str = "refresh:"
+REFRESH_FAMILY_KEY_PREFIX: str = "refresh-family:"
+
+# Atomically advance a token family from the presented token to its replacement. If the
+# presented token isn't the family's current token it was already rotated, i.e. it has
+# been replayed, so the whole family is revoked.
+# KEYS[1]: family key; ARGV: presented digest, replacement digest, TTL in seconds
+_ROTATE_SCRIPT: str = """
+local current = redis.call('GET', KEYS[1])
+if current == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+if current then
+    redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+refresh_unavailable_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="Token refresh is temporarily unavailable. Please try again shortly.",
+    headers={"Retry-After": "1"},
+)
+
+
+class RefreshTokenStore:
+    """
+    Refresh tokens are random strings which are only ever stored as an HMAC-SHA256
+    digest, so checking one costs microseconds rather than a password hash.
+
+    Each login starts a token family. Redeeming a token replaces it with a new token in
+    the same family, and presenting an already redeemed token revokes the family.
+    """
+
+    def __init__(
+        self,
+        a_secret_key: str = core_config.SECRET_KEY,
+        a_expire_minutes: int = core_config.REFRESH_TOKEN_EXPIRE_MINUTES,
+    ):
+        # Derive a dedicated key so digests can't be confused with anything else
+        # signed with SECRET_KEY
+        self._key: bytes = hmac.new(
+            a_secret_key.encode(), b"refresh-token", sha256
+        ).digest()
+        self.ttl_seconds: int = a_expire_minutes * 60
+
+    def _digest(self, a_token: str) -> str:
+        """
+        Derive the stored form of a refresh token
+        :param a_token: A refresh token as presented by the client
+        :return: The hex encoded HMAC-SHA256 of the token
+        """
+        return hmac.new(self._key, a_token.encode(), sha256).hexdigest()
+
+    async def _store(self, a_subject: str, a_family: str) -> Tuple[str, str]:
+        """
+        Generate a new refresh token and record which subject and family it belongs to
+        :param a_subject: The 'sub' claim for access tokens minted from the token
+        :param a_family: The token family the new token belongs to
+        :return: The new refresh token and its digest
+        """
+        l_token: str = token_urlsafe(32)
+        l_digest: str = self._digest(l_token)
+        await get_redis().set(
+            f"{REFRESH_KEY_PREFIX}{l_digest}",
+            f"{a_subject}:{a_family}",
+            ex=self.ttl_seconds,
+        )
+        return l_token, l_digest
+
+    async def issue(self, a_subject: str) -> Optional[str]:
+        """
+        Start a new token family, e.g. after a successful password login
+        :param a_subject: The 'sub' claim for access tokens minted from the token
+        :return: A new refresh token; None if Redis is unavailable, in which case the
+        client must fall back to logging in with its password
+        """
+        l_family: str = token_urlsafe(16)
+        try:
+            l_token, l_digest = await self._store(a_subject, l_family)
+            await get_redis().set(
+                f"{REFRESH_FAMILY_KEY_PREFIX}{l_family}", l_digest, ex=self.ttl_seconds
+            )
+        except RedisError as e:
+            logger.warning(f"[RefreshTokenStore] failed to issue a refresh token: {e}")
+            return None
+        return l_token
+
+    async def rotate(self, a_token: str) -> Tuple[str, str]:
+        """
+        Redeem a refresh token for a replacement in the same family
+        :param a_token: A refresh token as presented by the client
+        :return: The subject the token was issued to and the replacement refresh token;
+        TokenError if the token is unknown, expired, or was already redeemed
+        """
+        l_digest: str = self._digest(a_token)
+        l_redis = get_redis()
+        try:
+            l_record: Optional[str] = await l_redis.get(
+                f"{REFRESH_KEY_PREFIX}{l_digest}"
+            )
+            if l_record is None:
+                raise TokenError("Unknown or expired refresh token")
+            l_subject, l_family = l_record.rsplit(":", 1)
+            l_token, l_new_digest = await self._store(l_subject, l_family)
+            l_rotated: int = await l_redis.register_script(_ROTATE_SCRIPT)(
+                keys=[f"{REFRESH_FAMILY_KEY_PREFIX}{l_family}"],
+                args=[l_digest, l_new_digest, self.ttl_seconds],
+            )
+        except RedisError as e:
+            logger.warning(f"[RefreshTokenStore] failed to rotate a refresh token: {e}")
+            raise refresh_unavailable_exception
+        if not l_rotated:
+            logger.warning(
+                f"[RefreshTokenStore] refresh token reuse for subject {l_subject}; "
+                f"revoked its token family"
+            )
+            raise TokenError("Refresh token was already redeemed")
+        return l_subject, l_token
+
+    async def revoke(self, a_token: str) -> None:
+        """
+        Revoke the family a refresh token belongs to, e.g. on logout
+        :param a_token: A refresh token as presented by the client
+        :return: Nothing
+        """
+        l_redis = get_redis()
+        try:
+            l_record: Optional[str] = await l_redis.get(
+                f"{REFRESH_KEY_PREFIX}{self._digest(a_token)}"
+            )
+            if l_record is not None:
+                l_family: str = l_record.rsplit(":", 1)[1]
+                await l_redis.delete(f"{REFRESH_FAMILY_KEY_PREFIX}{l_family}")
+        except RedisError as e:
+            logger.warning(f"[RefreshTokenStore] failed to revoke a refresh token: {e}")
+            raise refresh_unavailable_exception
+
+
+refresh_token_store = RefreshTokenStore()
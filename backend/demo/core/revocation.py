@@ -0,0 +1,220 @@
+"""
+Revocation of access tokens before they expire
+"""
+from asyncio import CancelledError
+from asyncio import create_task
+from asyncio import sleep
+from asyncio import Task
+from hashlib import blake2b
+from math import ceil
+from math import log
+from time import monotonic
+from time import time
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+from demo.core.config import core_config
+from demo.core.config import core_logger as logger
+from demo.core.redis_client import get_redis
+from fastapi import HTTPException
+from fastapi import status
+from redis.exceptions import RedisError
+
+REVOKED_KEY_PREFIX: str = "revoked:"
+REVOCATION_CHANNEL: str = "revocations"
+# Seconds to wait before resubscribing after losing the Redis connection
+RECONNECT_SECONDS: float = 5.0
+
+revocation_unavailable_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="Token revocation is temporarily unavailable. Please try again shortly.",
+    headers={"Retry-After": "1"},
+)
+
+
+class BloomFilter:
+    """
+    Fixed size set membership filter which may report false positives but never false
+    negatives. Bit positions are derived from a single BLAKE2b digest using double
+    hashing, so each add or lookup costs one hash regardless of the number of probes.
+    """
+
+    def __init__(self, a_capacity: int, a_error_rate: float):
+        self.capacity: int = a_capacity
+        self.error_rate: float = a_error_rate
+        self.size: int = max(8, ceil(-a_capacity * log(a_error_rate) / (log(2) ** 2)))
+        self.probes: int = max(1, round(self.size / a_capacity * log(2)))
+        self.count: int = 0
+        self._bits: bytearray = bytearray(ceil(self.size / 8))
+
+    def _positions(self, a_item: str) -> Iterator[int]:
+        """
+        Derive the bit positions representing a_item
+        :param a_item: The member to locate
+        :return: An iterator of self.probes bit positions
+        """
+        l_digest: bytes = blake2b(a_item.encode(), digest_size=16).digest()
+        l_h1: int = int.from_bytes(l_digest[:8], "little")
+        # Keep the step non-zero so the probes never collapse onto a single bit
+        l_h2: int = int.from_bytes(l_digest[8:], "little") | 1
+        for i in range(self.probes):
+            yield (l_h1 + i * l_h2) % self.size
+
+    def add(self, a_item: str) -> None:
+        """
+        Add a_item to the filter
+        :param a_item: The member to add
+        :return: Nothing
+        """
+        for l_position in self._positions(a_item):
+            self._bits[l_position >> 3] |= 1 << (l_position & 7)
+        self.count += 1
+
+    def __contains__(self, a_item: str) -> bool:
+        return all(
+            self._bits[l_position >> 3] & (1 << (l_position & 7))
+            for l_position in self._positions(a_item)
+        )
+
+
+class RevocationList:
+    """
+    Revoked token IDs ('jti' claims) are stored in Redis with a TTL equal to the
+    token's remaining lifetime and announced on a pub/sub channel.
+
+    Each worker mirrors the announcements in a BloomFilter so checking a token which
+    hasn't been revoked, the overwhelmingly common case, never leaves the process. Only
+    filter hits are confirmed against Redis.
+    """
+
+    def __init__(
+        self,
+        a_capacity: int = core_config.REVOCATION_BLOOM_CAPACITY,
+        a_error_rate: float = core_config.REVOCATION_BLOOM_ERROR_RATE,
+        a_rebuild_seconds: int = core_config.REVOCATION_REBUILD_SECONDS,
+    ):
+        self.capacity: int = a_capacity
+        self.error_rate: float = a_error_rate
+        self.rebuild_seconds: int = a_rebuild_seconds
+        # Number of filter hits which had to be confirmed against Redis
+        self.confirmations: int = 0
+        self._bloom: BloomFilter = BloomFilter(a_capacity, a_error_rate)
+        self._listener: Optional[Task] = None
+
+    @staticmethod
+    def _key(a_jti: str) -> str:
+        """
+        Derive the Redis key which marks a_jti as revoked
+        :param a_jti: A token's 'jti' claim
+        :return: The Redis key
+        """
+        return f"{REVOKED_KEY_PREFIX}{a_jti}"
+
+    async def revoke(self, a_jti: str, a_expires_at: float) -> None:
+        """
+        Revoke a token until it would have expired anyway
+        :param a_jti: The token's 'jti' claim
+        :param a_expires_at: The token's 'exp' claim as a POSIX timestamp
+        :return: Nothing
+        """
+        l_ttl: int = ceil(a_expires_at - time())
+        if l_ttl <= 0:
+            return
+        l_redis = get_redis()
+        try:
+            await l_redis.set(self._key(a_jti), 1, ex=l_ttl)
+            await l_redis.publish(REVOCATION_CHANNEL, a_jti)
+        except RedisError as e:
+            logger.warning(f"[RevocationList] failed to revoke a token: {e}")
+            raise revocation_unavailable_exception
+        # Don't wait for the announcement to make it back to this worker
+        self._bloom.add(a_jti)
+
+    async def is_revoked(self, a_jti: Optional[str]) -> bool:
+        """
+        Determine whether a token has been revoked
+        :param a_jti: The token's 'jti' claim, if any
+        :return: True if the token was revoked, False otherwise
+        """
+        if a_jti is None or a_jti not in self._bloom:
+            return False
+        self.confirmations += 1
+        try:
+            return bool(await get_redis().exists(self._key(a_jti)))
+        except RedisError as e:
+            # A filter hit is almost certainly a revoked token so fail closed
+            logger.warning(f"[RevocationList] unable to confirm a revocation: {e}")
+            return True
+
+    async def rebuild(self) -> None:
+        """
+        Replace the filter with one holding exactly the revocations currently in Redis.
+        This drops revocations whose tokens have since expired and resizes the filter if
+        more tokens were revoked than it was sized for.
+        :return: Nothing
+        """
+        l_jtis: List[str] = [
+            l_key[len(REVOKED_KEY_PREFIX) :]
+            async for l_key in get_redis().scan_iter(
+                match=f"{REVOKED_KEY_PREFIX}*", count=1000
+            )
+        ]
+        l_bloom = BloomFilter(max(self.capacity, len(l_jtis) * 2), self.error_rate)
+        for l_jti in l_jtis:
+            l_bloom.add(l_jti)
+        self._bloom = l_bloom
+        logger.debug(f"[RevocationList] rebuilt filter with {len(l_jtis)} entries")
+
+    async def _listen(self) -> None:
+        """
+        Mirror announced revocations into the filter and periodically rebuild it,
+        resubscribing whenever the connection to Redis is lost
+        :return: Nothing
+        """
+        while True:
+            try:
+                l_pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+                try:
+                    # Subscribe before rebuilding so no announcement is missed between
+                    await l_pubsub.subscribe(REVOCATION_CHANNEL)
+                    await self.rebuild()
+                    l_next_rebuild: float = monotonic() + self.rebuild_seconds
+                    while True:
+                        l_message = await l_pubsub.get_message(timeout=1.0)
+                        if l_message is not None:
+                            self._bloom.add(l_message["data"])
+                        if monotonic() >= l_next_rebuild:
+                            await self.rebuild()
+                            l_next_rebuild = monotonic() + self.rebuild_seconds
+                finally:
+                    await l_pubsub.reset()
+            except CancelledError:
+                raise
+            except (RedisError, OSError) as e:
+                logger.warning(f"[RevocationList] lost revocation announcements: {e}")
+                await sleep(RECONNECT_SECONDS)
+
+    def start(self) -> None:
+        """
+        Begin mirroring revocations from Redis in a background task
+        :return: Nothing
+        """
+        if self._listener is None:
+            self._listener = create_task(self._listen())
+
+    async def stop(self) -> None:
+        """
+        Stop mirroring revocations from Redis
+        :return: Nothing
+        """
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except CancelledError:
+                pass
+            self._listener = None
+
+
+revocation_list = RevocationList()
@@ -5,9 +5,11 @@ from datetime import datetime
 from datetime import timedelta
 from typing import Dict
 from typing import Optional
+from uuid import uuid4
 
 from demo.core.config import core_config
 from demo.core.config import core_logger as logger
+from demo.core.tokens import token_codec
 from email_validator import EmailNotValidError
 from email_validator import validate_email
 from fastapi import HTTPException
@@ -16,7 +18,6 @@ from fastapi import status
 from fastapi.openapi.models import OAuthFlows as OAuthFlowsModel
 from fastapi.security import OAuth2
 from fastapi.security.utils import get_authorization_scheme_param
-from jose import jwt
 
 
 def sanitize_email(
@@ -50,13 +51,13 @@ def sanitize_email(
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """
     Cryptographically generate an ephemeral access token using a secret key and the
-    current time.
+    current time. Each token receives a unique 'jti' claim so it may be revoked.
 
     Args:
         data: Any key:value pairs to embed in the JWT
         expires_delta: The duration the token should remain valid
 
-    Returns: The data encrypted as a JSON Web Token using the server's secret key
+    Returns: The data signed as a JSON Web Token using the configured token_codec
 
     """
     to_encode = data.copy()
@@ -66,10 +67,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + timedelta(
             minutes=core_config.ACCESS_TOKEN_EXPIRE_MINUTES
         )
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(
-        to_encode, core_config.SECRET_KEY, algorithm=core_config.HASH_ALGORITHM
-    )
+    to_encode.update({"exp": expire, "jti": uuid4().hex})
+    encoded_jwt = token_codec.encode(to_encode)
     return encoded_jwt
 
 
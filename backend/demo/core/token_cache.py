@@ -0,0 +1,108 @@
+"""
+Per-worker cache of already verified JSON Web Tokens
+"""
+from collections import OrderedDict
+from hashlib import sha256
+from time import time
+from typing import Any
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+from demo.core.config import core_config
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU mapping of raw tokens to the claims verified from them.
+
+    Entries are keyed by a SHA-256 digest so raw bearer tokens are never held in memory
+    longer than the request which presented them. Each entry records the token's 'exp'
+    claim and is never returned after that moment, so a hit is exactly as trustworthy
+    as repeating the signature check. Only claims which can't change while the token
+    is valid are cached; details of its user are not.
+    """
+
+    def __init__(self, a_max_size: int = core_config.TOKEN_CACHE_SIZE):
+        self.max_size: int = a_max_size
+        self.hits: int = 0
+        self.misses: int = 0
+        self._entries: OrderedDict[bytes, Tuple[float, Any]] = OrderedDict()
+
+    @staticmethod
+    def _key(a_token: str) -> bytes:
+        """
+        Derive the cache key for a raw token
+        :param a_token: A JWT as presented by the client
+        :return: The SHA-256 digest of the token
+        """
+        return sha256(a_token.encode()).digest()
+
+    def get(self, a_token: str) -> Optional[Any]:
+        """
+        Retrieve the claims previously verified from a_token
+        :param a_token: A JWT as presented by the client
+        :return: The cached claims if present and unexpired; None otherwise
+        """
+        l_key: bytes = self._key(a_token)
+        l_entry: Optional[Tuple[float, Any]] = self._entries.get(l_key)
+        if l_entry is None:
+            self.misses += 1
+            return None
+        if l_entry[0] <= time():
+            del self._entries[l_key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(l_key)
+        self.hits += 1
+        return l_entry[1]
+
+    def put(self, a_token: str, a_claims: Any, a_expires_at: float) -> None:
+        """
+        Remember the claims of a verified token
+        :param a_token: A JWT as presented by the client
+        :param a_claims: The claims the token was verified to carry
+        :param a_expires_at: The token's 'exp' claim as a POSIX timestamp
+        :return: Nothing
+        """
+        if self.max_size <= 0 or a_expires_at <= time():
+            return
+        l_key: bytes = self._key(a_token)
+        self._entries[l_key] = (a_expires_at, a_claims)
+        self._entries.move_to_end(l_key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def evict(self, a_token: str) -> None:
+        """
+        Forget a_token, e.g. because it has been revoked
+        :param a_token: A JWT as presented by the client
+        :return: Nothing
+        """
+        self._entries.pop(self._key(a_token), None)
+
+    def clear(self) -> None:
+        """
+        Forget every cached token and reset the counters
+        :return: Nothing
+        """
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Report the cache occupancy and effectiveness
+        :return: A dict of size, max_size, hits, misses, and hit_ratio
+        """
+        l_lookups: int = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / l_lookups if l_lookups else 0.0,
+        }
+
+
+verified_token_cache = VerifiedTokenCache()
@@ -0,0 +1,336 @@
+"""
+Interchangeable JSON Web Token codecs.
+
+Key material is parsed once when a codec is created instead of on every encode and
+decode. The active codec is chosen with the TOKEN_BACKEND setting and exposed as
+token_codec.
+
+Asymmetric algorithms (EdDSA, ES*, RS*, PS*) stamp every token with a 'kid' header
+and publish their public keys as a JSON Web Key Set, so downstream services can verify
+tokens locally. Retired public keys listed in JWT_PUBLIC_KEY_FILES keep verifying, and
+stay published, which allows signing keys to be rotated without invalidating tokens
+that are still in circulation.
+"""
+from abc import ABC
+from abc import abstractmethod
+from base64 import urlsafe_b64encode
+from hashlib import sha256
+from json import dumps
+from json import loads
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import jwt as pyjwt
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import Encoding
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+from cryptography.hazmat.primitives.serialization import NoEncryption
+from cryptography.hazmat.primitives.serialization import PrivateFormat
+from cryptography.hazmat.primitives.serialization import PublicFormat
+from demo.core.config import core_config
+from demo.core.config import CoreConfig
+from demo.core.config import TokenBackend
+from jose import jwk
+from jose import jwt as jose_jwt
+from jose.exceptions import JOSEError
+from jwt.algorithms import get_default_algorithms
+
+# The members of each key type which contribute to an RFC 7638 JWK thumbprint
+_thumbprint_members: Dict[str, Tuple[str, ...]] = {
+    "EC": ("crv", "kty", "x", "y"),
+    "OKP": ("crv", "kty", "x"),
+    "RSA": ("e", "kty", "n"),
+}
+
+_ec_algorithm_curves: Dict[str, Any] = {
+    "ES256": ec.SECP256R1,
+    "ES384": ec.SECP384R1,
+    "ES512": ec.SECP521R1,
+}
+
+
+class TokenError(Exception):
+    """
+    Raised when a token can't be encoded or fails decoding or verification
+    """
+
+
+def is_symmetric(a_algorithm: str) -> bool:
+    """
+    Determine whether a JWS algorithm uses a shared secret rather than a key pair
+    :param a_algorithm: A JWS algorithm name such as HS256 or EdDSA
+    :return: True for HMAC based algorithms, False otherwise
+    """
+    return a_algorithm.upper().startswith("HS")
+
+
+def infer_algorithm(a_public_key: Any) -> str:
+    """
+    Choose the JWS algorithm for a retired public key from its key type
+    :param a_public_key: A cryptography public key
+    :return: A JWS algorithm name
+    """
+    if isinstance(a_public_key, ed25519.Ed25519PublicKey):
+        return "EdDSA"
+    if isinstance(a_public_key, ec.EllipticCurvePublicKey):
+        for l_algorithm, l_curve in _ec_algorithm_curves.items():
+            if a_public_key.curve.name == l_curve.name:
+                return l_algorithm
+    if isinstance(a_public_key, rsa.RSAPublicKey):
+        return "RS256"
+    raise TokenError(f"Unsupported public key type {type(a_public_key).__name__}")
+
+
+def public_jwk(a_public_key: Any, a_algorithm: str) -> Dict[str, str]:
+    """
+    Describe a public key as a JSON Web Key identified by its RFC 7638 thumbprint
+    :param a_public_key: A cryptography public key
+    :param a_algorithm: The JWS algorithm the key is used with
+    :return: A JWK dict including 'kid', 'alg', and 'use'
+    """
+    l_jwk: Dict[str, str] = loads(
+        get_default_algorithms()[a_algorithm].to_jwk(a_public_key)
+    )
+    l_members: Dict[str, str] = {k: l_jwk[k] for k in _thumbprint_members[l_jwk["kty"]]}
+    l_digest: bytes = sha256(
+        dumps(l_members, separators=(",", ":"), sort_keys=True).encode()
+    ).digest()
+    l_jwk["kid"] = urlsafe_b64encode(l_digest).rstrip(b"=").decode()
+    l_jwk["alg"] = a_algorithm
+    l_jwk["use"] = "sig"
+    return l_jwk
+
+
+def generate_signing_key_pem(a_algorithm: str) -> Tuple[bytes, bytes]:
+    """
+    Create a new key pair for an asymmetric JWS algorithm
+    :param a_algorithm: One of EdDSA, ES256, ES384, ES512, RS256, RS384, or RS512
+    :return: A (PEM private key, PEM public key) tuple
+    """
+    if a_algorithm == "EdDSA":
+        l_private_key = ed25519.Ed25519PrivateKey.generate()
+    elif a_algorithm in _ec_algorithm_curves:
+        l_private_key = ec.generate_private_key(_ec_algorithm_curves[a_algorithm]())
+    elif a_algorithm in ("RS256", "RS384", "RS512"):
+        l_private_key = rsa.generate_private_key(public_exponent=65537, key_size=3072)
+    else:
+        raise TokenError(f"Can't generate a key pair for {a_algorithm}")
+    return (
+        l_private_key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption()),
+        l_private_key.public_key().public_bytes(
+            Encoding.PEM, PublicFormat.SubjectPublicKeyInfo
+        ),
+    )
+
+
+class KeyRing:
+    """
+    The active signing key plus every key accepted for verification, indexed by kid.
+
+    Symmetric (HS*) key rings have no kid and publish nothing since the shared secret
+    must never leave this service.
+    """
+
+    def __init__(
+        self,
+        a_algorithm: str,
+        a_signing_key: Any,
+        a_verifying_key: Any,
+        a_retired_public_keys: Sequence[Any] = (),
+    ):
+        """
+        :param a_algorithm: The JWS algorithm used to sign new tokens
+        :param a_signing_key: A shared secret (bytes) or a cryptography private key
+        :param a_verifying_key: A shared secret (bytes) or a cryptography public key
+        :param a_retired_public_keys: Public keys which only verify existing tokens
+        """
+        self.algorithm: str = a_algorithm
+        self.signing_key: Any = a_signing_key
+        self.kid: Optional[str] = None
+        self.jwks: Dict[str, List[Dict[str, str]]] = {"keys": []}
+        # Tokens without a 'kid' header are checked against the active key
+        self.verifying_keys: Dict[Optional[str], Tuple[str, Any]] = {
+            None: (a_algorithm, a_verifying_key)
+        }
+        if is_symmetric(a_algorithm):
+            return
+
+        l_active_jwk: Dict[str, str] = public_jwk(a_verifying_key, a_algorithm)
+        self.kid = l_active_jwk["kid"]
+        self.verifying_keys[self.kid] = (a_algorithm, a_verifying_key)
+        self.jwks["keys"].append(l_active_jwk)
+        for l_public_key in a_retired_public_keys:
+            l_algorithm: str = infer_algorithm(l_public_key)
+            l_jwk: Dict[str, str] = public_jwk(l_public_key, l_algorithm)
+            if l_jwk["kid"] not in self.verifying_keys:
+                self.verifying_keys[l_jwk["kid"]] = (l_algorithm, l_public_key)
+                self.jwks["keys"].append(l_jwk)
+
+    def verifying_key(self, a_kid: Optional[str]) -> Tuple[str, Any]:
+        """
+        Find the key which must have signed a token with the given 'kid' header
+        :param a_kid: The token's 'kid' header, if any
+        :return: An (algorithm, key) tuple; raises TokenError for unknown kids
+        """
+        try:
+            return self.verifying_keys[a_kid]
+        except KeyError:
+            raise TokenError(f"Unknown signing key {a_kid}")
+
+
+def load_key_ring(a_config: CoreConfig = core_config) -> KeyRing:
+    """
+    Parse the configured key material into ready to use key objects
+    :param a_config: The BaseSettings from demo.core.config
+    :return: A KeyRing for the configured HASH_ALGORITHM
+    """
+    if is_symmetric(a_config.HASH_ALGORITHM):
+        l_secret: bytes = a_config.SECRET_KEY.encode()
+        return KeyRing(a_config.HASH_ALGORITHM, l_secret, l_secret)
+    if a_config.JWT_PRIVATE_KEY_FILE is None:
+        raise TokenError(
+            f"HASH_ALGORITHM {a_config.HASH_ALGORITHM} requires JWT_PRIVATE_KEY_FILE"
+        )
+    l_private_key = load_pem_private_key(
+        a_config.JWT_PRIVATE_KEY_FILE.read_bytes(), password=None
+    )
+    l_retired_keys: List[Any] = [
+        load_pem_public_key(Path(l_path).read_bytes())
+        for l_path in a_config.JWT_PUBLIC_KEY_FILES
+    ]
+    return KeyRing(
+        a_config.HASH_ALGORITHM,
+        l_private_key,
+        l_private_key.public_key(),
+        l_retired_keys,
+    )
+
+
+class TokenCodec(ABC):
+    """
+    Encode claims into, and decode claims from, signed JSON Web Tokens
+    """
+
+    name: str = ""
+
+    def __init__(self, a_key_ring: KeyRing):
+        """
+        :param a_key_ring: The keys used to sign and verify tokens
+        """
+        self.key_ring: KeyRing = a_key_ring
+        self._headers: Optional[Dict[str, str]] = (
+            {"kid": a_key_ring.kid} if a_key_ring.kid else None
+        )
+
+    @abstractmethod
+    def encode(self, a_claims: Dict[str, Any]) -> str:
+        """
+        Sign a_claims into a compact JWT
+        :param a_claims: The claims to embed in the token
+        :return: The encoded token
+        """
+
+    @abstractmethod
+    def decode(self, a_token: str) -> Dict[str, Any]:
+        """
+        Verify a_token's signature and expiration then return its claims
+        :param a_token: A compact JWT
+        :return: The verified claims; raises TokenError otherwise
+        """
+
+
+class PyJWTCodec(TokenCodec):
+    """
+    Codec backed by PyJWT which accepts cryptography key objects directly
+    """
+
+    name = "pyjwt"
+
+    def encode(self, a_claims: Dict[str, Any]) -> str:
+        try:
+            return pyjwt.encode(
+                a_claims,
+                self.key_ring.signing_key,
+                algorithm=self.key_ring.algorithm,
+                headers=self._headers,
+            )
+        except (pyjwt.PyJWTError, TypeError, ValueError) as e:
+            raise TokenError(e) from e
+
+    def decode(self, a_token: str) -> Dict[str, Any]:
+        try:
+            l_algorithm, l_key = self.key_ring.verifying_key(
+                pyjwt.get_unverified_header(a_token).get("kid")
+            )
+            return pyjwt.decode(a_token, l_key, algorithms=[l_algorithm])
+        except pyjwt.PyJWTError as e:
+            raise TokenError(e) from e
+
+
+class JoseCodec(TokenCodec):
+    """
+    Codec backed by python-jose. Keys are converted to jose Key objects up front so
+    jose doesn't reconstruct them on every call.
+    """
+
+    name = "jose"
+
+    def __init__(self, a_key_ring: KeyRing):
+        super().__init__(a_key_ring)
+        try:
+            self._signing_key = jwk.construct(
+                a_key_ring.signing_key, a_key_ring.algorithm
+            )
+            self._verifying_keys: Dict[Optional[str], Tuple[str, Any]] = {
+                l_kid: (l_algorithm, jwk.construct(l_key, l_algorithm))
+                for l_kid, (l_algorithm, l_key) in a_key_ring.verifying_keys.items()
+            }
+        except JOSEError as e:
+            raise TokenError(e) from e
+
+    def encode(self, a_claims: Dict[str, Any]) -> str:
+        try:
+            return jose_jwt.encode(
+                a_claims,
+                self._signing_key,
+                algorithm=self.key_ring.algorithm,
+                headers=self._headers,
+            )
+        except JOSEError as e:
+            raise TokenError(e) from e
+
+    def decode(self, a_token: str) -> Dict[str, Any]:
+        try:
+            l_kid: Optional[str] = jose_jwt.get_unverified_header(a_token).get("kid")
+            if l_kid not in self._verifying_keys:
+                raise TokenError(f"Unknown signing key {l_kid}")
+            l_algorithm, l_key = self._verifying_keys[l_kid]
+            return jose_jwt.decode(a_token, l_key, algorithms=[l_algorithm])
+        except JOSEError as e:
+            raise TokenError(e) from e
+
+
+token_backends: Dict[TokenBackend, type] = {
+    TokenBackend.pyjwt: PyJWTCodec,
+    TokenBackend.jose: JoseCodec,
+}
+
+
+def create_token_codec(a_config: CoreConfig = core_config) -> TokenCodec:
+    """
+    Build the configured codec with its keys already parsed
+    :param a_config: The BaseSettings from demo.core.config
+    :return: A ready to use TokenCodec
+    """
+    return token_backends[a_config.TOKEN_BACKEND](load_key_ring(a_config))
+
+
+token_codec: TokenCodec = create_token_codec()
@@ -4,34 +4,123 @@ maintain a concept of the global database schema.
 
 https://docs.sqlalchemy.org/en/14/tutorial/metadata.html#defining-table-metadata-with-the-orm
 """
+from typing import Any
+from typing import AsyncIterator
+from typing import Dict
+from typing import List
+from typing import Mapping
 from typing import Optional
+from typing import Tuple
+from uuid import uuid4
 
+from asyncpg import Connection
 from demo.core.config import core_config
+from fastapi import HTTPException
+from fastapi import Request
+from fastapi import status
 from fastapi.logger import logger
-from sqlalchemy import create_engine
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.engine import RowMapping
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.ext.declarative import DeclarativeMeta
 from sqlalchemy.orm import registry
-from sqlalchemy.orm import Session
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.expression import Executable
 
 logger.info(f"[demo.database] Database URI being used: {core_config.DATABASE_URI}")
 
-engine_default: Engine = create_engine(
-    core_config.DATABASE_URI, pool_pre_ping=True, future=True
+
+def async_database_url(a_uri: str) -> URL:
+    """
+    Select the asyncpg driver for a postgresql:// URI
+    :param a_uri: A URI such as core_config.DATABASE_URI
+    :return: The equivalent postgresql+asyncpg URL
+    """
+    return make_url(str(a_uri)).set(drivername="postgresql+asyncpg")
+
+
+class PoolerConnection(Connection):
+    """
+    An asyncpg connection which names its prepared statements with a UUID. asyncpg
+    numbers them from a per process counter, so behind a transaction pooler two
+    workers could otherwise prepare the same name on one server connection.
+    """
+
+    def _get_unique_id(self, a_prefix: str) -> str:
+        return f"__asyncpg_{a_prefix}_{uuid4().hex}__"
+
+
+def connect_args(
+    a_transaction_pooler: bool = core_config.DATABASE_TRANSACTION_POOLER,
+) -> Dict[str, Any]:
+    """
+    Driver arguments which make a connection safe behind a transaction pooler. A
+    statement prepared in one transaction may be missing from the server connection
+    the next one gets, so asyncpg's and SQLAlchemy's statement caches are disabled and
+    every statement is prepared, under a unique name, in the transaction running it.
+    :param a_transaction_pooler: Whether connections go through a transaction pooler
+    :return: connect_args for create_async_engine; empty without a pooler
+    """
+    if not a_transaction_pooler:
+        return {}
+    return {
+        "statement_cache_size": 0,
+        "prepared_statement_cache_size": 0,
+        "connection_class": PoolerConnection,
+    }
+
+
+def pool_budget(
+    a_max_connections: int,
+    a_workers: int,
+    a_transaction_pooler: bool = core_config.DATABASE_TRANSACTION_POOLER,
+) -> Tuple[int, int]:
+    """
+    Split the connections the whole deployment may open evenly between its gunicorn
+    workers. Half of each worker's share is kept open in the pool and the rest is
+    overflow which is opened during bursts and closed again once returned.
+
+    Behind a transaction pooler an idle connection holds no Postgres backend, while
+    opening one costs a handshake and asyncpg's type introspection, so the whole share
+    is kept open instead.
+    :param a_max_connections: Connections all workers together may hold
+    :param a_workers: The number of gunicorn workers
+    :param a_transaction_pooler: Whether connections go through a transaction pooler
+    :return: The pool_size and max_overflow of one worker's engine
+    """
+    l_per_worker: int = max(1, a_max_connections // a_workers)
+    if a_transaction_pooler:
+        return l_per_worker, 0
+    l_pool_size: int = (l_per_worker + 1) // 2
+    return l_pool_size, l_per_worker - l_pool_size
+
+
+l_pool_size, l_max_overflow = pool_budget(
+    core_config.DATABASE_MAX_CONNECTIONS, core_config.WEB_CONCURRENCY
 )
-# NOTE: We're using the DATABASE_URI_GENERIC here. See the notes in core_config.
-engine_generic: Engine = create_engine(
-    core_config.DATABASE_URI_GENERIC,
-    isolation_level="AUTOCOMMIT",
-    echo=True,
-    future=True,
+logger.info(
+    f"[demo.database] Connection pool size {l_pool_size} with {l_max_overflow} "
+    f"overflow for each of {core_config.WEB_CONCURRENCY} workers"
+)
+
+# The worker's only connection pool. The repository, ORM sessions and the startup and
+# shutdown handlers all share it.
+engine: AsyncEngine = create_async_engine(
+    async_database_url(core_config.DATABASE_URI),
+    pool_size=l_pool_size,
+    max_overflow=l_max_overflow,
+    pool_timeout=core_config.DATABASE_POOL_TIMEOUT,
+    pool_pre_ping=True,
+    connect_args=connect_args(),
 )
 SessionLocal: sessionmaker = sessionmaker(
-    autocommit=False,
+    bind=engine,
+    class_=AsyncSession,
     autoflush=False,
-    bind=engine_default,
-    future=True,
+    expire_on_commit=False,
 )
 
 mapper_registry = registry()
@@ -41,7 +130,7 @@ class Base(metaclass=DeclarativeMeta):
     """
     Shared class for all SQLAlchemy models in order to maintain a shared MetaData
     instance used by Alembic in general and Pytest specifically when calling
-    `Base.metadata.drop_all(engine_default)` or `...create_all(engine_default)`
+    `Base.metadata.drop_all` or `...create_all` through `AsyncConnection.run_sync`
 
     This is used instead of the simpler Base=declarative_base() in order to provide more
     explicit instantiation that works better with intellisense-like helpers in VSCode,
@@ -59,17 +148,74 @@ class Base(metaclass=DeclarativeMeta):
     __init__ = mapper_registry.constructor
 
 
-def get_db() -> Session:
+async def get_db() -> AsyncIterator[AsyncSession]:
     """
-    Attempt to generate a new SQLAlchemy Session using the SessionLocal sessionmaker
+    Generate a new SQLAlchemy AsyncSession using the SessionLocal sessionmaker
     generator.
     """
-    db: Optional[Session] = None
-    try:
-        db = SessionLocal()
+    async with SessionLocal() as db:
         yield db
-    except Exception as e:
-        logger.error(e)
-    finally:
-        if db:
-            db.close()
+
+
+async def get_async_db(request: Request) -> AsyncEngine:
+    """
+    Provide the engine whose pool was verified by create_start_app_handler. Queries
+    made with it are awaited on the event loop rather than blocking a worker thread.
+    :param request: The incoming request
+    :return: The AsyncEngine stored in app.state; HTTP 503 exception if the database
+    couldn't be reached at startup
+    """
+    l_db: Optional[AsyncEngine] = getattr(request.app.state, "_db", None)
+    if l_db is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The database is unavailable. Please try again later.",
+        )
+    return l_db
+
+
+async def fetch_one(
+    a_db: AsyncEngine, a_statement: Executable, a_params: Mapping[str, Any]
+) -> Optional[RowMapping]:
+    """
+    Run a statement in its own transaction and return its first row. The connection is
+    only checked out of the pool for the duration of the statement.
+    :param a_db: The AsyncEngine from app.state
+    :param a_statement: The SQL to run
+    :param a_params: Values for the statement's bound parameters
+    :return: The first row; None if there wasn't one
+    """
+    async with a_db.begin() as l_connection:
+        l_result = await l_connection.execute(a_statement, a_params)
+        return l_result.mappings().first()
+
+
+async def fetch_all(
+    a_db: AsyncEngine, a_statement: Executable, a_params: Mapping[str, Any]
+) -> List[RowMapping]:
+    """
+    Run a statement in its own transaction and return every row. Callers must bound
+    the number of rows, e.g. with LIMIT, as they're all held in memory.
+    :param a_db: The AsyncEngine from app.state
+    :param a_statement: The SQL to run
+    :param a_params: Values for the statement's bound parameters
+    :return: The rows in the order returned
+    """
+    async with a_db.begin() as l_connection:
+        l_result = await l_connection.execute(a_statement, a_params)
+        return l_result.mappings().all()
+
+
+async def execute(
+    a_db: AsyncEngine, a_statement: Executable, a_params: Mapping[str, Any]
+) -> int:
+    """
+    Run a statement in its own transaction
+    :param a_db: The AsyncEngine from app.state
+    :param a_statement: The SQL to run
+    :param a_params: Values for the statement's bound parameters
+    :return: The number of rows affected
+    """
+    async with a_db.begin() as l_connection:
+        l_result = await l_connection.execute(a_statement, a_params)
+        return l_result.rowcount
@@ -0,0 +1,257 @@
+"""
+Per-request SQL instrumentation.
+
+When DATABASE_INSTRUMENTATION is enabled, SQLAlchemy cursor events on each engine time
+every statement and add it to the QueryStats of the request being served, which is
+found through a contextvar. Statements slower than DATABASE_SLOW_QUERY_MS are logged
+without their parameter values, and requests which repeat one statement at least
+DATABASE_REPEATED_QUERY_THRESHOLD times are flagged as a likely N+1 query pattern.
+
+When disabled no event listener or middleware is installed, so nothing is measured.
+"""
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Any
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from demo.core.config import core_config
+from demo.core.config import core_logger as logger
+from sqlalchemy import event
+from sqlalchemy.engine import Connection
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.types import ASGIApp
+from starlette.types import Message
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+# Key in Connection.info holding the start times of the statements it's running
+_START_TIMES_KEY: str = "instrumentation_start_times"
+
+
+class QueryStats:
+    """
+    The statements one request ran
+    """
+
+    __slots__ = ("count", "seconds", "slowest_seconds", "slowest_statement", "counts")
+
+    def __init__(self) -> None:
+        self.count: int = 0
+        self.seconds: float = 0.0
+        self.slowest_seconds: float = 0.0
+        self.slowest_statement: Optional[str] = None
+        # Times each distinct statement text was run
+        self.counts: Counter = Counter()
+
+    def add(self, a_statement: str, a_seconds: float) -> None:
+        """
+        Record a statement
+        :param a_statement: The SQL text as sent to the driver
+        :param a_seconds: How long the statement took
+        :return: Nothing
+        """
+        self.count += 1
+        self.seconds += a_seconds
+        self.counts[a_statement] += 1
+        if a_seconds > self.slowest_seconds:
+            self.slowest_seconds = a_seconds
+            self.slowest_statement = a_statement
+
+    def most_repeated(self) -> Tuple[Optional[str], int]:
+        """
+        :return: The statement run most often and how many times; (None, 0) if none
+        """
+        if not self.counts:
+            return None, 0
+        return self.counts.most_common(1)[0]
+
+
+_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def redact(a_parameters: Any, a_executemany: bool) -> str:
+    """
+    Describe a statement's parameters without revealing their values
+    :param a_parameters: The parameters passed to the driver
+    :param a_executemany: Whether a_parameters is a sequence of parameter sets
+    :return: A description such as "3 parameters" or "500 rows"
+    """
+    if a_executemany:
+        return f"{len(a_parameters)} rows"
+    return f"{len(a_parameters) if a_parameters else 0} parameters"
+
+
+def statement_summary(a_statement: Optional[str], a_length: int = 200) -> str:
+    """
+    :param a_statement: SQL text
+    :param a_length: The most characters to keep
+    :return: The statement on one line, truncated to a_length characters
+    """
+    l_summary: str = " ".join((a_statement or "").split())
+    return l_summary if len(l_summary) <= a_length else f"{l_summary[:a_length]}..."
+
+
+class QueryInstrumentation:
+    """
+    Installs the cursor event listeners and records statements into the current
+    request's QueryStats
+    """
+
+    def __init__(
+        self,
+        a_slow_query_ms: float = core_config.DATABASE_SLOW_QUERY_MS,
+        a_repeated_query_threshold: int = core_config.DATABASE_REPEATED_QUERY_THRESHOLD,
+    ):
+        self.slow_query_seconds: float = a_slow_query_ms / 1000
+        self.repeated_query_threshold: int = a_repeated_query_threshold
+
+    def _before_cursor_execute(
+        self,
+        a_connection: Connection,
+        a_cursor: Any,
+        a_statement: str,
+        a_parameters: Any,
+        a_context: Any,
+        a_executemany: bool,
+    ) -> None:
+        a_connection.info.setdefault(_START_TIMES_KEY, []).append(perf_counter())
+
+    def _after_cursor_execute(
+        self,
+        a_connection: Connection,
+        a_cursor: Any,
+        a_statement: str,
+        a_parameters: Any,
+        a_context: Any,
+        a_executemany: bool,
+    ) -> None:
+        l_start_times: List[float] = a_connection.info.get(_START_TIMES_KEY, [])
+        if not l_start_times:
+            return
+        l_seconds: float = perf_counter() - l_start_times.pop()
+        l_stats: Optional[QueryStats] = _query_stats.get()
+        if l_stats is not None:
+            l_stats.add(a_statement, l_seconds)
+        if l_seconds >= self.slow_query_seconds:
+            logger.warning(
+                f"[sql] slow query took {l_seconds * 1000:.1f} ms with "
+                f"{redact(a_parameters, a_executemany)}: "
+                f"{statement_summary(a_statement)}"
+            )
+
+    def instrument(self, a_engine: AsyncEngine) -> None:
+        """
+        Time every statement a_engine runs. Calling this again has no effect.
+        :param a_engine: An engine such as demo.database.engine
+        :return: Nothing
+        """
+        l_engine: Engine = a_engine.sync_engine
+        if event.contains(
+            l_engine, "before_cursor_execute", self._before_cursor_execute
+        ):
+            return
+        event.listen(l_engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(l_engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def uninstrument(self, a_engine: AsyncEngine) -> None:
+        """
+        Stop timing a_engine's statements
+        :param a_engine: An engine previously passed to instrument()
+        :return: Nothing
+        """
+        l_engine: Engine = a_engine.sync_engine
+        if event.contains(
+            l_engine, "before_cursor_execute", self._before_cursor_execute
+        ):
+            event.remove(l_engine, "before_cursor_execute", self._before_cursor_execute)
+            event.remove(l_engine, "after_cursor_execute", self._after_cursor_execute)
+
+    @contextmanager
+    def record(self) -> Iterator[QueryStats]:
+        """
+        Collect the statements run within the block, including by tasks it creates
+        :return: The QueryStats being filled in
+        """
+        l_stats = QueryStats()
+        l_token = _query_stats.set(l_stats)
+        try:
+            yield l_stats
+        finally:
+            _query_stats.reset(l_token)
+
+    def report(self, a_name: str, a_stats: QueryStats) -> None:
+        """
+        Log a summary of the statements a request ran, warning if it repeated one
+        :param a_name: What ran the statements, e.g. "GET /v1/users/get"
+        :param a_stats: The statements it ran
+        :return: Nothing
+        """
+        if a_stats.count == 0:
+            return
+        l_statement, l_repeats = a_stats.most_repeated()
+        if l_repeats >= self.repeated_query_threshold:
+            logger.warning(
+                f"[sql] possible N+1 queries: {a_name} ran the same statement "
+                f"{l_repeats} times: {statement_summary(l_statement)}"
+            )
+        logger.debug(
+            f"[sql] {a_name} ran {a_stats.count} statements in "
+            f"{a_stats.seconds * 1000:.1f} ms; slowest {a_stats.slowest_seconds * 1000:.1f}"
+            f" ms: {statement_summary(a_stats.slowest_statement)}"
+        )
+
+
+query_instrumentation = QueryInstrumentation()
+
+
+class QueryInstrumentationMiddleware:
+    """
+    ASGI middleware giving each HTTP request its own QueryStats. The statements run
+    before the response starts are reported in a Server-Timing header; every
+    statement, including those run while a response streams, is logged when the
+    request finishes.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        a_instrumentation: QueryInstrumentation = query_instrumentation,
+    ):
+        self.app: ASGIApp = app
+        self.instrumentation: QueryInstrumentation = a_instrumentation
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with self.instrumentation.record() as l_stats:
+
+            async def send_with_timing(a_message: Message) -> None:
+                if a_message["type"] == "http.response.start":
+                    l_timing: str = (
+                        f'db;dur={l_stats.seconds * 1000:.1f};desc="'
+                        f'{l_stats.count} queries"'
+                    )
+                    a_message = {
+                        **a_message,
+                        "headers": [
+                            *a_message.get("headers", []),
+                            (b"server-timing", l_timing.encode()),
+                        ],
+                    }
+                await send(a_message)
+
+            try:
+                await self.app(scope, receive, send_with_timing)
+            finally:
+                self.instrumentation.report(
+                    f"{scope['method']} {scope['path']}", l_stats
+                )
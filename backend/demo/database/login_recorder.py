@@ -0,0 +1,157 @@
+"""
+Write-behind recording of successful logins
+"""
+from asyncio import CancelledError
+from asyncio import create_task
+from asyncio import Event
+from asyncio import Lock
+from asyncio import Task
+from asyncio import TimeoutError
+from asyncio import wait_for
+from datetime import datetime
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from demo.core.config import core_config
+from demo.core.config import core_logger as logger
+from demo.database.repository.users import record_logins_db
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+class LoginRecorder:
+    """
+    Buffers successful logins in memory so the login route never waits on a write.
+
+    Logins by the same user are coalesced into one update of their last_login and
+    login_count, and every login becomes a login_events row. A background task writes
+    the buffer every flush_seconds, or as soon as batch_size logins are waiting, in
+    one transaction of two multi-row statements. If Postgres falls behind, logins
+    beyond max_pending are dropped and counted rather than held, and a batch which
+    fails to write is dropped too, so memory stays bounded however slow the database.
+    """
+
+    def __init__(
+        self,
+        a_flush_seconds: float = core_config.LOGIN_RECORDER_FLUSH_SECONDS,
+        a_batch_size: int = core_config.LOGIN_RECORDER_BATCH_SIZE,
+        a_max_pending: int = core_config.LOGIN_RECORDER_MAX_PENDING,
+    ):
+        self.flush_seconds: float = a_flush_seconds
+        self.batch_size: int = a_batch_size
+        self.max_pending: int = a_max_pending
+        # Logins recorded, written to the database, and dropped by this worker
+        self.recorded: int = 0
+        self.written: int = 0
+        self.dropped: int = 0
+        # User ID to their most recent login time and number of logins
+        self._logins: Dict[int, Tuple[datetime, int]] = {}
+        # User ID, time and client IP address of each login
+        self._events: List[Tuple[int, datetime, Optional[str]]] = []
+        self._db: Optional[AsyncEngine] = None
+        # Created by start() so they belong to the running event loop
+        self._wake: Optional[Event] = None
+        self._flush_lock: Optional[Lock] = None
+        self._flusher: Optional[Task] = None
+        self._stopping: bool = False
+
+    @property
+    def pending(self) -> int:
+        """
+        :return: The number of logins waiting to be written
+        """
+        return len(self._events)
+
+    def record(self, a_user_id: int, a_ip_address: Optional[str] = None) -> None:
+        """
+        Buffer a successful login. Never waits on the database.
+        :param a_user_id: The user who logged in
+        :param a_ip_address: The client's IP address, if known
+        :return: Nothing
+        """
+        if self._db is None:
+            return
+        if len(self._events) >= self.max_pending:
+            self.dropped += 1
+            return
+        l_now: datetime = datetime.now()
+        l_previous: Optional[Tuple[datetime, int]] = self._logins.get(a_user_id)
+        self._logins[a_user_id] = (l_now, l_previous[1] + 1 if l_previous else 1)
+        self._events.append((a_user_id, l_now, a_ip_address))
+        self.recorded += 1
+        if len(self._events) >= self.batch_size and self._wake is not None:
+            self._wake.set()
+
+    async def flush(self) -> None:
+        """
+        Write every buffered login. Logins recorded meanwhile wait for the next flush.
+        :return: Nothing
+        """
+        if self._db is None or self._flush_lock is None:
+            return
+        async with self._flush_lock:
+            if not self._events:
+                return
+            l_logins, self._logins = self._logins, {}
+            l_events, self._events = self._events, []
+            try:
+                await record_logins_db(self._db, l_logins, l_events)
+            except Exception as e:
+                self.dropped += len(l_events)
+                logger.warning(
+                    f"[LoginRecorder] dropped {len(l_events)} logins "
+                    f"({self.dropped} in total): {e}"
+                )
+                return
+            self.written += len(l_events)
+            logger.debug(f"[LoginRecorder] wrote {len(l_events)} logins")
+
+    async def _flush_periodically(self) -> None:
+        """
+        Flush every flush_seconds or when woken by record() or stop()
+        :return: Nothing
+        """
+        while not self._stopping:
+            try:
+                await wait_for(self._wake.wait(), timeout=self.flush_seconds)
+            except TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def start(self, a_db: AsyncEngine) -> None:
+        """
+        Begin buffering logins and writing them in a background task
+        :param a_db: The engine to write with
+        :return: Nothing
+        """
+        if self._flusher is not None:
+            return
+        self._db = a_db
+        self._wake = Event()
+        self._flush_lock = Lock()
+        self._stopping = False
+        self._flusher = create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        """
+        Write the logins still buffered and stop the background task. Call before the
+        engine is disposed.
+        :return: Nothing
+        """
+        if self._flusher is None:
+            return
+        # Let a write in progress finish rather than cancelling it part way
+        self._stopping = True
+        self._wake.set()
+        try:
+            await self._flusher
+        except CancelledError:
+            pass
+        await self.flush()
+        self._flusher = None
+        self._db = None
+
+
+login_recorder = LoginRecorder()
@@ -0,0 +1,34 @@
+"""
+SQLAlchemy database Model for login_events table
+"""
+from datetime import datetime
+
+from demo.database import Base
+from sqlalchemy import BigInteger
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import ForeignKey
+from sqlalchemy import Index
+from sqlalchemy import Integer
+from sqlalchemy import String
+
+
+class LoginEvent(Base):
+    """
+    Audit trail of successful logins, one row per login.
+    """
+
+    __tablename__ = "login_events"
+
+    id = Column(BigInteger, primary_key=True)
+    user_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+    )
+    time_created = Column(DateTime, nullable=False, default=datetime.now)
+    # The client's address as the API saw it, None if unknown
+    ip_address = Column(String, nullable=True)
+
+    __table_args__ = (
+        # A user's login history, most recent first
+        Index("ix_login_events_user_id_time_created", user_id, time_created),
+    )
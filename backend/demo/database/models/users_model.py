@@ -7,9 +7,26 @@ from demo.database import Base
 from sqlalchemy import Boolean
 from sqlalchemy import Column
 from sqlalchemy import DateTime
+from sqlalchemy import DDL
+from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy import Index
 from sqlalchemy import Integer
+from sqlalchemy import literal_column
 from sqlalchemy import String
 from sqlalchemy.orm import validates
+from sqlalchemy.sql.elements import ColumnElement
+
+
+def email_domain(a_email: ColumnElement) -> ColumnElement:
+    """
+    The part of an e-mail address after the '@'. The separator and part number are
+    rendered as literals so queries match the ix_users_email_domain_time_created_id
+    expression even with a generic plan.
+    :param a_email: The e-mail column
+    :return: A SQL expression for the domain
+    """
+    return func.split_part(a_email, literal_column("'@'"), literal_column("2"))
 
 
 class User(Base):
@@ -19,13 +36,65 @@ class User(Base):
 
     __tablename__ = "users"
 
-    id = Column(Integer, primary_key=True, index=True)
-    email = Column(String, nullable=False, unique=True)
+    id = Column(Integer, primary_key=True)
+    email = Column(String, nullable=False)
     username = Column(String, nullable=False, unique=False)
     password = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
     is_superuser = Column(Boolean, default=False)
-    time_created = Column(DateTime, nullable=False, default=datetime.now())
+    time_created = Column(DateTime, nullable=False, default=datetime.now)
+    # Written in batches by demo.database.login_recorder, so they may trail the most
+    # recent logins by a moment
+    last_login = Column(DateTime, nullable=True)
+    login_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Incremented by every update of the user's details. Clients echo it back as an
+    # If-Match ETag so concurrent updates can't overwrite each other unseen.
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+    # Every query in demo.database.repository.users is checked against these by
+    # tests/database/query_plan_test.py
+    __table_args__ = (
+        # E-mail addresses are unique regardless of case. Lookups compare lower(email).
+        Index("ix_users_lower_email", func.lower(email), unique=True),
+        # Username logins pick the oldest account with the username
+        Index("ix_users_username_id", username, id),
+        # Keyset pagination of the admin user listing walks this index in order
+        Index("ix_users_time_created_id", time_created, id),
+        # The same order within each e-mail domain
+        Index(
+            "ix_users_email_domain_time_created_id",
+            email_domain(email),
+            time_created,
+            id,
+        ),
+        # The same order restricted to the listing's boolean filters. Queries must
+        # test the column itself, not compare it with a parameter, to match these.
+        Index(
+            "ix_users_active_time_created_id",
+            time_created,
+            id,
+            postgresql_where=is_active,
+        ),
+        Index(
+            "ix_users_superuser_time_created_id",
+            time_created,
+            id,
+            postgresql_where=is_superuser,
+        ),
+        # Admin search matches any part of an e-mail or username with ILIKE
+        Index(
+            "ix_users_email_trgm",
+            email,
+            postgresql_using="gin",
+            postgresql_ops={"email": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_users_username_trgm",
+            username,
+            postgresql_using="gin",
+            postgresql_ops={"username": "gin_trgm_ops"},
+        ),
+    )
 
     # Attempt to ensure consistent checks between provided values and those stored in
     # database by forcing all usernames and emails to be stored as all lowercase.
@@ -40,3 +109,9 @@ class User(Base):
         :return: A lowercase version of the email str
         """
         return value.lower()
+
+
+# The trigram indexes need pg_trgm. Migrations install it; this covers create_all.
+event.listen(
+    User.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+)
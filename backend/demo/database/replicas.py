@@ -0,0 +1,266 @@
+"""
+Routing of read only queries to replicas of the primary database
+"""
+from asyncio import CancelledError
+from asyncio import create_task
+from asyncio import gather
+from asyncio import sleep
+from asyncio import Task
+from asyncio import wait_for
+from collections import OrderedDict
+from itertools import count
+from time import monotonic
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+from demo.core.config import core_config
+from demo.core.config import core_logger as logger
+from demo.core.config import ReplicaSelection
+from demo.core.redis_client import get_redis
+from demo.database import async_database_url
+from demo.database import connect_args
+from demo.database import pool_budget
+from redis.exceptions import RedisError
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.sql.elements import TextClause
+
+USER_WRITE_CHANNEL: str = "user-writes"
+# Seconds to wait before resubscribing after losing the Redis connection
+RECONNECT_SECONDS: float = 5.0
+
+# Seconds the replica's replayed data is behind the primary. A replica which has
+# replayed everything it received is current even if the primary has been idle. NULL
+# if the replica has never replayed a transaction.
+SELECT_REPLICA_LAG: TextClause = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class ReplicaRouter:
+    """
+    Chooses the engine each read only query uses.
+
+    Reads go to a replica chosen round robin or by fewest connections in use, skipping
+    replicas which are unreachable or lagging more than max_lag_seconds. If no replica
+    qualifies the primary is used. After a user writes, their reads go to the primary
+    for pin_seconds so they always see their own change; the write is announced on a
+    pub/sub channel so every worker pins the user, not just the one which served it.
+    """
+
+    def __init__(
+        self,
+        a_uris: List[str] = core_config.DATABASE_REPLICA_URIS,
+        a_selection: ReplicaSelection = core_config.DATABASE_REPLICA_SELECTION,
+        a_max_lag_seconds: float = core_config.DATABASE_REPLICA_MAX_LAG_SECONDS,
+        a_lag_check_seconds: float = core_config.DATABASE_REPLICA_LAG_CHECK_SECONDS,
+        a_pin_seconds: float = core_config.DATABASE_READ_YOUR_WRITES_SECONDS,
+    ):
+        l_pool_size, l_max_overflow = pool_budget(
+            core_config.DATABASE_MAX_CONNECTIONS, core_config.WEB_CONCURRENCY
+        )
+        self.replicas: List[AsyncEngine] = [
+            create_async_engine(
+                async_database_url(l_uri),
+                pool_size=l_pool_size,
+                max_overflow=l_max_overflow,
+                pool_timeout=core_config.DATABASE_POOL_TIMEOUT,
+                pool_pre_ping=True,
+                connect_args=connect_args(),
+            )
+            for l_uri in a_uris
+        ]
+        self.selection: ReplicaSelection = a_selection
+        self.max_lag_seconds: float = a_max_lag_seconds
+        self.lag_check_seconds: float = a_lag_check_seconds
+        self.pin_seconds: float = a_pin_seconds
+        # Seconds each replica was last measured behind the primary; None until it's
+        # first measured or while it's unreachable
+        self.lag: List[Optional[float]] = [None] * len(self.replicas)
+        self._turns: Iterator[int] = count()
+        # User ID to the monotonic time their pin expires, soonest first
+        self._pins: OrderedDict[int, float] = OrderedDict()
+        self._tasks: List[Task] = []
+
+    def available(self) -> List[AsyncEngine]:
+        """
+        :return: The replicas which may currently be read from
+        """
+        return [
+            l_replica
+            for l_replica, l_lag in zip(self.replicas, self.lag)
+            if l_lag is not None and l_lag <= self.max_lag_seconds
+        ]
+
+    def is_pinned(self, a_user_id: int) -> bool:
+        """
+        :param a_user_id: The user ID
+        :return: True if the user wrote within the last pin_seconds
+        """
+        l_until: Optional[float] = self._pins.get(a_user_id)
+        return l_until is not None and l_until > monotonic()
+
+    def pin(self, a_user_id: int) -> None:
+        """
+        Send a user's reads in this worker to the primary for pin_seconds
+        :param a_user_id: The user ID
+        :return: Nothing
+        """
+        if not self.replicas or self.pin_seconds <= 0:
+            return
+        l_now: float = monotonic()
+        self._pins.pop(a_user_id, None)
+        self._pins[a_user_id] = l_now + self.pin_seconds
+        # Every pin lasts equally long so expired pins are always at the front
+        while next(iter(self._pins.values())) <= l_now:
+            self._pins.popitem(last=False)
+
+    async def record_write(self, a_user_id: int) -> None:
+        """
+        Pin a user who just wrote in every worker. Call after the write commits.
+        :param a_user_id: The user ID
+        :return: Nothing
+        """
+        if not self.replicas or self.pin_seconds <= 0:
+            return
+        self.pin(a_user_id)
+        try:
+            await get_redis().publish(USER_WRITE_CHANNEL, str(a_user_id))
+        except (RedisError, OSError) as e:
+            # Only this worker is pinned. Others may briefly serve the previous value.
+            logger.warning(f"[ReplicaRouter] failed to announce a write: {e}")
+
+    def reader(
+        self, a_primary: AsyncEngine, a_user_id: Optional[int] = None
+    ) -> AsyncEngine:
+        """
+        Choose the engine for a read only query
+        :param a_primary: The primary's engine, e.g. from get_async_db
+        :param a_user_id: The user the read is made for, if any
+        :return: A replica's engine; a_primary if none is available or the user is
+        pinned
+        """
+        if not self.replicas:
+            return a_primary
+        if a_user_id is not None and self.is_pinned(a_user_id):
+            return a_primary
+        l_available: List[AsyncEngine] = self.available()
+        if not l_available:
+            return a_primary
+        if self.selection == ReplicaSelection.least_connections:
+            return min(
+                l_available,
+                key=lambda l_replica: l_replica.sync_engine.pool.checkedout(),
+            )
+        return l_available[next(self._turns) % len(l_available)]
+
+    async def _measure(self, a_replica: AsyncEngine) -> Optional[float]:
+        """
+        :param a_replica: A replica's engine
+        :return: Seconds the replica is behind the primary; None if unknown
+        """
+        async with a_replica.connect() as l_connection:
+            l_lag = (await l_connection.execute(SELECT_REPLICA_LAG)).scalar()
+        return float(l_lag) if l_lag is not None else None
+
+    async def measure_lag(self) -> None:
+        """
+        Measure every replica's lag. A replica which doesn't answer within
+        max_lag_seconds, or a second if that's longer, is treated as unreachable.
+        :return: Nothing
+        """
+
+        async def measure(a_index: int) -> None:
+            l_lag: Optional[float] = None
+            try:
+                l_lag = await wait_for(
+                    self._measure(self.replicas[a_index]),
+                    timeout=max(1.0, self.max_lag_seconds),
+                )
+            except Exception as e:
+                # Only warn when a replica which was in use becomes unreachable
+                if self.lag[a_index] is not None:
+                    logger.warning(
+                        f"[ReplicaRouter] replica {a_index} unreachable: {e}"
+                    )
+                else:
+                    logger.debug(f"[ReplicaRouter] replica {a_index} unreachable: {e}")
+            if l_lag is not None and l_lag > self.max_lag_seconds:
+                logger.info(f"[ReplicaRouter] replica {a_index} is {l_lag:.1f}s behind")
+            self.lag[a_index] = l_lag
+
+        await gather(*(measure(i) for i in range(len(self.replicas))))
+
+    async def _monitor(self) -> None:
+        """
+        Periodically measure every replica's lag
+        :return: Nothing
+        """
+        while True:
+            await self.measure_lag()
+            await sleep(self.lag_check_seconds)
+
+    async def _listen(self) -> None:
+        """
+        Pin users other workers announce writes for, resubscribing whenever the
+        connection to Redis is lost
+        :return: Nothing
+        """
+        while True:
+            try:
+                l_pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+                try:
+                    await l_pubsub.subscribe(USER_WRITE_CHANNEL)
+                    while True:
+                        l_message = await l_pubsub.get_message(timeout=1.0)
+                        if l_message is None:
+                            continue
+                        try:
+                            self.pin(int(l_message["data"]))
+                        except ValueError:
+                            logger.warning(
+                                f"[ReplicaRouter] ignored invalid announcement: "
+                                f"{l_message['data']!r}"
+                            )
+                finally:
+                    await l_pubsub.reset()
+            except CancelledError:
+                raise
+            except (RedisError, OSError) as e:
+                logger.warning(f"[ReplicaRouter] lost write announcements: {e}")
+                await sleep(RECONNECT_SECONDS)
+
+    def start(self) -> None:
+        """
+        Begin measuring replica lag and listening for writes in background tasks.
+        Replicas aren't read from until their lag has been measured.
+        :return: Nothing
+        """
+        if not self.replicas or self._tasks:
+            return
+        self._tasks.append(create_task(self._monitor()))
+        if self.pin_seconds > 0:
+            self._tasks.append(create_task(self._listen()))
+
+    async def stop(self) -> None:
+        """
+        Stop the background tasks and close every replica's pooled connections
+        :return: Nothing
+        """
+        for l_task in self._tasks:
+            l_task.cancel()
+            try:
+                await l_task
+            except CancelledError:
+                pass
+        self._tasks = []
+        self.lag = [None] * len(self.replicas)
+        for l_replica in self.replicas:
+            await l_replica.dispose()
+
+
+replica_router = ReplicaRouter()
@@ -0,0 +1,394 @@
+"""
+Bulk user import.
+
+Rows are validated with the same rules as UserAdminCreateUpdateSchema, their passwords
+are hashed across a pool of processes, and each batch is loaded with COPY into a
+temporary staging table before being merged into users. Rows whose e-mail already
+exists are reported rather than aborting the import.
+"""
+from asyncio import gather
+from asyncio import get_running_loop
+from asyncio import Task
+from codecs import getincrementaldecoder
+from concurrent.futures import ProcessPoolExecutor
+from csv import reader
+from datetime import datetime
+from enum import Enum
+from itertools import chain
+from math import ceil
+from os import cpu_count
+from time import perf_counter
+from typing import Any
+from typing import AsyncIterable
+from typing import AsyncIterator
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from demo.core.config import core_config
+from demo.core.config import core_logger as logger
+from demo.core.hashing import hash_many
+from demo.schemas.users import UserAdminCreateUpdateSchema
+from demo.schemas.users import UserImportErrorSchema
+from demo.schemas.users import UserImportReportSchema
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.sql.elements import TextClause
+from ujson import loads
+
+
+class ImportFormat(str, Enum):
+    """
+    Explicit enumerated class for the file formats a bulk user import accepts
+    """
+
+    # A header row naming the IMPORT_COLUMNS followed by one user per row
+    csv = "csv"
+    # One JSON object per line
+    ndjson = "ndjson"
+
+
+IMPORT_COLUMNS: Tuple[str, ...] = (
+    "username",
+    "email",
+    "password",
+    "is_active",
+    "is_superuser",
+)
+STAGING_COLUMNS: Tuple[str, ...] = (
+    "line",
+    "email",
+    "username",
+    "password",
+    "is_active",
+    "is_superuser",
+    "time_created",
+)
+
+# The most lines a CSV record's quoted fields may span. A quote which is never closed
+# is reported after this many lines rather than reading the rest of the file into
+# one record.
+CSV_MAX_RECORD_LINES: int = 100
+
+# Dropped when the batch's transaction commits
+CREATE_STAGING_TABLE: TextClause = text(
+    "CREATE TEMPORARY TABLE users_import ("
+    "line integer NOT NULL, email varchar NOT NULL, username varchar NOT NULL, "
+    "password varchar NOT NULL, is_active boolean NOT NULL, "
+    "is_superuser boolean NOT NULL, time_created timestamp NOT NULL"
+    ") ON COMMIT DROP"
+)
+# Insert the first row staged for each e-mail which isn't already in users, then return
+# the line of every staged row which wasn't inserted
+MERGE_STAGING_TABLE: TextClause = text(
+    """
+    WITH chosen AS (
+        SELECT DISTINCT ON (email) * FROM users_import ORDER BY email, line
+    ), inserted AS (
+        INSERT INTO users
+            (email, username, password, is_active, is_superuser, time_created)
+        SELECT email, username, password, is_active, is_superuser, time_created
+        FROM chosen ORDER BY line
+        ON CONFLICT ((lower(email))) DO NOTHING
+        RETURNING email
+    )
+    SELECT staged.line, staged.email FROM users_import AS staged
+    WHERE NOT EXISTS (
+        SELECT 1 FROM chosen JOIN inserted ON inserted.email = chosen.email
+        WHERE chosen.line = staged.line
+    )
+    ORDER BY staged.line
+    """
+)
+
+# A validated row waiting to be imported: its line number and schema
+PendingUser = Tuple[int, UserAdminCreateUpdateSchema]
+
+
+async def iter_lines(a_chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """
+    Split a stream of UTF-8 bytes, such as a request body, into lines without holding
+    more than one chunk in memory
+    :param a_chunks: The byte stream
+    :return: Each line without its line ending
+    """
+    # utf-8-sig drops the byte order mark spreadsheet exports often begin with
+    l_decoder = getincrementaldecoder("utf-8-sig")()
+    l_buffer: str = ""
+    async for l_chunk in a_chunks:
+        l_buffer += l_decoder.decode(l_chunk)
+        *l_lines, l_buffer = l_buffer.split("\n")
+        for l_line in l_lines:
+            yield l_line.rstrip("\r")
+    l_buffer += l_decoder.decode(b"", final=True)
+    if l_buffer:
+        yield l_buffer.rstrip("\r")
+
+
+class IncompleteRecord(Exception):
+    """
+    A CSV record whose quoted field continues on the next line
+    """
+
+
+def more_lines() -> Iterator[str]:
+    """
+    Stands in for the lines after a CSV record, which the csv module only reads if a
+    quoted field is still open
+    :return: Nothing; IncompleteRecord when the csv module asks for a line
+    """
+    raise IncompleteRecord
+    yield ""
+
+
+def csv_values(a_text: str) -> Optional[List[str]]:
+    """
+    :param a_text: One CSV record, whose quoted fields may contain line breaks
+    :return: The record's values; None if a quoted field is still open at the end
+    """
+    try:
+        return next(reader(chain([a_text], more_lines())))
+    except IncompleteRecord:
+        return None
+
+
+async def iter_records(
+    a_lines: AsyncIterable[str], a_format: ImportFormat
+) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Group the lines of an import into records: one line each for NDJSON, and for CSV
+    as many lines as the record's quoted fields span, up to CSV_MAX_RECORD_LINES
+    :param a_lines: The lines of the import file
+    :param a_format: The file's format
+    :return: Each record's first line number and its lines joined by line feeds
+    """
+    l_line: int = 0
+    l_first: int = 0
+    l_pending: List[str] = []
+    async for l_text in a_lines:
+        l_line += 1
+        if not l_pending:
+            l_first = l_line
+        l_pending.append(l_text)
+        # Only a line with a quote, or one continuing a quoted field, may leave one open
+        if (
+            a_format == ImportFormat.csv
+            and ('"' in l_text or len(l_pending) > 1)
+            and len(l_pending) < CSV_MAX_RECORD_LINES
+            and csv_values("\n".join(l_pending)) is None
+        ):
+            continue
+        yield l_first, "\n".join(l_pending)
+        l_pending = []
+    if l_pending:
+        yield l_first, "\n".join(l_pending)
+
+
+def parse_csv_header(a_line: str) -> List[str]:
+    """
+    :param a_line: The first line of a CSV import
+    :return: The column names; ValueError if they aren't a subset of IMPORT_COLUMNS
+    which includes username, email and password
+    """
+    l_header: List[str] = [l_name.strip().lower() for l_name in next(reader([a_line]))]
+    l_unknown: List[str] = [
+        l_name for l_name in l_header if l_name not in IMPORT_COLUMNS
+    ]
+    if l_unknown:
+        raise ValueError(f"Unknown CSV columns: {', '.join(l_unknown)}")
+    if not {"username", "email", "password"}.issubset(l_header):
+        raise ValueError("CSV header must include username, email and password")
+    return l_header
+
+
+def parse_record(
+    a_line: str, a_format: ImportFormat, a_header: List[str]
+) -> Dict[str, Any]:
+    """
+    :param a_line: One record of the import, from iter_records()
+    :param a_format: The import's format
+    :param a_header: The CSV column names; unused for NDJSON
+    :return: The row's fields; ValueError if the record can't be parsed
+    """
+    if a_format == ImportFormat.csv:
+        l_values: Optional[List[str]] = csv_values(a_line)
+        if l_values is None:
+            raise ValueError(
+                f"A quoted field isn't closed within {CSV_MAX_RECORD_LINES} lines or "
+                "by the end of the file"
+            )
+        if len(l_values) != len(a_header):
+            raise ValueError(f"Expected {len(a_header)} columns, got {len(l_values)}")
+        # Empty cells fall back to the schema's defaults
+        return {k: v for k, v in zip(a_header, l_values) if v != ""}
+    l_record: Any = loads(a_line)
+    if not isinstance(l_record, dict):
+        raise ValueError("Each line must be a JSON object")
+    return l_record
+
+
+def validate_record(a_record: Dict[str, Any]) -> UserAdminCreateUpdateSchema:
+    """
+    :param a_record: A parsed row
+    :return: The row as a schema; ValueError describing every invalid field otherwise
+    """
+    try:
+        return UserAdminCreateUpdateSchema(
+            **{k: v for k, v in a_record.items() if k in IMPORT_COLUMNS}
+        )
+    except ValidationError as e:
+        raise ValueError(
+            "; ".join(
+                f"{'.'.join(str(l_loc) for l_loc in l_error['loc'])}: {l_error['msg']}"
+                for l_error in e.errors()
+            )
+        )
+    except HTTPException as e:
+        # render_safe_email reports invalid addresses with an HTTPException
+        raise ValueError(e.detail)
+
+
+async def hash_passwords(
+    a_pool: ProcessPoolExecutor, a_workers: int, a_passwords: List[str]
+) -> List[str]:
+    """
+    Hash a batch of passwords, split evenly across the pool's processes
+    :param a_pool: The import's process pool
+    :param a_workers: The number of processes in a_pool
+    :param a_passwords: Plaintext passwords
+    :return: Their hashes in the same order
+    """
+    l_loop = get_running_loop()
+    l_size: int = max(1, ceil(len(a_passwords) / a_workers))
+    l_chunks = await gather(
+        *(
+            l_loop.run_in_executor(a_pool, hash_many, a_passwords[i : i + l_size])
+            for i in range(0, len(a_passwords), l_size)
+        )
+    )
+    return [l_hash for l_chunk in l_chunks for l_hash in l_chunk]
+
+
+async def copy_batch_db(
+    a_db: AsyncEngine, a_rows: List[Tuple[Any, ...]]
+) -> List[Tuple[int, str]]:
+    """
+    COPY a batch into a staging table and merge it into users in one transaction
+    :param a_db: The AsyncEngine from app.state
+    :param a_rows: Values for the STAGING_COLUMNS
+    :return: The line and e-mail of every row which wasn't inserted because the e-mail
+    is already in use
+    """
+    async with a_db.begin() as l_connection:
+        await l_connection.execute(CREATE_STAGING_TABLE)
+        l_raw = await l_connection.get_raw_connection()
+        await l_raw.dbapi_connection.driver_connection.copy_records_to_table(
+            "users_import", records=a_rows, columns=STAGING_COLUMNS
+        )
+        l_result = await l_connection.execute(MERGE_STAGING_TABLE)
+        return [(l_row.line, l_row.email) for l_row in l_result]
+
+
+async def import_users_db(
+    a_db: AsyncEngine,
+    a_lines: AsyncIterable[str],
+    a_format: ImportFormat,
+    a_on_error: Callable[[UserImportErrorSchema], None],
+    a_batch_size: int = core_config.BULK_IMPORT_BATCH_SIZE,
+    a_hash_workers: int = core_config.BULK_IMPORT_HASH_WORKERS,
+) -> UserImportReportSchema:
+    """
+    Import users from CSV or NDJSON lines. While one batch is being hashed and copied
+    the next is parsed and validated.
+    :param a_db: The AsyncEngine from app.state
+    :param a_lines: The lines of the import file
+    :param a_format: The file's format
+    :param a_on_error: Called with each rejected row
+    :param a_batch_size: Rows hashed and copied together
+    :param a_hash_workers: Processes to hash with; 0 for one per CPU
+    :return: Counts and throughput of the import; ValueError if a CSV header is invalid
+    """
+    l_report = UserImportReportSchema()
+    l_start: float = perf_counter()
+    l_workers: int = a_hash_workers or cpu_count() or 1
+    l_pool = ProcessPoolExecutor(max_workers=l_workers)
+    l_previous: Optional[Task] = None
+
+    def reject(a_line: int, a_email: Optional[str], a_error: str) -> None:
+        l_report.rows_rejected += 1
+        a_on_error(UserImportErrorSchema(line=a_line, email=a_email, error=a_error))
+
+    async def load(a_batch: List[PendingUser]) -> None:
+        l_hashes: List[str] = await hash_passwords(
+            l_pool,
+            l_workers,
+            [l_user.password.get_secret_value() for _, l_user in a_batch],
+        )
+        l_now: datetime = datetime.now()
+        l_rejected = await copy_batch_db(
+            a_db,
+            [
+                (
+                    l_line,
+                    l_user.email.lower(),
+                    l_user.username,
+                    l_hash,
+                    l_user.is_active,
+                    l_user.is_superuser,
+                    l_now,
+                )
+                for (l_line, l_user), l_hash in zip(a_batch, l_hashes)
+            ],
+        )
+        for l_line, l_email in l_rejected:
+            reject(l_line, l_email, "An account with that e-mail already exists.")
+        l_report.rows_imported += len(a_batch) - len(l_rejected)
+
+    async def flush(a_batch: List[PendingUser]) -> None:
+        nonlocal l_previous
+        if l_previous is not None:
+            await l_previous
+        l_previous = get_running_loop().create_task(load(a_batch))
+
+    try:
+        l_header: List[str] = []
+        l_batch: List[PendingUser] = []
+        async for l_line, l_text in iter_records(a_lines, a_format):
+            if not l_text.strip():
+                continue
+            if a_format == ImportFormat.csv and not l_header:
+                l_header = parse_csv_header(l_text)
+                continue
+            l_report.rows_read += 1
+            l_record: Dict[str, Any] = {}
+            try:
+                l_record = parse_record(l_text, a_format, l_header)
+                l_batch.append((l_line, validate_record(l_record)))
+            except ValueError as e:
+                l_email: Any = l_record.get("email")
+                reject(l_line, l_email if isinstance(l_email, str) else None, str(e))
+                continue
+            if len(l_batch) >= a_batch_size:
+                await flush(l_batch)
+                l_batch = []
+        if l_batch:
+            await flush(l_batch)
+        if l_previous is not None:
+            await l_previous
+    finally:
+        if l_previous is not None and not l_previous.done():
+            l_previous.cancel()
+        await get_running_loop().run_in_executor(None, l_pool.shutdown)
+
+    l_report.seconds = perf_counter() - l_start
+    l_report.rows_per_second = l_report.rows_read / l_report.seconds
+    logger.info(
+        f"[import_users_db] imported {l_report.rows_imported} of {l_report.rows_read} "
+        f"rows at {l_report.rows_per_second:.0f} rows/s"
+    )
+    return l_report
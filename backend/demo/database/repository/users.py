@@ -0,0 +1,595 @@
+"""
+Asynchronous CRUD functions for the users table.
+
+Every statement is a module level constant so each call sends identical SQL text.
+SQLAlchemy reuses the compiled form and its asyncpg dialect prepares a statement the
+first time a pooled connection sees its text, reusing the prepared statement from then
+on, so repeat queries skip parsing and planning.
+"""
+from datetime import datetime
+from typing import Any
+from typing import Dict
+from typing import FrozenSet
+from typing import List
+from typing import Mapping
+from typing import Optional
+from typing import Tuple
+
+from demo.core.config import core_config
+from demo.core.config import core_logger as logger
+from demo.core.hashing import Hasher
+from demo.database import execute
+from demo.database import fetch_all
+from demo.database import fetch_one
+from demo.database.models.users_model import email_domain
+from demo.database.models.users_model import User
+from demo.schemas.users import UserCreateUpdateSchema
+from demo.schemas.users import UserSchema
+from demo.schemas.users import UserSearchResultSchema
+from demo.schemas.users import UserSearchSchema
+from fastapi import BackgroundTasks
+from fastapi import HTTPException
+from fastapi import status
+from sqlalchemy import not_
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy import tuple_
+from sqlalchemy.engine import RowMapping
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.elements import TextClause
+
+_user_columns: str = "id, email, username, password, is_active, is_superuser, version"
+# Columns of the admin user listing, which never includes the password hash
+_listing_columns: Tuple[str, ...] = (
+    "id",
+    "email",
+    "username",
+    "is_active",
+    "is_superuser",
+    "version",
+    "time_created",
+)
+# Columns of the users an admin search ranks
+_search_columns: str = ", ".join(_listing_columns)
+
+SELECT_USER_BY_ID: TextClause = text(
+    f"SELECT {_user_columns} FROM users WHERE id = :id"
+)
+SELECT_USER_BY_EMAIL: TextClause = text(
+    f"SELECT {_user_columns} FROM users WHERE lower(email) = :email"
+)
+# Batch lookups, one statement however many users are asked for
+SELECT_USERS_BY_IDS: TextClause = text(
+    f"SELECT {_user_columns} FROM users WHERE id = ANY(:ids)"
+)
+SELECT_USERS_BY_EMAILS: TextClause = text(
+    f"SELECT {_user_columns} FROM users WHERE lower(email) = ANY(:emails)"
+)
+# Usernames aren't unique so the oldest account with the username wins
+SELECT_USER_BY_USERNAME: TextClause = text(
+    f"SELECT {_user_columns} FROM users WHERE username = :username ORDER BY id LIMIT 1"
+)
+INSERT_USER: TextClause = text(
+    "INSERT INTO users "
+    "(email, username, password, is_active, is_superuser, time_created) "
+    "VALUES (:email, :username, :password, :is_active, :is_superuser, :time_created) "
+    f"RETURNING {_user_columns}"
+)
+_update_user: str = (
+    "UPDATE users SET email = :email, username = :username, password = :password, "
+    "version = version + 1 WHERE id = :id"
+)
+UPDATE_USER: TextClause = text(f"{_update_user} RETURNING {_user_columns}")
+# Only applies if nobody else updated the user since the client read :version, so
+# concurrent updates are detected without locking the row
+UPDATE_USER_IF_VERSION: TextClause = text(
+    f"{_update_user} AND version = :version RETURNING {_user_columns}"
+)
+# Only replaces the hash which was verified, so a password changed meanwhile is kept
+UPDATE_USER_PASSWORD: TextClause = text(
+    "UPDATE users SET password = :password WHERE id = :id AND password = :old_hash"
+)
+# Users whose e-mail or username contains the term, found through the trigram indexes
+# and ranked by how closely the term matches part of either, then by whole value. At
+# most :candidates matches are ranked, so a term most users contain, such as a common
+# domain, returns as soon as that many are found rather than ranking all of them. Users
+# whose e-mail or username is the term itself are always ranked, found through their
+# own indexes, so the arbitrary cut can't drop an exact match. truncated is set when
+# the cut was reached and better matches may have been left out.
+SEARCH_USERS: TextClause = text(
+    f"""
+    SELECT *,
+        greatest(word_similarity(:term, email), word_similarity(:term, username))
+            AS rank,
+        count(*) OVER () >= :candidates AS truncated
+    FROM (
+        (
+            SELECT {_search_columns}
+            FROM users
+            WHERE email ILIKE :pattern OR username ILIKE :pattern
+            LIMIT :candidates
+        )
+        UNION
+        (SELECT {_search_columns} FROM users WHERE lower(email) = lower(:term))
+        UNION
+        (
+            SELECT {_search_columns}
+            FROM users
+            WHERE username = :term
+            ORDER BY id
+            LIMIT :limit
+        )
+    ) AS candidates
+    ORDER BY rank DESC,
+        greatest(similarity(:term, email), similarity(:term, username)) DESC, id
+    LIMIT :limit
+    """
+)
+# Applies a batch of logins recorded by demo.database.login_recorder, one element of
+# each array per user. Users are locked in ID order so concurrent batches from other
+# workers can't deadlock.
+RECORD_LOGINS: TextClause = text(
+    """
+    UPDATE users
+    SET last_login = greatest(users.last_login, logins.last_login),
+        login_count = users.login_count + logins.count
+    FROM unnest(
+        CAST(:ids AS integer[]),
+        CAST(:last_logins AS timestamp[]),
+        CAST(:counts AS integer[])
+    ) AS logins (id, last_login, count)
+    WHERE users.id = logins.id
+    """
+)
+INSERT_LOGIN_EVENTS: TextClause = text(
+    """
+    INSERT INTO login_events (user_id, time_created, ip_address)
+    SELECT * FROM unnest(
+        CAST(:user_ids AS integer[]),
+        CAST(:times AS timestamp[]),
+        CAST(:ip_addresses AS varchar[])
+    )
+    """
+)
+# Matches ranked per search. Searches matching fewer users rank every match.
+SEARCH_CANDIDATES: int = 1000
+# Applies to the rest of the current transaction only, so it's safe with pooling
+SET_STATEMENT_TIMEOUT: TextClause = text(
+    "SELECT set_config('statement_timeout', :timeout, true)"
+)
+# SQLSTATE of a statement cancelled by statement_timeout
+QUERY_CANCELED: str = "57014"
+
+email_conflict_exception = HTTPException(
+    status_code=status.HTTP_409_CONFLICT,
+    detail="An account with that e-mail already exists.",
+)
+version_conflict_exception = HTTPException(
+    status_code=status.HTTP_412_PRECONDITION_FAILED,
+    detail="The account changed since it was read. Read it again and retry.",
+)
+search_timeout_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="The search took too long. Please try a more specific term.",
+)
+
+# Hash compared against when a login names an account which doesn't exist so unknown
+# and known accounts take the same time to reject
+_dummy_hash: Optional[str] = None
+
+
+def user_schema_from_row(a_row: Mapping[str, Any]) -> UserSchema:
+    """
+    Convert a users row into a UserSchema. Stored values were validated before they were
+    written, so they aren't validated again.
+    :param a_row: A record containing the _user_columns
+    :return: A UserSchema without the password hash
+    """
+    return UserSchema.construct(
+        id=a_row["id"],
+        username=a_row["username"],
+        email=a_row["email"],
+        is_active=a_row["is_active"],
+        is_superuser=a_row["is_superuser"],
+        version=a_row["version"],
+    )
+
+
+async def get_user_by_id_db(a_id: int, a_db: AsyncEngine) -> Optional[UserSchema]:
+    """
+    Retrieve a user by primary key
+    :param a_id: The user ID
+    :param a_db: The AsyncEngine from app.state
+    :return: The matching user; None if there isn't one
+    """
+    l_row = await fetch_one(a_db, SELECT_USER_BY_ID, {"id": a_id})
+    return user_schema_from_row(l_row) if l_row is not None else None
+
+
+async def get_user_by_email_db(a_email: str, a_db: AsyncEngine) -> Optional[UserSchema]:
+    """
+    Retrieve a user by their e-mail address
+    :param a_email: The e-mail address, compared case insensitively
+    :param a_db: The AsyncEngine from app.state
+    :return: The matching user; None if there isn't one
+    """
+    l_row = await fetch_one(a_db, SELECT_USER_BY_EMAIL, {"email": a_email.lower()})
+    return user_schema_from_row(l_row) if l_row is not None else None
+
+
+async def get_users_by_ids_db(
+    a_ids: List[int], a_db: AsyncEngine
+) -> Dict[int, UserSchema]:
+    """
+    Retrieve many users by primary key with one query
+    :param a_ids: The user IDs
+    :param a_db: The AsyncEngine from app.state
+    :return: Each user found by ID; IDs without a user are absent
+    """
+    l_rows = await fetch_all(a_db, SELECT_USERS_BY_IDS, {"ids": a_ids})
+    return {l_row["id"]: user_schema_from_row(l_row) for l_row in l_rows}
+
+
+async def get_users_by_emails_db(
+    a_emails: List[str], a_db: AsyncEngine
+) -> Dict[str, UserSchema]:
+    """
+    Retrieve many users by e-mail address with one query
+    :param a_emails: The e-mail addresses, compared case insensitively
+    :param a_db: The AsyncEngine from app.state
+    :return: Each user found by lowercase e-mail address; addresses without a user
+    are absent
+    """
+    l_rows = await fetch_all(
+        a_db,
+        SELECT_USERS_BY_EMAILS,
+        {"emails": list({l_email.lower() for l_email in a_emails})},
+    )
+    return {l_row["email"].lower(): user_schema_from_row(l_row) for l_row in l_rows}
+
+
+async def create_user_db(
+    a_user: UserCreateUpdateSchema,
+    a_db: AsyncEngine,
+    a_is_active: bool = True,
+    a_is_superuser: bool = False,
+) -> UserSchema:
+    """
+    Insert a new user, hashing their password in the hashing pool
+    :param a_user: The requested new user details
+    :param a_db: The AsyncEngine from app.state
+    :param a_is_active: Whether the account may log in
+    :param a_is_superuser: Whether the account is an administrator
+    :return: The new user; HTTP 409 exception if the e-mail is already in use
+    """
+    try:
+        l_row = await fetch_one(
+            a_db,
+            INSERT_USER,
+            {
+                "email": a_user.email.lower(),
+                "username": a_user.username,
+                "password": await a_user.password.get_hash(),
+                "is_active": a_is_active,
+                "is_superuser": a_is_superuser,
+                "time_created": datetime.now(),
+            },
+        )
+    except IntegrityError:
+        logger.debug(f"[create_user_db] e-mail already in use: {a_user.email}")
+        raise email_conflict_exception
+    logger.info(f"[create_user_db] created user {l_row['id']}")
+    return user_schema_from_row(l_row)
+
+
+async def create_default_admin_db(
+    a_admin: UserCreateUpdateSchema, a_db: AsyncEngine
+) -> UserSchema:
+    """
+    Ensure the default administrator account exists
+    :param a_admin: The default account's details
+    :param a_db: The AsyncEngine from app.state
+    :return: The existing or newly created account
+    """
+    l_admin: Optional[UserSchema] = await get_user_by_email_db(a_admin.email, a_db)
+    if l_admin is not None:
+        return l_admin
+    try:
+        return await create_user_db(
+            a_admin, a_db, a_is_active=True, a_is_superuser=True
+        )
+    except HTTPException:
+        # Another worker created it first
+        return await get_user_by_email_db(a_admin.email, a_db)
+
+
+async def update_user_db(
+    a_id: int,
+    a_user: UserCreateUpdateSchema,
+    a_db: AsyncEngine,
+    a_version: Optional[int] = None,
+) -> Optional[UserSchema]:
+    """
+    Replace a user's username, e-mail and password in a single statement. The password
+    is hashed before it's sent, so no row lock is held while hashing.
+    :param a_id: The user ID
+    :param a_user: The requested new user details
+    :param a_db: The AsyncEngine from app.state
+    :param a_version: If provided, the version the client last read. The user is only
+    updated if it's still current.
+    :return: The updated user; None if there isn't one; HTTP 409 exception if the
+    e-mail is already in use by another account; HTTP 412 exception if a_version
+    isn't the user's current version
+    """
+    l_values: Dict[str, Any] = {
+        "id": a_id,
+        "email": a_user.email.lower(),
+        "username": a_user.username,
+        "password": await a_user.password.get_hash(),
+    }
+    if a_version is not None:
+        l_values["version"] = a_version
+    try:
+        l_row = await fetch_one(
+            a_db,
+            UPDATE_USER if a_version is None else UPDATE_USER_IF_VERSION,
+            l_values,
+        )
+    except IntegrityError:
+        logger.debug(f"[update_user_db] e-mail already in use: {a_user.email}")
+        raise email_conflict_exception
+    if l_row is None and a_version is not None:
+        # Only a failed update pays for telling a stale version from a deleted user
+        if await fetch_one(a_db, SELECT_USER_BY_ID, {"id": a_id}) is None:
+            return None
+        logger.debug(f"[update_user_db] user {a_id} isn't at version {a_version}")
+        raise version_conflict_exception
+    return user_schema_from_row(l_row) if l_row is not None else None
+
+
+async def update_user_password_db(
+    a_id: int, a_plain_password: str, a_old_hash: str, a_db: AsyncEngine
+) -> None:
+    """
+    Replace a user's password hash with one using the currently configured scheme and
+    cost. This is intended to run as a background task after a login. If the user's
+    password changed since a_old_hash was read, the new password is kept.
+    :param a_id: The user ID
+    :param a_plain_password: The plaintext password which was just verified
+    :param a_old_hash: The stored hash a_plain_password was verified against
+    :param a_db: The AsyncEngine from app.state
+    :return: Nothing
+    """
+    l_hash: str = await Hasher.get_password_hash_async(a_plain_password)
+    await execute(
+        a_db,
+        UPDATE_USER_PASSWORD,
+        {"id": a_id, "password": l_hash, "old_hash": a_old_hash},
+    )
+    logger.info(f"[update_user_password_db] upgraded password hash for user {a_id}")
+
+
+async def authenticate_user_db(
+    a_username: str,
+    a_password: str,
+    a_db: AsyncEngine,
+    a_background_tasks: Optional[BackgroundTasks] = None,
+) -> Optional[UserSchema]:
+    """
+    Verify a login. Logins containing '@' are treated as an e-mail address; otherwise
+    as a username.
+    :param a_username: The username or e-mail address provided by the client
+    :param a_password: The plaintext password provided by the client
+    :param a_db: The AsyncEngine from app.state
+    :param a_background_tasks: If provided, an outdated password hash is upgraded after
+    the response is sent
+    :return: The authenticated user; None if the credentials are invalid
+    """
+    global _dummy_hash
+    if "@" in a_username:
+        l_row = await fetch_one(
+            a_db, SELECT_USER_BY_EMAIL, {"email": a_username.lower()}
+        )
+    else:
+        l_row = await fetch_one(a_db, SELECT_USER_BY_USERNAME, {"username": a_username})
+
+    if l_row is None:
+        # Always run the verification, even for unknown accounts, so response timing
+        # doesn't reveal which accounts exist.
+        if _dummy_hash is None:
+            _dummy_hash = await Hasher.get_password_hash_async("not a real password")
+        await Hasher.verify_password_async(a_password, _dummy_hash)
+        return None
+
+    if not await Hasher.verify_password_async(a_password, l_row["password"]):
+        return None
+
+    # Upgrade hashes made with an outdated scheme or cost after the response is sent so
+    # changing the cost fleet-wide never forces a password reset or slows this login.
+    if a_background_tasks is not None and Hasher.needs_update(l_row["password"]):
+        a_background_tasks.add_task(
+            update_user_password_db, l_row["id"], a_password, l_row["password"], a_db
+        )
+    return user_schema_from_row(l_row)
+
+
+def list_users_query(
+    a_limit: int,
+    a_after: Optional[Tuple[datetime, int]] = None,
+    a_is_active: Optional[bool] = None,
+    a_is_superuser: Optional[bool] = None,
+    a_email_domain: Optional[str] = None,
+    a_fields: Optional[FrozenSet[str]] = None,
+) -> Select:
+    """
+    Build the query for one page of users ordered by (time_created, id). Pages continue
+    from the last row of the previous page rather than skipping an OFFSET, so every
+    page is a range scan of ix_users_time_created_id, or its per domain or partial
+    variants, and costs the same however deep it is.
+    :param a_limit: The most rows to return
+    :param a_after: The (time_created, id) of the last row already returned, if any
+    :param a_is_active: If provided, only users with this is_active value
+    :param a_is_superuser: If provided, only users with this is_superuser value
+    :param a_email_domain: If provided, only users whose e-mail is at this domain
+    :param a_fields: If provided, only these of the _listing_columns are selected,
+    along with id and time_created which the next page continues from
+    :return: A select of the _listing_columns
+    """
+    l_users = User.__table__
+    l_query = (
+        select(
+            *(
+                l_users.c[l_column]
+                for l_column in _listing_columns
+                if a_fields is None
+                or l_column in a_fields
+                or l_column in ("id", "time_created")
+            )
+        )
+        .order_by(l_users.c.time_created, l_users.c.id)
+        .limit(a_limit)
+    )
+    if a_after is not None:
+        l_query = l_query.where(
+            tuple_(l_users.c.time_created, l_users.c.id) > tuple_(*a_after)
+        )
+    # The boolean filters are rendered as literal predicates rather than parameters so
+    # the planner can match them to the partial indexes, even with a generic plan
+    if a_is_active is not None:
+        l_query = l_query.where(
+            l_users.c.is_active if a_is_active else not_(l_users.c.is_active)
+        )
+    if a_is_superuser is not None:
+        l_query = l_query.where(
+            l_users.c.is_superuser if a_is_superuser else not_(l_users.c.is_superuser)
+        )
+    if a_email_domain is not None:
+        l_query = l_query.where(email_domain(l_users.c.email) == a_email_domain.lower())
+    return l_query
+
+
+async def list_users_db(
+    a_db: AsyncEngine,
+    a_limit: int,
+    a_after: Optional[Tuple[datetime, int]] = None,
+    a_is_active: Optional[bool] = None,
+    a_is_superuser: Optional[bool] = None,
+    a_email_domain: Optional[str] = None,
+    a_fields: Optional[FrozenSet[str]] = None,
+) -> List[RowMapping]:
+    """
+    Read one page of users ordered by (time_created, id)
+    :param a_db: The AsyncEngine from app.state
+    :param a_limit: The most rows to return
+    :param a_after: The (time_created, id) of the last row already returned, if any
+    :param a_is_active: If provided, only users with this is_active value
+    :param a_is_superuser: If provided, only users with this is_superuser value
+    :param a_email_domain: If provided, only users whose e-mail is at this domain
+    :param a_fields: If provided, only these of the _listing_columns, plus id and
+    time_created, are read
+    :return: The page's rows with the _listing_columns
+    """
+    l_query: Select = list_users_query(
+        a_limit, a_after, a_is_active, a_is_superuser, a_email_domain, a_fields
+    )
+    return await fetch_all(a_db, l_query, {})
+
+
+def like_pattern(a_term: str) -> str:
+    """
+    :param a_term: Text to search for
+    :return: A LIKE pattern matching values containing a_term, with any wildcards in
+    it matched literally
+    """
+    l_escaped: str = (
+        a_term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    )
+    return f"%{l_escaped}%"
+
+
+async def search_users_db(
+    a_db: AsyncEngine,
+    a_term: str,
+    a_limit: int = core_config.USER_SEARCH_MAX_RESULTS,
+    a_timeout_ms: int = core_config.USER_SEARCH_TIMEOUT_MS,
+) -> UserSearchSchema:
+    """
+    Find users whose e-mail or username contains a term, case insensitively, best
+    matches first. Terms shorter than three characters have no trigrams for the
+    indexes to narrow the search with.
+    :param a_db: The AsyncEngine from app.state
+    :param a_term: Part of an e-mail or username
+    :param a_limit: The most users to return, capped at USER_SEARCH_MAX_RESULTS
+    :param a_timeout_ms: Milliseconds the query may run
+    :return: The matching users and whether the candidates ranked were cut short; HTTP
+    503 exception if the query timed out
+    """
+    l_params: Dict[str, Any] = {
+        "term": a_term,
+        "pattern": like_pattern(a_term),
+        "limit": min(a_limit, core_config.USER_SEARCH_MAX_RESULTS),
+        "candidates": SEARCH_CANDIDATES,
+    }
+    try:
+        async with a_db.begin() as l_connection:
+            await l_connection.execute(
+                SET_STATEMENT_TIMEOUT, {"timeout": str(a_timeout_ms)}
+            )
+            l_result = await l_connection.execute(SEARCH_USERS, l_params)
+            l_rows: List[RowMapping] = l_result.mappings().all()
+    except DBAPIError as e:
+        if getattr(e.orig, "pgcode", None) != QUERY_CANCELED:
+            raise
+        logger.warning(f"[search_users_db] search timed out: {a_term!r}")
+        raise search_timeout_exception
+    return UserSearchSchema.construct(
+        users=[
+            UserSearchResultSchema.construct(
+                **{
+                    l_key: l_value
+                    for l_key, l_value in l_row.items()
+                    if l_key != "truncated"
+                }
+            )
+            for l_row in l_rows
+        ],
+        truncated=bool(l_rows) and l_rows[0]["truncated"],
+    )
+
+
+async def record_logins_db(
+    a_db: AsyncEngine,
+    a_logins: Mapping[int, Tuple[datetime, int]],
+    a_events: List[Tuple[int, datetime, Optional[str]]],
+) -> None:
+    """
+    Write a batch of logins in one transaction of two statements, however many it
+    holds
+    :param a_db: The AsyncEngine from app.state
+    :param a_logins: Each user ID's most recent login time and number of logins
+    :param a_events: The user ID, time and client IP address of every login
+    :return: Nothing
+    """
+    l_ids: List[int] = sorted(a_logins)
+    async with a_db.begin() as l_connection:
+        if l_ids:
+            await l_connection.execute(
+                RECORD_LOGINS,
+                {
+                    "ids": l_ids,
+                    "last_logins": [a_logins[l_id][0] for l_id in l_ids],
+                    "counts": [a_logins[l_id][1] for l_id in l_ids],
+                },
+            )
+        if a_events:
+            await l_connection.execute(
+                INSERT_LOGIN_EVENTS,
+                {
+                    "user_ids": [l_event[0] for l_event in a_events],
+                    "times": [l_event[1] for l_event in a_events],
+                    "ip_addresses": [l_event[2] for l_event in a_events],
+                },
+            )
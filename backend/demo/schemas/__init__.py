@@ -12,22 +12,90 @@ These schemas will generally be paired with
     Those routes will typically use these Pydantic schemas to document their input and
     output with clients and convert to and from the SQLAlchemy models.
 """
+from asyncio import ensure_future
+from asyncio import Future
+from functools import lru_cache
+from typing import Any
+from typing import FrozenSet
 from typing import Optional
+from typing import Tuple
+from typing import TypeVar
 
+from demo.core.hashing import Hasher
 from demo.core.security import sanitize_email
 from fastapi import HTTPException
 from fastapi import status
 from pydantic import BaseModel as PydanticBaseModel
 from pydantic import conint
 from pydantic import constr
+from pydantic import SecretStr
+from pydantic.validators import str_validator
 from ujson import loads
 
+Model = TypeVar("Model", bound=PydanticBaseModel)
+
 # A specific type of constrained strings for usernames and passwords to ensure they're
 # reasonable
 generic_str = constr(strip_whitespace=True, min_length=3, max_length=64)
 
-# A specific type of constrained int for user ID to ensure they're reasonable
-user_id_int = conint(ge=1)
+
+class SecretPassword(SecretStr):
+    """
+    Plaintext password with the same constraints as generic_str which stays sealed
+    (masked in repr, logs and serialized output) and is only hashed on demand.
+
+    Parsing a request body no longer costs a bcrypt round. The hash is computed in the
+    async hashing pool the first time get_hash() is awaited, which should be when the
+    repository layer persists it, and is reused by every later call.
+    """
+
+    min_length = 3
+    max_length = 64
+
+    def __init__(self, value: str):
+        super().__init__(value)
+        self._hash_future: Optional[Future] = None
+
+    @classmethod
+    def validate(cls, value: Any) -> "SecretPassword":
+        """
+        Coerce plaintext, SecretStr, or SecretPassword input into a SecretPassword
+        :param value: The client provided password
+        :return: A SecretPassword with surrounding whitespace removed
+        """
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, SecretStr):
+            value = value.get_secret_value()
+        return cls(str_validator(value).strip())
+
+    async def get_hash(self) -> str:
+        """
+        Hash the sealed plaintext exactly once, no matter how many callers await it
+        :return: A hashed representation of the password
+        """
+        if self._hash_future is None:
+            self._hash_future = ensure_future(
+                Hasher.get_password_hash_async(self.get_secret_value())
+            )
+        return await self._hash_future
+
+    async def verify(self, a_hashed_password: str) -> bool:
+        """
+        Compare the sealed plaintext with a stored hash without hashing it here
+        :param a_hashed_password: The reference hash
+        :return: True if they match, False otherwise
+        """
+        return await Hasher.verify_password_async(
+            self.get_secret_value(), a_hashed_password
+        )
+
+
+# The largest user ID the users table's integer id column can hold
+MAX_USER_ID: int = 2**31 - 1
+# A specific type of constrained int for user ID to ensure they're reasonable. IDs
+# beyond the column's range would fail the query rather than simply not be found.
+user_id_int = conint(ge=1, le=MAX_USER_ID)
 
 # A constrained integer for reasonable year values
 year_int = conint(gt=1900, lt=3000)
@@ -76,3 +144,42 @@ def render_safe_email(a_email: Optional[str]) -> Optional[str]:
             status_code=status.HTTP_400_BAD_REQUEST, detail="e-mail is not valid"
         )
     return l_sanitized_email
+
+
+@lru_cache(maxsize=1024)
+def parse_fields(a_fields: str, a_allowed: Tuple[str, ...]) -> FrozenSet[str]:
+    """
+    Parse a fields= query parameter, remembering the result so clients repeating the
+    same request don't repeat the work
+    :param a_fields: Comma separated field names
+    :param a_allowed: The field names which may be requested
+    :return: The requested field names; HTTP 422 exception if one isn't allowed or
+    none were named
+    """
+    l_fields: FrozenSet[str] = frozenset(
+        l_field.strip() for l_field in a_fields.split(",") if l_field.strip()
+    )
+    l_unknown: FrozenSet[str] = l_fields.difference(a_allowed)
+    if not l_fields or l_unknown:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"fields must name one or more of: {', '.join(a_allowed)}",
+        )
+    return l_fields
+
+
+def with_fields(a_model: Model, a_fields: Optional[FrozenSet[str]]) -> Model:
+    """
+    Trim a response to the fields a client asked for. The copy is an instance of the
+    same class with only a_fields set, so serializing it with exclude_unset emits just
+    those fields and no model class is built for each combination of fields.
+    :param a_model: A response model whose fields are all set, e.g. from construct()
+    :param a_fields: The fields to keep; None to keep every field
+    :return: a_model itself if a_fields is None; otherwise a copy with only a_fields
+    set
+    """
+    if a_fields is None:
+        return a_model
+    return type(a_model).construct(
+        **{l_field: getattr(a_model, l_field) for l_field in a_fields}
+    )
@@ -1,25 +1,33 @@
 """
 User Pydantic Schemas
 """
+from datetime import datetime
+from typing import Any
+from typing import Dict
+from typing import List
 from typing import Optional
 
-from demo.core.hashing import Hasher
+from demo.core.config import core_config
 from demo.schemas import BaseModel
 from demo.schemas import generic_str
 from demo.schemas import render_safe_email
+from demo.schemas import SecretPassword
+from demo.schemas import user_id_int
 from pydantic import EmailStr
+from pydantic import root_validator
 from pydantic import validator
 
 
 class UserLoginSchema(BaseModel):
     """
     Facilitate user authentication
+
+    Note: password is a SecretPassword so parsing never hashes it. Await
+    password.get_hash() when persisting or password.verify() when authenticating.
     """
 
     username: generic_str
-    password: generic_str
-
-    _hash_pass = validator("password", allow_reuse=True)(Hasher.get_password_hash)
+    password: SecretPassword
 
 
 class UserCreateUpdateSchema(UserLoginSchema):
@@ -72,5 +80,94 @@ class UserSchema(BaseModel):
     email: EmailStr
     is_active: bool
     is_superuser: bool
+    # Incremented by every update and sent as the ETag of the user's own record.
+    # Records cached before versions were tracked read as version 1.
+    version: int = 1
 
     _sanitize_email = validator("email", allow_reuse=True)(render_safe_email)
+
+
+class UserSearchResultSchema(UserSchema):
+    """
+    A user matching an admin search and how closely they match
+    """
+
+    # id, username, email, is_active, is_superuser and version inherited from UserSchema
+    time_created: datetime
+    # From 0 to 1, the best trigram similarity of the search term to any part of the
+    # user's e-mail or username
+    rank: float
+
+
+class UserSearchSchema(BaseModel):
+    """
+    An admin search's matches, best first
+    """
+
+    users: List[UserSearchResultSchema] = []
+    # Whether the term matched more users than are ranked, so better matches than those
+    # returned may exist. Users whose e-mail or username is the term are always ranked.
+    truncated: bool = False
+
+
+class UserBatchRequestSchema(BaseModel):
+    """
+    Users to look up by ID and by e-mail address, at most USER_BATCH_MAX_ITEMS in all
+    """
+
+    ids: List[user_id_int] = []
+    # Compared case insensitively. Addresses which aren't valid simply aren't found.
+    emails: List[str] = []
+
+    @root_validator(skip_on_failure=True)
+    def limit_items(cls, values: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Reject batches larger than USER_BATCH_MAX_ITEMS
+        :param values: The parsed ids and emails
+        :return: The values unchanged
+        """
+        if (
+            len(values["ids"]) + len(values["emails"])
+            > core_config.USER_BATCH_MAX_ITEMS
+        ):
+            raise ValueError(
+                f"at most {core_config.USER_BATCH_MAX_ITEMS} ids and emails may be "
+                "requested at once"
+            )
+        return values
+
+
+class UserBatchSchema(BaseModel):
+    """
+    The users a batch lookup found, in the order they were asked for. A position is
+    null if there's no user with that ID or e-mail address.
+    """
+
+    ids: List[Optional[UserSchema]] = []
+    emails: List[Optional[UserSchema]] = []
+
+
+class UserImportErrorSchema(BaseModel):
+    """
+    A bulk import row which was rejected
+    """
+
+    # 1-based line number in the uploaded file
+    line: int
+    email: Optional[str] = None
+    error: str
+
+
+class UserImportReportSchema(BaseModel):
+    """
+    Outcome of a bulk user import
+    """
+
+    rows_read: int = 0
+    rows_imported: int = 0
+    rows_rejected: int = 0
+    seconds: float = 0.0
+    rows_per_second: float = 0.0
+    # Rejected rows, up to the limit the caller asked for
+    errors: List[UserImportErrorSchema] = []
+    errors_truncated: bool = False
@@ -28,6 +28,8 @@ else:
     web_concurrency = max(int(default_web_concurrency), 2)
     if use_max_workers:
         web_concurrency = min(web_concurrency, use_max_workers)
+# Workers inherit this so demo.database can divide the connection budget between them
+os.environ["WEB_CONCURRENCY"] = str(web_concurrency)
 accesslog_var = os.getenv("ACCESS_LOG", "-")
 use_accesslog = accesslog_var or None
 errorlog_var = os.getenv("ERROR_LOG", "-")
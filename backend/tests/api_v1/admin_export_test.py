@@ -0,0 +1,116 @@
+"""
+Tests for the administrator bulk user export route
+"""
+from csv import DictReader
+from gzip import decompress
+from io import StringIO
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import pytest
+from demo.core.config import core_config
+from demo.schemas.users import UserCreateUpdateSchema
+from fastapi import status
+from fastapi.testclient import TestClient
+from requests import Response
+from sqlalchemy.ext.asyncio import AsyncEngine
+from tests.api_v1.conftest import v1_route_admin_export_users
+from tests.api_v1.conftest import v1_route_create_user
+from tests.conftest import random_email
+from tests.conftest import random_password
+from tests.conftest import revealed_dict
+from tests.conftest import user_authentication_headers
+from ujson import loads
+
+
+@pytest.fixture(scope="module")
+def awkward_user(client: TestClient, db: AsyncEngine) -> UserCreateUpdateSchema:
+    """
+    A new user whose username needs quoting or escaping in CSV and JSON
+    """
+    l_user = UserCreateUpdateSchema(
+        username='a "quoted", \\\\slashed name',
+        email=random_email(),
+        password=random_password(),
+    )
+    response: Response = client.post(v1_route_create_user, json=revealed_dict(l_user))
+    assert response.status_code == status.HTTP_201_CREATED
+    return l_user
+
+
+def test_export_users_csv(
+    client: TestClient,
+    admin_headers: Dict[str, str],
+    awkward_user: UserCreateUpdateSchema,
+) -> None:
+    """Demonstrate that the CSV export includes every user without password hashes
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        admin_headers (Dict[str, str]): A pytest fixture for administrator credentials
+        awkward_user (UserCreateUpdateSchema): A pytest fixture for a new user
+    """
+    response: Response = client.get(v1_route_admin_export_users, headers=admin_headers)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/csv")
+    assert "users.csv" in response.headers["content-disposition"]
+    l_rows: List[Dict[str, str]] = list(DictReader(StringIO(response.text)))
+    assert "password" not in l_rows[0]
+    assert {l_row["email"]: l_row["username"] for l_row in l_rows} == {
+        core_config.DEFAULT_EMAIL: core_config.DEFAULT_USERNAME,
+        awkward_user.email: awkward_user.username,
+    }
+
+
+def test_export_users_ndjson_gzip(
+    client: TestClient,
+    admin_headers: Dict[str, str],
+    awkward_user: UserCreateUpdateSchema,
+) -> None:
+    """Demonstrate that the gzipped NDJSON export decompresses into one JSON user per
+    line
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        admin_headers (Dict[str, str]): A pytest fixture for administrator credentials
+        awkward_user (UserCreateUpdateSchema): A pytest fixture for a new user
+    """
+    response: Response = client.get(
+        v1_route_admin_export_users,
+        params={"format": "ndjson", "gzip": True},
+        headers=admin_headers,
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/gzip"
+    l_users: List[Dict[str, Any]] = [
+        loads(l_line) for l_line in decompress(response.content).splitlines()
+    ]
+    assert len(l_users) == 2
+    l_user: Dict[str, Any] = next(
+        l_user for l_user in l_users if l_user["email"] == awkward_user.email
+    )
+    assert l_user["username"] == awkward_user.username
+    assert "password" not in l_user
+
+
+def test_export_users_requires_admin(
+    client: TestClient, awkward_user: UserCreateUpdateSchema
+) -> None:
+    """Demonstrate that users who aren't administrators can't export users
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        awkward_user (UserCreateUpdateSchema): A pytest fixture for a new user
+    """
+    l_headers: Optional[Dict[str, str]] = user_authentication_headers(
+        client, awkward_user.email, awkward_user.password.get_secret_value()
+    )
+    assert l_headers is not None
+
+    response: Response = client.get(v1_route_admin_export_users, headers=l_headers)
+
+    assert response.status_code == status.HTTP_403_FORBIDDEN
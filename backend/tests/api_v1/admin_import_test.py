@@ -0,0 +1,122 @@
+"""
+Tests for the administrator bulk user import route
+"""
+from typing import Any
+from typing import Dict
+from typing import List
+
+from demo.core.config import core_config
+from fastapi import status
+from fastapi.testclient import TestClient
+from requests import Response
+from tests.api_v1.conftest import v1_route_admin_import_users
+from tests.conftest import random_email
+from tests.conftest import random_password
+from tests.conftest import user_authentication_headers
+from ujson import dumps
+
+
+def test_import_users_csv(client: TestClient, admin_headers: Dict[str, str]) -> None:
+    """Demonstrate that a CSV import creates the valid rows, including those whose
+    quoted fields span lines, and reports the others by line number
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        admin_headers (Dict[str, str]): A pytest fixture for administrator credentials
+    """
+    l_email: str = random_email()
+    l_multiline_email: str = random_email()
+    l_password: str = random_password().replace(",", "").replace('"', "")
+    l_body: str = "\n".join(
+        [
+            "username,email,password,is_active",
+            f"imported,{l_email},{l_password},",
+            f"second,{random_email()},{l_password},false",
+            f'"two\nlines",{l_multiline_email},{l_password},',
+            f"invalid,not-an-email,{l_password},",
+            f"existing,{core_config.DEFAULT_EMAIL},{l_password},",
+            f"repeated,{l_email},{l_password},",
+            "too,few",
+        ]
+    )
+
+    response: Response = client.post(
+        v1_route_admin_import_users,
+        data=l_body.encode(),
+        headers={**admin_headers, "Content-Type": "text/csv"},
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    l_report: Dict[str, Any] = response.json()
+    assert l_report["rows_read"] == 7
+    assert l_report["rows_imported"] == 3
+    assert l_report["rows_rejected"] == 4
+    # Rows are reported by the line they start on
+    assert [l_error["line"] for l_error in l_report["errors"]] == [6, 9, 7, 8]
+    assert l_report["rows_per_second"] > 0
+    assert user_authentication_headers(client, l_email, l_password) is not None
+    assert (
+        user_authentication_headers(client, l_multiline_email, l_password) is not None
+    )
+
+
+def test_import_users_ndjson_limits_errors(
+    client: TestClient, admin_headers: Dict[str, str]
+) -> None:
+    """Demonstrate that an NDJSON import reports at most max_errors rejected rows
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        admin_headers (Dict[str, str]): A pytest fixture for administrator credentials
+    """
+    l_lines: List[str] = [
+        dumps(
+            {
+                "username": "ndjson",
+                "email": random_email(),
+                "password": random_password(),
+                "is_superuser": True,
+            }
+        ),
+        "[1, 2]",
+        "{not json",
+        dumps({"username": "no password", "email": random_email()}),
+    ]
+
+    response: Response = client.post(
+        v1_route_admin_import_users,
+        params={"max_errors": 2},
+        data="\n".join(l_lines).encode(),
+        headers={**admin_headers, "Content-Type": "application/x-ndjson"},
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    l_report: Dict[str, Any] = response.json()
+    assert l_report["rows_imported"] == 1
+    assert l_report["rows_rejected"] == 3
+    assert len(l_report["errors"]) == 2
+    assert l_report["errors_truncated"]
+
+
+def test_import_users_rejects_invalid_requests(
+    client: TestClient, admin_headers: Dict[str, str]
+) -> None:
+    """Demonstrate that unsupported bodies and unknown CSV columns are rejected
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        admin_headers (Dict[str, str]): A pytest fixture for administrator credentials
+    """
+    response: Response = client.post(
+        v1_route_admin_import_users,
+        data=b"{}",
+        headers={**admin_headers, "Content-Type": "application/json"},
+    )
+    assert response.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+    response = client.post(
+        v1_route_admin_import_users,
+        data=b"username,email,password,role\n",
+        headers={**admin_headers, "Content-Type": "text/csv"},
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,518 @@
+"""
+Tests for administrator User routes
+"""
+from datetime import datetime
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import pytest
+from demo.core.config import core_config
+from demo.core.pagination import encode_cursor
+from demo.database.repository.users import search_users_db
+from demo.schemas.users import UserCreateUpdateSchema
+from fastapi import HTTPException
+from fastapi import status
+from fastapi.testclient import TestClient
+from requests import Response
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from tests.api_v1.conftest import v1_route_admin_cache_stats
+from tests.api_v1.conftest import v1_route_admin_list_users
+from tests.api_v1.conftest import v1_route_admin_search_users
+from tests.api_v1.conftest import v1_route_batch_users
+from tests.api_v1.conftest import v1_route_create_user
+from tests.conftest import random_letters_lower
+from tests.conftest import random_password
+from tests.conftest import revealed_dict
+from tests.conftest import user_authentication_headers
+from ujson import loads
+
+listing_domain: str = f"{random_letters_lower(12)}.com"
+
+
+@pytest.fixture(scope="module")
+def listed_users(client: TestClient, db: AsyncEngine) -> List[UserCreateUpdateSchema]:
+    """
+    Five new users sharing an e-mail domain, in creation order
+    """
+    l_users: List[UserCreateUpdateSchema] = []
+    for _ in range(5):
+        l_email: str = f"{random_letters_lower(10)}@{listing_domain}"
+        l_user = UserCreateUpdateSchema(
+            username=l_email, email=l_email, password=random_password()
+        )
+        response: Response = client.post(
+            v1_route_create_user, json=revealed_dict(l_user)
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        l_users.append(l_user)
+    return l_users
+
+
+def test_list_users_requires_admin(
+    client: TestClient, listed_users: List[UserCreateUpdateSchema]
+) -> None:
+    """Demonstrate that users who aren't administrators can't list users
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        listed_users (List[UserCreateUpdateSchema]): A pytest fixture of new users
+    """
+    l_headers: Optional[Dict[str, str]] = user_authentication_headers(
+        client, listed_users[0].email, listed_users[0].password.get_secret_value()
+    )
+    assert l_headers is not None
+
+    response: Response = client.get(v1_route_admin_list_users, headers=l_headers)
+
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_list_users_pages_with_cursor(
+    client: TestClient,
+    admin_headers: Dict[str, str],
+    listed_users: List[UserCreateUpdateSchema],
+) -> None:
+    """Demonstrate that following next_cursor visits every matching user once, oldest
+    first
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        admin_headers (Dict[str, str]): A pytest fixture for administrator credentials
+        listed_users (List[UserCreateUpdateSchema]): A pytest fixture of new users
+    """
+    l_params: Dict[str, Any] = {"email_domain": listing_domain, "limit": 2}
+    l_emails: List[str] = []
+    l_pages: int = 0
+    while True:
+        response: Response = client.get(
+            v1_route_admin_list_users, params=l_params, headers=admin_headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+        l_body: Dict[str, Any] = response.json()
+        l_emails += [l_user["email"] for l_user in l_body["users"]]
+        l_pages += 1
+        if l_body["next_cursor"] is None:
+            break
+        l_params["cursor"] = l_body["next_cursor"]
+
+    assert l_emails == [l_user.email for l_user in listed_users]
+    assert l_pages == 3
+
+
+def test_list_users_ndjson_resumes_from_line_cursor(
+    client: TestClient,
+    admin_headers: Dict[str, str],
+    listed_users: List[UserCreateUpdateSchema],
+) -> None:
+    """Demonstrate that NDJSON streams every matching user across several queries and
+    that each line's cursor resumes the listing after that line
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        admin_headers (Dict[str, str]): A pytest fixture for administrator credentials
+        listed_users (List[UserCreateUpdateSchema]): A pytest fixture of new users
+    """
+    l_params: Dict[str, Any] = {
+        "email_domain": listing_domain,
+        "page_size": 2,
+        "format": "ndjson",
+    }
+    response: Response = client.get(
+        v1_route_admin_list_users, params=l_params, headers=admin_headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    l_lines: List[Dict[str, Any]] = [
+        loads(l_text) for l_text in response.text.splitlines()
+    ]
+    assert [l_line["email"] for l_line in l_lines] == [
+        l_user.email for l_user in listed_users
+    ]
+
+    l_params["cursor"] = l_lines[1]["cursor"]
+    response = client.get(
+        v1_route_admin_list_users, params=l_params, headers=admin_headers
+    )
+    assert [loads(l_text)["email"] for l_text in response.text.splitlines()] == [
+        l_user.email for l_user in listed_users[2:]
+    ]
+
+
+def test_list_users_filters(
+    client: TestClient,
+    admin_headers: Dict[str, str],
+    listed_users: List[UserCreateUpdateSchema],
+) -> None:
+    """Demonstrate that the listing filters combine
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        admin_headers (Dict[str, str]): A pytest fixture for administrator credentials
+        listed_users (List[UserCreateUpdateSchema]): A pytest fixture of new users
+    """
+    response: Response = client.get(
+        v1_route_admin_list_users,
+        params={"is_superuser": True},
+        headers=admin_headers,
+    )
+    l_users: List[Dict[str, Any]] = response.json()["users"]
+    assert [l_user["email"] for l_user in l_users] == [core_config.DEFAULT_EMAIL]
+
+    response = client.get(
+        v1_route_admin_list_users,
+        params={"email_domain": listing_domain, "is_superuser": True},
+        headers=admin_headers,
+    )
+    assert response.json() == {"users": [], "next_cursor": None}
+
+
+def test_sparse_fields(
+    client: TestClient,
+    admin_headers: Dict[str, str],
+    listed_users: List[UserCreateUpdateSchema],
+) -> None:
+    """Demonstrate that fields= limits the users returned by the listing, search and
+    batch lookup to the named fields, and that listing cursors still work
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        admin_headers (Dict[str, str]): A pytest fixture for administrator credentials
+        listed_users (List[UserCreateUpdateSchema]): A pytest fixture of new users
+    """
+    l_params: Dict[str, Any] = {
+        "email_domain": listing_domain,
+        "page_size": 2,
+        "format": "ndjson",
+        "fields": "time_created,email",
+    }
+    response: Response = client.get(
+        v1_route_admin_list_users, params=l_params, headers=admin_headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    l_lines: List[Dict[str, Any]] = [
+        loads(l_text) for l_text in response.text.splitlines()
+    ]
+    assert [list(l_line) for l_line in l_lines] == [
+        ["email", "time_created", "cursor"]
+    ] * len(listed_users)
+    l_params["cursor"] = l_lines[1]["cursor"]
+    response = client.get(
+        v1_route_admin_list_users, params=l_params, headers=admin_headers
+    )
+    assert [loads(l_text)["email"] for l_text in response.text.splitlines()] == [
+        l_user.email for l_user in listed_users[2:]
+    ]
+
+    response = client.get(
+        v1_route_admin_list_users,
+        params={"email_domain": listing_domain, "limit": 1, "fields": "id"},
+        headers=admin_headers,
+    )
+    assert list(response.json()["users"][0]) == ["id"]
+    assert response.json()["next_cursor"] is not None
+
+    response = client.get(
+        v1_route_admin_search_users,
+        params={"q": listed_users[0].email, "fields": "rank,email"},
+        headers=admin_headers,
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["users"][0]["email"] == listed_users[0].email
+    assert all(set(l_user) == {"email", "rank"} for l_user in response.json()["users"])
+
+    response = client.post(
+        v1_route_batch_users,
+        params={"fields": "username"},
+        json={"ids": [1, 987654]},
+        headers=admin_headers,
+    )
+    assert response.json() == {
+        "ids": [{"username": core_config.DEFAULT_USERNAME}, None],
+        "emails": [],
+    }
+
+    for l_route, l_fields in (
+        (v1_route_admin_list_users, "password"),
+        (v1_route_admin_search_users, "time_created,password"),
+    ):
+        response = client.get(
+            l_route, params={"q": "abc", "fields": l_fields}, headers=admin_headers
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_list_users_rejects_invalid_input(
+    client: TestClient, admin_headers: Dict[str, str]
+) -> None:
+    """Demonstrate that malformed cursors and e-mail domains are rejected
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        admin_headers (Dict[str, str]): A pytest fixture for administrator credentials
+    """
+    for l_cursor in (
+        "bogus",
+        encode_cursor(datetime(2020, 1, 1), 2**40),
+        encode_cursor(datetime(2020, 1, 1), 0),
+    ):
+        response: Response = client.get(
+            v1_route_admin_list_users,
+            params={"cursor": l_cursor},
+            headers=admin_headers,
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    response = client.get(
+        v1_route_admin_list_users,
+        params={"email_domain": "%.com"},
+        headers=admin_headers,
+    )
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_cache_stats(
+    client: TestClient,
+    admin_headers: Dict[str, str],
+    listed_users: List[UserCreateUpdateSchema],
+) -> None:
+    """Demonstrate that administrators, and only administrators, can see the hit ratios
+    of the user and token caches
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        admin_headers (Dict[str, str]): A pytest fixture for administrator credentials
+        listed_users (List[UserCreateUpdateSchema]): A pytest fixture of new users
+    """
+    l_headers: Optional[Dict[str, str]] = user_authentication_headers(
+        client, listed_users[0].email, listed_users[0].password.get_secret_value()
+    )
+    assert l_headers is not None
+    response: Response = client.get(v1_route_admin_cache_stats, headers=l_headers)
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    response = client.get(v1_route_admin_cache_stats, headers=admin_headers)
+    assert response.status_code == status.HTTP_200_OK
+    l_stats: Dict[str, Dict[str, float]] = response.json()
+    assert l_stats["user_cache"]["misses"] >= 1
+    assert 0 <= l_stats["user_cache"]["hit_ratio"] <= 1
+    assert l_stats["token_cache"]["hits"] >= 1
+
+
+def test_search_users_ranks_matches(
+    client: TestClient,
+    admin_headers: Dict[str, str],
+    listed_users: List[UserCreateUpdateSchema],
+) -> None:
+    """Demonstrate that a search finds users by part of their e-mail, best match first,
+    and returns no more than the requested number
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        admin_headers (Dict[str, str]): A pytest fixture for administrator credentials
+        listed_users (List[UserCreateUpdateSchema]): A pytest fixture of new users
+    """
+    l_term: str = listed_users[2].email[:8].upper()
+    response: Response = client.get(
+        v1_route_admin_search_users, params={"q": l_term}, headers=admin_headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    l_users: List[Dict[str, Any]] = response.json()["users"]
+    assert [l_user["email"] for l_user in l_users] == [listed_users[2].email]
+    assert 0 < l_users[0]["rank"] <= 1
+
+    response = client.get(
+        v1_route_admin_search_users,
+        params={"q": listing_domain, "limit": 3},
+        headers=admin_headers,
+    )
+    l_emails: List[str] = [l_user["email"] for l_user in response.json()["users"]]
+    assert len(l_emails) == 3
+    assert set(l_emails) <= {l_user.email for l_user in listed_users}
+    assert response.json()["truncated"] is False
+
+    # Wildcards in the term match literally
+    response = client.get(
+        v1_route_admin_search_users, params={"q": "%_%"}, headers=admin_headers
+    )
+    assert response.json() == {"users": [], "truncated": False}
+
+
+def test_search_users_keeps_exact_matches(
+    client: TestClient,
+    admin_headers: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Demonstrate that a user whose e-mail or username is the search term is found
+    even when the term matches more users than are ranked, and that the response says
+    the matches were cut short
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        admin_headers (Dict[str, str]): A pytest fixture for administrator credentials
+        monkeypatch (pytest.MonkeyPatch): A pytest fixture to rank fewer candidates
+    """
+    # The exact matches are created last, so a cut taking the first users found
+    # leaves them out
+    l_name: str = random_letters_lower(10)
+    l_domain: str = f"{random_letters_lower(12)}.com"
+    for l_prefix in ("a", "b", ""):
+        l_user = UserCreateUpdateSchema(
+            username=f"{l_name}{l_prefix}",
+            email=f"{l_prefix}{l_name}@{l_domain}",
+            password=random_password(),
+        )
+        response: Response = client.post(
+            v1_route_create_user, json=revealed_dict(l_user)
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+    monkeypatch.setattr("demo.database.repository.users.SEARCH_CANDIDATES", 1)
+
+    for l_term, l_field in ((l_name, "username"), (f"{l_name}@{l_domain}", "email")):
+        response = client.get(
+            v1_route_admin_search_users,
+            params={"q": l_term, "fields": l_field},
+            headers=admin_headers,
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["users"][0] == {l_field: l_term}
+        assert response.json()["truncated"] is True
+
+
+def test_search_users_rejects_invalid_input(
+    client: TestClient,
+    admin_headers: Dict[str, str],
+    listed_users: List[UserCreateUpdateSchema],
+) -> None:
+    """Demonstrate that only administrators may search, with terms of at least three
+    characters and limits no higher than USER_SEARCH_MAX_RESULTS
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        admin_headers (Dict[str, str]): A pytest fixture for administrator credentials
+        listed_users (List[UserCreateUpdateSchema]): A pytest fixture of new users
+    """
+    l_headers: Optional[Dict[str, str]] = user_authentication_headers(
+        client, listed_users[0].email, listed_users[0].password.get_secret_value()
+    )
+    assert l_headers is not None
+    response: Response = client.get(
+        v1_route_admin_search_users, params={"q": "abc"}, headers=l_headers
+    )
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    for l_params in (
+        {"q": "ab"},
+        {"q": "abc", "limit": core_config.USER_SEARCH_MAX_RESULTS + 1},
+    ):
+        response = client.get(
+            v1_route_admin_search_users, params=l_params, headers=admin_headers
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_batch_lookup_keeps_request_order(
+    client: TestClient,
+    admin_headers: Dict[str, str],
+    listed_users: List[UserCreateUpdateSchema],
+) -> None:
+    """Demonstrate that a batch lookup answers every ID and e-mail address in the
+    order given, repeats included, with null for those without a user
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        admin_headers (Dict[str, str]): A pytest fixture for administrator credentials
+        listed_users (List[UserCreateUpdateSchema]): A pytest fixture of new users
+    """
+    l_emails: List[str] = [l_user.email for l_user in listed_users]
+    response: Response = client.post(
+        v1_route_batch_users,
+        json={"emails": [l_emails[2].upper(), "nobody@example.com", "not an e-mail"]},
+        headers=admin_headers,
+    )
+    assert response.status_code == status.HTTP_200_OK
+    l_found: List[Optional[Dict[str, Any]]] = response.json()["emails"]
+    assert l_found[0]["email"] == l_emails[2]
+    assert l_found[1:] == [None, None]
+    assert response.json()["ids"] == []
+
+    l_ids: List[int] = [l_found[0]["id"], 987654, 1, l_found[0]["id"]]
+    response = client.post(
+        v1_route_batch_users,
+        json={"ids": l_ids, "emails": [l_emails[0]]},
+        headers=admin_headers,
+    )
+    assert response.status_code == status.HTTP_200_OK
+    l_by_id: List[Optional[Dict[str, Any]]] = response.json()["ids"]
+    assert [l_user and l_user["id"] for l_user in l_by_id] == [
+        l_ids[0],
+        None,
+        1,
+        l_ids[0],
+    ]
+    assert l_by_id[0] == l_found[0]
+    assert l_by_id[2]["username"] == core_config.DEFAULT_USERNAME
+    assert response.json()["emails"][0]["email"] == l_emails[0]
+
+
+def test_batch_lookup_rejects_invalid_input(
+    client: TestClient,
+    admin_headers: Dict[str, str],
+    listed_users: List[UserCreateUpdateSchema],
+) -> None:
+    """Demonstrate that only administrators may look users up in bulk, at most
+    USER_BATCH_MAX_ITEMS at a time and only by IDs a user could have
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        admin_headers (Dict[str, str]): A pytest fixture for administrator credentials
+        listed_users (List[UserCreateUpdateSchema]): A pytest fixture of new users
+    """
+    l_headers: Optional[Dict[str, str]] = user_authentication_headers(
+        client, listed_users[0].email, listed_users[0].password.get_secret_value()
+    )
+    assert l_headers is not None
+    response: Response = client.post(
+        v1_route_batch_users, json={"ids": [1]}, headers=l_headers
+    )
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    response = client.post(
+        v1_route_batch_users,
+        json={
+            "ids": list(range(1, core_config.USER_BATCH_MAX_ITEMS + 1)),
+            "emails": ["one@example.com"],
+        },
+        headers=admin_headers,
+    )
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    # IDs the users table can't hold are rejected rather than failing the query
+    for l_id in (0, 2**31, 2**40):
+        response = client.post(
+            v1_route_batch_users, json={"ids": [1, l_id]}, headers=admin_headers
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_search_users_times_out(client: TestClient, db: AsyncEngine) -> None:
+    """Demonstrate that a search which runs longer than its timeout is cancelled
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's engine
+    """
+
+    async def search_locked_table(a_db: AsyncEngine) -> None:
+        # The search waits for the lock until its timeout cancels it
+        async with a_db.begin() as l_connection:
+            await l_connection.execute(
+                text("LOCK TABLE users IN ACCESS EXCLUSIVE MODE")
+            )
+            await search_users_db(a_db, "abc", a_timeout_ms=100)
+
+    with pytest.raises(HTTPException) as e:
+        client.portal.call(search_locked_table, db)
+    assert e.value.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
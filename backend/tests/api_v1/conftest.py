@@ -4,3 +4,13 @@ paths.
 """
 v1_route_create_user: str = "/v1/users/create"
 v1_route_login: str = "/v1/login/token"
+v1_route_refresh: str = "/v1/login/refresh"
+v1_route_revoke: str = "/v1/login/revoke"
+v1_route_get_user: str = "/v1/users/get"
+v1_route_update_user: str = "/v1/users/update"
+v1_route_batch_users: str = "/v1/users/batch"
+v1_route_admin_list_users: str = "/v1/admin/users/list"
+v1_route_admin_import_users: str = "/v1/admin/users/import"
+v1_route_admin_export_users: str = "/v1/admin/users/export"
+v1_route_admin_cache_stats: str = "/v1/admin/users/cache-stats"
+v1_route_admin_search_users: str = "/v1/admin/users/search"
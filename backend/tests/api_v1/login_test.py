@@ -3,13 +3,33 @@ Tests for Login related routes
 """
 from logging import getLogger
 from typing import Dict
+from typing import Optional
 
 import jwt
 from demo.core.config import core_config
+from demo.core.hashing import Hasher
+from demo.core.rate_limit import login_ip_rate_limiter
+from demo.core.rate_limit import login_username_rate_limiter
+from demo.database import execute
+from demo.database import fetch_one
+from demo.database.login_recorder import login_recorder
+from demo.database.repository.users import SELECT_USER_BY_ID
+from demo.database.repository.users import update_user_password_db
 from demo.schemas.users import UserLoginSchema
 from fastapi import status
 from fastapi.testclient import TestClient
 from jwt.exceptions import PyJWTError
+from passlib.context import CryptContext
+from pytest import MonkeyPatch
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from tests.api_v1.conftest import v1_route_get_user
+from tests.api_v1.conftest import v1_route_refresh
+from tests.api_v1.conftest import v1_route_revoke
+from tests.conftest import random_email
+from tests.conftest import random_password
+from tests.conftest import revealed_dict
+from tests.conftest import user_authentication_headers
 
 # from demo.schemas.users import UserCreateUpdateSchema
 
@@ -24,6 +44,9 @@ from jwt.exceptions import PyJWTError
 
 logger = getLogger(__name__)
 
+SET_PASSWORD = text("UPDATE users SET password = :password WHERE id = :id")
+SELECT_LOGIN_COUNT = text("SELECT last_login, login_count FROM users WHERE id = :id")
+
 
 # def test_default_user(
 #     client: TestClient,
@@ -53,15 +76,19 @@ logger = getLogger(__name__)
 
 def test_default_user_login(
     client: TestClient,
+    db: AsyncEngine,
     default_test_account_login: UserLoginSchema,
 ) -> None:
     """Demonstrate that an existing user account can login via the FastAPI route.
 
     Args:
         client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
         default_test_account_login (UserCreateUpdateSchema): A pytest fixture for a default user/pass
     """
-    response = client.post("/v1/login/token", data=default_test_account_login.dict())
+    response = client.post(
+        "/v1/login/token", data=revealed_dict(default_test_account_login)
+    )
 
     assert response.status_code == status.HTTP_200_OK
 
@@ -81,9 +108,226 @@ def test_default_user_login(
         logger.info(f"[test_user_login] Decoded JWT: {l_jwt}")
         # Here we will assume that the database was wiped and the very first user
         # account created was the default account. Thus, it should be ID 1
-        assert l_jwt["sub"] == "5"
-        # TODO: Change this back to 1 since the default account should be the first in
-        #  the database
+        assert l_jwt["sub"] == "1"
         assert isinstance(l_jwt["exp"], int)
     except PyJWTError as e:
         logger.error(f"Failed to decode JWT during login: {e}")
+
+
+def test_invalid_password_login(
+    client: TestClient,
+    db: AsyncEngine,
+    default_test_account_login: UserLoginSchema,
+) -> None:
+    """Demonstrate that an incorrect password is rejected by the FastAPI route.
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
+        default_test_account_login (UserLoginSchema): A pytest fixture for a default user/pass
+    """
+    l_data: Dict[str, str] = revealed_dict(default_test_account_login)
+    l_data["password"] = random_password()
+    response = client.post("/v1/login/token", data=l_data)
+
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_login_upgrades_outdated_hash(
+    client: TestClient,
+    db: AsyncEngine,
+    default_test_account_login: UserLoginSchema,
+) -> None:
+    """Demonstrate that a successful login transparently rehashes an outdated hash.
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
+        default_test_account_login (UserLoginSchema): A pytest fixture for a default user/pass
+    """
+    l_outdated_hash: str = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash(
+        core_config.DEFAULT_USER_PASS
+    )
+    assert Hasher.needs_update(l_outdated_hash)
+    client.portal.call(
+        execute, db, SET_PASSWORD, {"id": 1, "password": l_outdated_hash}
+    )
+
+    response = client.post(
+        "/v1/login/token", data=revealed_dict(default_test_account_login)
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    l_row = client.portal.call(fetch_one, db, SELECT_USER_BY_ID, {"id": 1})
+    assert l_row["password"] != l_outdated_hash
+    assert not Hasher.needs_update(l_row["password"])
+
+
+def test_rehash_keeps_changed_password(client: TestClient, db: AsyncEngine) -> None:
+    """Demonstrate that a rehash after a login doesn't overwrite a password which was
+    changed after the login was verified
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
+    """
+    l_verified_hash: str = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash(
+        core_config.DEFAULT_USER_PASS
+    )
+    l_before = client.portal.call(fetch_one, db, SELECT_USER_BY_ID, {"id": 1})
+    assert l_before["password"] != l_verified_hash
+
+    client.portal.call(
+        update_user_password_db, 1, core_config.DEFAULT_USER_PASS, l_verified_hash, db
+    )
+    l_after = client.portal.call(fetch_one, db, SELECT_USER_BY_ID, {"id": 1})
+    assert l_after["password"] == l_before["password"]
+
+
+def test_login_recorded(
+    client: TestClient,
+    db: AsyncEngine,
+    default_test_account_login: UserLoginSchema,
+) -> None:
+    """Demonstrate that a successful login is buffered rather than written by the
+    route, then counted in the user's bookkeeping once the recorder flushes.
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
+        default_test_account_login (UserLoginSchema): A pytest fixture for a default user/pass
+    """
+    client.portal.call(login_recorder.flush)
+    l_before = client.portal.call(fetch_one, db, SELECT_LOGIN_COUNT, {"id": 1})
+    l_recorded: int = login_recorder.recorded
+
+    response = client.post(
+        "/v1/login/token", data=revealed_dict(default_test_account_login)
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert login_recorder.recorded == l_recorded + 1
+    client.portal.call(login_recorder.flush)
+    l_after = client.portal.call(fetch_one, db, SELECT_LOGIN_COUNT, {"id": 1})
+    assert l_after["login_count"] == l_before["login_count"] + 1
+    assert l_after["last_login"] is not None
+
+
+def test_revoked_token_rejected(
+    client: TestClient,
+    db: AsyncEngine,
+    default_test_account_login: UserLoginSchema,
+) -> None:
+    """Demonstrate that a revoked access token is rejected before it expires, even
+    after this worker has cached it as verified.
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
+        default_test_account_login (UserLoginSchema): A pytest fixture for a default user/pass
+    """
+    l_headers: Optional[Dict[str, str]] = user_authentication_headers(
+        client,
+        default_test_account_login.username,
+        default_test_account_login.password.get_secret_value(),
+    )
+    assert l_headers is not None
+
+    # Cache the token as verified before revoking it
+    response = client.get(v1_route_get_user, headers=l_headers)
+    assert response.status_code == status.HTTP_200_OK
+
+    response = client.post(v1_route_revoke, headers=l_headers)
+    assert response.status_code == status.HTTP_200_OK
+
+    response = client.get(v1_route_get_user, headers=l_headers)
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    response = client.post(v1_route_revoke, headers=l_headers)
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    # Other tokens for the same user are unaffected
+    l_new_headers: Optional[Dict[str, str]] = user_authentication_headers(
+        client,
+        default_test_account_login.username,
+        default_test_account_login.password.get_secret_value(),
+    )
+    assert l_new_headers is not None
+    response = client.get(v1_route_get_user, headers=l_new_headers)
+    assert response.status_code == status.HTTP_200_OK
+
+
+def test_refresh_token_rotation(
+    client: TestClient,
+    db: AsyncEngine,
+    default_test_account_login: UserLoginSchema,
+) -> None:
+    """Demonstrate that a refresh token mints a new access token exactly once and that
+    replaying it revokes every refresh token descended from the same login.
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
+        default_test_account_login (UserLoginSchema): A pytest fixture for a default user/pass
+    """
+    response = client.post(
+        "/v1/login/token", data=revealed_dict(default_test_account_login)
+    )
+    assert response.status_code == status.HTTP_200_OK
+    l_first_refresh: str = response.json()["refresh_token"]
+
+    response = client.post(
+        v1_route_refresh,
+        data={"grant_type": "refresh_token", "refresh_token": l_first_refresh},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    l_tokens: Dict[str, str] = response.json()
+    assert l_tokens["refresh_token"] != l_first_refresh
+    response = client.get(
+        v1_route_get_user,
+        headers={"Authorization": f"Bearer {l_tokens['access_token']}"},
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    # Replaying the redeemed token is rejected and revokes its replacement as well
+    response = client.post(
+        v1_route_refresh,
+        data={"grant_type": "refresh_token", "refresh_token": l_first_refresh},
+    )
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    response = client.post(
+        v1_route_refresh,
+        data={
+            "grant_type": "refresh_token",
+            "refresh_token": l_tokens["refresh_token"],
+        },
+    )
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_login_rate_limits(
+    client: TestClient, db: AsyncEngine, monkeypatch: MonkeyPatch
+) -> None:
+    """Demonstrate that logins are limited per client IP before the form is parsed and
+    per username before the password is hashed.
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
+        monkeypatch (MonkeyPatch): A pytest fixture for temporarily patching objects
+    """
+    monkeypatch.setattr(login_username_rate_limiter, "capacity", 1)
+    l_data: Dict[str, str] = {"username": random_email(), "password": random_password()}
+    response = client.post("/v1/login/token", data=l_data)
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    response = client.post("/v1/login/token", data=l_data)
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert int(response.headers["Retry-After"]) > 0
+
+    # Use fresh buckets so earlier logins from the test client don't count
+    monkeypatch.setattr(login_ip_rate_limiter, "name", "login-ip-test")
+    monkeypatch.setattr(login_ip_rate_limiter, "capacity", 1)
+    # An empty form is rejected during parsing until the IP's bucket is empty
+    response = client.post("/v1/login/token")
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    response = client.post("/v1/login/token")
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
@@ -2,32 +2,47 @@
 Tests for User related routes
 """
 from logging import getLogger
+from typing import Dict
+from typing import List
 from typing import Optional
 
+from demo.core.cache import user_cache
+from demo.core.config import core_config
+from demo.core.token_cache import verified_token_cache
+from demo.database import execute
 from demo.schemas.users import UserCreateUpdateSchema
 from fastapi import status
 from fastapi.testclient import TestClient
 from requests import Response
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
 from tests.api_v1.conftest import v1_route_create_user
+from tests.api_v1.conftest import v1_route_get_user
+from tests.api_v1.conftest import v1_route_update_user
 from tests.conftest import random_user
-
-# from sqlalchemy.orm import Session
+from tests.conftest import revealed_dict
+from tests.conftest import user_authentication_headers
 
 logger = getLogger(__name__)
 
+DEACTIVATE_USER = text("UPDATE users SET is_active = false WHERE id = :id")
+DELETE_USER = text("DELETE FROM users WHERE id = :id")
+
 
-def test_create_user(client: TestClient) -> None:
+def test_create_user(client: TestClient, db: AsyncEngine) -> None:
     """Demonstrate that a unique new user account creation request succeeds
 
     Args:
         client (TestClient): A pytest fixture for a FastAPI TestClient
-        # db_session (Session): A pytest fixture for a SQLAlchemy database Session
+        db (AsyncEngine): A pytest fixture for the application's database engine
     """
     l_new_user: Optional[UserCreateUpdateSchema] = random_user()
     # Verify random user creation succeeded
     assert l_new_user is not None
 
-    response: Response = client.post(v1_route_create_user, l_new_user.json())
+    response: Response = client.post(
+        v1_route_create_user, json=revealed_dict(l_new_user)
+    )
 
     logger.debug(
         f"[test_create_user] response: [{response.status_code}] {response.text}"
@@ -39,36 +54,265 @@ def test_create_user(client: TestClient) -> None:
     # this assert may fail if the l_new_user includes non-lowercase characters since
     # the response will be only lowercase.
     assert response.json()["email"] == l_new_user.email
-    # assert response.json()["is_active"] is True
-    assert response.json()["is_active"] is False
-
-
-# def test_create_user_duplicate(client: TestClient, db_session: Session) -> None:
-#     """Demonstrate that a redundant user account creation request fails as expected
-#
-#     Args:
-#         client (TestClient): A pytest fixture for a FastAPI TestClient
-#         db_session (Session): A pytest fixture for a SQLAlchemy database Session
-#     """
-#     l_new_user: Optional[UserCreateUpdateSchema] = random_user()
-#     # Verify random user creation succeeded
-#     assert l_new_user is not None
-#
-#     response: Response = client.post(v1_route_create_user, l_new_user.json())
-#
-#     logger.debug(
-#         f"[test_create_user_duplicate] response 1: [{response.status_code}] {response.text}"
-#     )
-#
-#     assert response.status_code == status.HTTP_201_CREATED
-#     assert response.json()["email"] == l_new_user.email
-#     assert response.json()["is_active"] is True
-#
-#     # Now try to add this user a 2nd time
-#     response = client.post(v1_route_create_user, l_new_user.json())
-#     logger.debug(
-#         f"[test_create_user_duplicate] response 2: [{response.status_code}] {response.text}"
-#     )
-#     assert response.status_code == status.HTTP_409_CONFLICT
-#     assert response.json()["email"] == l_new_user.email
-#     assert response.json()["is_active"] is False
+    assert response.json()["is_active"] is True
+
+
+def test_create_user_duplicate(client: TestClient, db: AsyncEngine) -> None:
+    """Demonstrate that a redundant user account creation request fails as expected
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
+    """
+    l_new_user: Optional[UserCreateUpdateSchema] = random_user()
+    # Verify random user creation succeeded
+    assert l_new_user is not None
+
+    response: Response = client.post(
+        v1_route_create_user, json=revealed_dict(l_new_user)
+    )
+
+    logger.debug(
+        f"[test_create_user_duplicate] response 1: [{response.status_code}] {response.text}"
+    )
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["email"] == l_new_user.email
+    assert response.json()["is_active"] is True
+
+    # Now try to add this user a 2nd time
+    response = client.post(v1_route_create_user, json=revealed_dict(l_new_user))
+    logger.debug(
+        f"[test_create_user_duplicate] response 2: [{response.status_code}] {response.text}"
+    )
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+
+def test_new_user_login_and_update(client: TestClient, db: AsyncEngine) -> None:
+    """Demonstrate that a newly created account can log in, read and update its own
+    record
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
+    """
+    l_new_user: Optional[UserCreateUpdateSchema] = random_user()
+    assert l_new_user is not None
+    response: Response = client.post(
+        v1_route_create_user, json=revealed_dict(l_new_user)
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    l_id: int = response.json()["id"]
+
+    l_headers: Optional[Dict[str, str]] = user_authentication_headers(
+        client, l_new_user.email, l_new_user.password.get_secret_value()
+    )
+    assert l_headers is not None
+    response = client.get(v1_route_get_user, headers=l_headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["id"] == l_id
+
+    l_updated_user: Optional[UserCreateUpdateSchema] = random_user()
+    assert l_updated_user is not None
+    response = client.put(
+        v1_route_update_user, json=revealed_dict(l_updated_user), headers=l_headers
+    )
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.json()["email"] == l_updated_user.email
+
+    response = client.get(v1_route_get_user, headers=l_headers)
+    assert response.json()["email"] == l_updated_user.email
+    assert (
+        user_authentication_headers(
+            client, l_updated_user.email, l_updated_user.password.get_secret_value()
+        )
+        is not None
+    )
+
+
+def test_update_if_match(client: TestClient, db: AsyncEngine) -> None:
+    """Demonstrate that an update sent with the ETag of an outdated record is rejected
+    rather than overwriting someone else's update
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
+    """
+    l_new_user: Optional[UserCreateUpdateSchema] = random_user()
+    assert l_new_user is not None
+    response: Response = client.post(
+        v1_route_create_user, json=revealed_dict(l_new_user)
+    )
+    assert response.json()["version"] == 1
+    l_headers: Optional[Dict[str, str]] = user_authentication_headers(
+        client, l_new_user.email, l_new_user.password.get_secret_value()
+    )
+    assert l_headers is not None
+    response = client.get(v1_route_get_user, headers=l_headers)
+    l_etag: str = response.headers["ETag"]
+    assert l_etag == '"1"'
+    response = client.get(v1_route_get_user, params={"fields": "id"}, headers=l_headers)
+    assert response.headers["ETag"] == l_etag
+
+    l_body: Dict[str, str] = revealed_dict(random_user())
+    response = client.put(
+        v1_route_update_user, json=l_body, headers={**l_headers, "If-Match": l_etag}
+    )
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.json()["version"] == 2
+    assert response.headers["ETag"] == '"2"'
+
+    # A second update based on what was read earlier conflicts with the first
+    for l_if_match in (l_etag, "2", 'W/"2"', '"\u00b2"'):
+        response = client.put(
+            v1_route_update_user,
+            json=revealed_dict(random_user()),
+            headers={**l_headers, "If-Match": l_if_match},
+        )
+        assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+    response = client.get(v1_route_get_user, headers=l_headers)
+    assert response.json()["email"] == l_body["email"]
+    assert response.headers["ETag"] == '"2"'
+
+    # Without If-Match, or with *, updates are unconditional
+    for l_extra_headers, l_version in (({"If-Match": "*"}, 3), ({}, 4)):
+        response = client.put(
+            v1_route_update_user,
+            json=revealed_dict(random_user()),
+            headers={**l_headers, **l_extra_headers},
+        )
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.headers["ETag"] == f'"{l_version}"'
+
+
+def test_update_if_match_deleted_user(client: TestClient, db: AsyncEngine) -> None:
+    """Demonstrate that a conditional update of a user deleted since their record was
+    cached is answered with 404 rather than as a version conflict
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
+    """
+    l_new_user: Optional[UserCreateUpdateSchema] = random_user()
+    assert l_new_user is not None
+    response: Response = client.post(
+        v1_route_create_user, json=revealed_dict(l_new_user)
+    )
+    l_id: int = response.json()["id"]
+    l_headers: Optional[Dict[str, str]] = user_authentication_headers(
+        client, l_new_user.email, l_new_user.password.get_secret_value()
+    )
+    assert l_headers is not None
+    l_etag: str = client.get(v1_route_get_user, headers=l_headers).headers["ETag"]
+
+    # The user cache still holds the record so the token is accepted
+    client.portal.call(execute, db, DELETE_USER, {"id": l_id})
+    response = client.put(
+        v1_route_update_user,
+        json=revealed_dict(random_user()),
+        headers={**l_headers, "If-Match": l_etag},
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    client.portal.call(user_cache.invalidate, l_id)
+
+
+def test_get_my_info_uses_token_cache(client: TestClient, db: AsyncEngine) -> None:
+    """Demonstrate that repeat requests with the same token skip JWT verification
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
+    """
+    l_headers: Optional[Dict[str, str]] = user_authentication_headers(
+        client, core_config.DEFAULT_USERNAME, core_config.DEFAULT_USER_PASS
+    )
+    assert l_headers is not None
+    verified_token_cache.clear()
+
+    for _ in range(3):
+        response: Response = client.get(v1_route_get_user, headers=l_headers)
+        assert response.status_code == status.HTTP_200_OK
+
+    assert verified_token_cache.stats()["misses"] == 1
+    assert verified_token_cache.stats()["hits"] == 2
+
+
+async def deactivate_user(a_db: AsyncEngine, a_id: int) -> None:
+    """
+    Deactivate a user and invalidate their cached record, as an administrator would
+    """
+    await execute(a_db, DEACTIVATE_USER, {"id": a_id})
+    await user_cache.invalidate(a_id)
+
+
+def test_cached_tokens_follow_user_changes(client: TestClient, db: AsyncEngine) -> None:
+    """Demonstrate that tokens already in the verified token cache see their user's
+    updates, and are rejected once the user is deactivated
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
+    """
+    l_new_user: Optional[UserCreateUpdateSchema] = random_user()
+    assert l_new_user is not None
+    response: Response = client.post(
+        v1_route_create_user, json=revealed_dict(l_new_user)
+    )
+    l_id: int = response.json()["id"]
+    # Two sessions, e.g. on two devices, each with its token cached
+    l_sessions: List[Dict[str, str]] = []
+    for _ in range(2):
+        l_headers: Optional[Dict[str, str]] = user_authentication_headers(
+            client, l_new_user.email, l_new_user.password.get_secret_value()
+        )
+        assert l_headers is not None
+        l_sessions.append(l_headers)
+        assert client.get(v1_route_get_user, headers=l_headers).status_code == 200
+
+    l_body: Dict[str, str] = revealed_dict(random_user())
+    response = client.put(v1_route_update_user, json=l_body, headers=l_sessions[0])
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    response = client.get(v1_route_get_user, headers=l_sessions[1])
+    assert response.json()["email"] == l_body["email"]
+    assert response.headers["ETag"] == '"2"'
+
+    client.portal.call(deactivate_user, db, l_id)
+    for l_headers in l_sessions:
+        response = client.get(v1_route_get_user, headers=l_headers)
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_get_my_info_sparse_fields(client: TestClient, db: AsyncEngine) -> None:
+    """Demonstrate that fields= limits the response to the named fields and rejects
+    fields the route doesn't return
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
+    """
+    l_headers: Optional[Dict[str, str]] = user_authentication_headers(
+        client, core_config.DEFAULT_USERNAME, core_config.DEFAULT_USER_PASS
+    )
+    assert l_headers is not None
+
+    response: Response = client.get(
+        v1_route_get_user, params={"fields": "email, id"}, headers=l_headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"id": 1, "email": core_config.DEFAULT_EMAIL}
+
+    response = client.get(v1_route_get_user, headers=l_headers)
+    assert set(response.json()) == {
+        "id",
+        "username",
+        "email",
+        "is_active",
+        "is_superuser",
+        "version",
+    }
+
+    for l_fields in ("password", "id,password", ",", "time_created"):
+        response = client.get(
+            v1_route_get_user, params={"fields": l_fields}, headers=l_headers
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
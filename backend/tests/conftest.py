@@ -7,6 +7,7 @@ yield based pytest fixtures below. Iterator[str] was used for clarity and simpli
 https://docs.python.org/3/library/typing.html#typing.Generator
 """
 import secrets
+from asyncio import run
 from datetime import date
 from datetime import datetime
 from logging import getLogger
@@ -20,35 +21,32 @@ from typing import Generator
 from typing import Optional
 
 import pytest
+from asyncpg.exceptions import PostgresError
 from demo.core.config import core_config
 from demo.core.config import CoreConfig
+from demo.core.redis_client import set_redis
+from demo.database import Base
+from demo.database import engine
 from demo.main import get_application
 from demo.schemas.users import UserAdminCreateUpdateSchema
 from demo.schemas.users import UserCreateUpdateSchema
 from demo.schemas.users import UserLoginSchema
+from fakeredis.aioredis import FakeRedis
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
+from pydantic import BaseModel
+from pydantic import SecretStr
 from pydantic import ValidationError
 from pydantic.errors import EmailError
 from pydantic.errors import StrError
 from requests import Response
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine
 
 # from fastapi import HTTPException
 # from fastapi import status
 # from pydantic.errors import MissingError
 
-# from demo.database import Base
-# from demo.database import engine_default
-# from demo.database import get_db
-# from demo.database.repository.users import create_default_admin_db
-# from demo.database.repository.users import create_user_db
-# from demo.database.repository.users import get_user_by_email_db
-
-# from sqlalchemy import MetaData
-# from sqlalchemy.engine.base import Engine
-# from sqlalchemy.orm import Session
-# from sqlalchemy.orm import sessionmaker
-
 
 logger = getLogger(__name__)
 
@@ -89,7 +87,10 @@ def default_test_account_login() -> UserLoginSchema:
 def app() -> Generator[FastAPI, Any, None]:
     """
     Provide an initialized FastAPI fixture for pytest's TestClient wrapper.
+
+    Redis is replaced with an in-memory stand-in so no Redis service is required.
     """
+    set_redis(FakeRedis(decode_responses=True))
     _app: FastAPI = get_application(a_config=testing_config)
 
     yield _app
@@ -125,44 +126,61 @@ def app() -> Generator[FastAPI, Any, None]:
 #     connection.close()
 
 
-@pytest.fixture(scope="module")
-def client(
-    app: FastAPI, default_test_account: UserAdminCreateUpdateSchema
-) -> Generator[TestClient, Any, None]:
+async def reset_database() -> None:
     """
-    Create a new pytest TestClient that wraps FastAPI and overrides the `get_db`
-    dependency that is injected into routes.
+    Drop and re-create every table. The pool is disposed afterwards as its connections
+    belong to this event loop rather than the TestClient's.
+    """
+    try:
+        async with engine.begin() as l_connection:
+            await l_connection.run_sync(Base.metadata.drop_all, checkfirst=True)
+            await l_connection.run_sync(Base.metadata.create_all, checkfirst=True)
+    finally:
+        await engine.dispose()
+
 
-    This also drops and re-initializes the test database tables.
+@pytest.fixture(scope="module")
+def client(app: FastAPI) -> Generator[TestClient, Any, None]:
     """
-    # app.dependency_overrides[get_db] = override_get_db
+    Create a new pytest TestClient that wraps FastAPI.
 
-    # logger.debug(
-    #     f"[client fixture] TestClient creating default user with engine: {db_session.get_bind().engine}"
-    # )
+    This also drops and re-initializes the test database tables. The default account
+    is then created by the application's startup handler.
+    """
+    # Wipe and reset the test database
+    try:
+        run(reset_database())
+    except (OSError, PostgresError, DBAPIError) as e:
+        logger.warning(f"[client fixture] Unable to reset the test database: {e}")
 
     with TestClient(app) as client:
-        # Wipe and reset the test database
-        # l_metadata: MetaData = Base.metadata
-        # l_metadata.drop_all(bind=engine_default, checkfirst=True)
-        # l_metadata.create_all(bind=engine_default, checkfirst=True)
-
-        # Add the default account
-        # l_session: TestingSessionLocal = next(iter(override_get_db()))
-        # l_admin = create_default_admin_db(a_admin=default_test_account, a_db=l_session)
-
-        # if isinstance(l_admin, UserSchema):
-        #     logger.info(f"Test client created default user: {l_admin.__dict__}")
-        # else:
-        #     logger.info("Test client failed to create default user.")
-        #     raise HTTPException(
-        #         status_code=status.HTTP_401_UNAUTHORIZED,
-        #         detail="Failed to instantiate default user account during FastAPI "
-        #         "TestClient creation.",
-        #     )
         yield client
 
 
+@pytest.fixture(scope="module")
+def db(client: TestClient) -> AsyncEngine:
+    """
+    The engine whose pool the application verified at startup. Tests which need the
+    database are skipped if it couldn't be reached.
+    """
+    l_db: Optional[AsyncEngine] = getattr(client.app.state, "_db", None)
+    if l_db is None:
+        pytest.skip("The test database is unavailable")
+    return l_db
+
+
+@pytest.fixture(scope="module")
+def admin_headers(client: TestClient, db: AsyncEngine) -> Dict[str, str]:
+    """
+    Authorization headers for the default administrator account
+    """
+    l_headers: Optional[Dict[str, str]] = user_authentication_headers(
+        client, core_config.DEFAULT_USERNAME, core_config.DEFAULT_USER_PASS
+    )
+    assert l_headers is not None
+    return l_headers
+
+
 def user_authentication_headers(
     a_client: TestClient, a_email: str, a_password: str
 ) -> Optional[Dict[str, str]]:
@@ -193,6 +211,22 @@ def user_authentication_headers(
     return None
 
 
+def revealed_dict(a_schema: BaseModel) -> Dict[str, Any]:
+    """
+    Secret fields such as SecretPassword are masked when serialized. Reveal them so the
+    schema can be used as a request body.
+    Args:
+        a_schema: A Pydantic schema instance
+
+    Returns: A dict of the schema fields with cleartext secret values
+
+    """
+    return {
+        k: v.get_secret_value() if isinstance(v, SecretStr) else v
+        for k, v in a_schema.dict().items()
+    }
+
+
 def random_letters(a_length: int = 32) -> str:
     """
     Return a string of random uppercase and lowercase letters a_length long
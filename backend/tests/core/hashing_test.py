@@ -0,0 +1,99 @@
+"""
+Tests for the async password hashing engine
+"""
+from asyncio import gather
+
+import pytest
+from demo.core.config import core_config
+from demo.core.config import CoreConfig
+from demo.core.config import HashPoolKind
+from demo.core.hashing import ARGON2_MAX_TIME_COST
+from demo.core.hashing import build_crypt_context
+from demo.core.hashing import calibrate_argon2_time_cost
+from demo.core.hashing import calibrate_bcrypt_rounds
+from demo.core.hashing import HashingEngine
+from fastapi import HTTPException
+from fastapi import status
+from passlib.context import CryptContext
+from pytest import MonkeyPatch
+from tests.conftest import random_password
+
+
+async def test_hash_and_verify_round_trip() -> None:
+    """Demonstrate that hashes produced by the engine verify against the plaintext"""
+    l_engine: HashingEngine = HashingEngine(a_kind=HashPoolKind.thread, a_workers=1)
+    l_password: str = random_password()
+    try:
+        l_hash: str = await l_engine.hash(l_password)
+        assert l_hash != l_password
+        assert await l_engine.verify(l_password, l_hash) is True
+        assert await l_engine.verify(random_password(), l_hash) is False
+        assert l_engine.pending == 0
+    finally:
+        l_engine.shutdown()
+
+
+async def test_pending_limit_rejects_excess_requests() -> None:
+    """Demonstrate that requests beyond the pending limit receive a 503 immediately"""
+    l_engine: HashingEngine = HashingEngine(
+        a_kind=HashPoolKind.thread, a_workers=1, a_max_pending=1
+    )
+    try:
+        l_results = await gather(
+            l_engine.hash(random_password()),
+            l_engine.hash(random_password()),
+            return_exceptions=True,
+        )
+        assert isinstance(l_results[0], str)
+        assert isinstance(l_results[1], HTTPException)
+        assert l_results[1].status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert l_engine.rejected == 1
+    finally:
+        l_engine.shutdown()
+
+
+@pytest.mark.parametrize("a_kind", [HashPoolKind.thread, HashPoolKind.process])
+async def test_pool_kinds(a_kind: HashPoolKind) -> None:
+    """Demonstrate that both thread and process pools produce usable hashes"""
+    l_engine: HashingEngine = HashingEngine(a_kind=a_kind, a_workers=1)
+    l_password: str = random_password()
+    try:
+        assert await l_engine.verify(l_password, await l_engine.hash(l_password))
+    finally:
+        l_engine.shutdown()
+
+
+def test_needs_update_when_cost_changes() -> None:
+    """Demonstrate that hashes with a higher or lower cost than configured are flagged"""
+    l_config: CoreConfig = core_config.copy(update={"BCRYPT_ROUNDS": 5})
+    l_context: CryptContext = build_crypt_context(l_config)
+    l_password: str = random_password()
+
+    assert l_context.needs_update(l_context.hash(l_password)) is False
+    for l_rounds in (4, 6):
+        l_other: CryptContext = build_crypt_context(
+            core_config.copy(update={"BCRYPT_ROUNDS": l_rounds})
+        )
+        assert l_context.needs_update(l_other.hash(l_password)) is True
+
+
+def test_calibrate_bcrypt_rounds() -> None:
+    """Demonstrate that calibration never returns less than the requested minimum"""
+    l_rounds, l_ms = calibrate_bcrypt_rounds(a_target_ms=1, a_min_rounds=4)
+    assert l_rounds == 4
+    assert l_ms > 0
+
+
+def test_calibrate_argon2_time_cost_is_bounded(monkeypatch: MonkeyPatch) -> None:
+    """Demonstrate that argon2 calibration stops at ARGON2_MAX_TIME_COST even if every
+    time cost fits the budget
+
+    Args:
+        monkeypatch (MonkeyPatch): A pytest fixture for patching the hash timer
+    """
+    monkeypatch.setattr("demo.core.hashing.measure_hash_ms", lambda a_context: 0.1)
+    l_time_cost, l_ms = calibrate_argon2_time_cost(
+        a_target_ms=250, a_memory_cost=1024, a_parallelism=1
+    )
+    assert l_time_cost == ARGON2_MAX_TIME_COST
+    assert l_ms == 0.1
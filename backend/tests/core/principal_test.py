@@ -0,0 +1,33 @@
+"""
+Tests for the authenticated Principal
+"""
+import pytest
+from demo.core.principal import Principal
+from demo.schemas.users import UserSchema
+
+
+def test_principal_is_immutable() -> None:
+    """Demonstrate that a Principal can't be altered once created"""
+    l_principal: Principal = Principal(
+        a_id=5, a_username="user", a_email="u@example.com"
+    )
+    with pytest.raises(AttributeError):
+        l_principal.is_superuser = True
+    with pytest.raises(AttributeError):
+        l_principal.extra = "value"
+    assert not hasattr(l_principal, "__dict__")
+    assert l_principal == Principal(a_id=5, a_username="user", a_email="u@example.com")
+
+
+def test_principal_to_schema() -> None:
+    """Demonstrate that converting a Principal matches a validated UserSchema"""
+    l_principal: Principal = Principal(
+        a_id=5, a_username="user", a_email="u@example.com", a_is_active=True
+    )
+    assert l_principal.to_schema() == UserSchema(
+        id=5,
+        username="user",
+        email="u@example.com",
+        is_active=True,
+        is_superuser=False,
+    )
@@ -0,0 +1,43 @@
+"""
+Tests for the token bucket rate limiter
+"""
+from demo.core.redis_client import set_redis
+from demo.core.rate_limit import LocalTokenBuckets
+from demo.core.rate_limit import RateLimiter
+from fakeredis.aioredis import FakeRedis
+from redis.asyncio import Redis
+
+
+def test_local_buckets_refill() -> None:
+    """Demonstrate that a bucket allows a burst and then reports when to retry"""
+    l_buckets: LocalTokenBuckets = LocalTokenBuckets(a_capacity=2, a_rate=1.0)
+    assert l_buckets.take("a") == 0
+    assert l_buckets.take("a") == 0
+    assert 0 < l_buckets.take("a") <= 1
+    # Buckets are independent per key
+    assert l_buckets.take("b") == 0
+
+
+async def test_redis_buckets_shared_between_workers() -> None:
+    """Demonstrate that limiters in different workers draw from the same bucket"""
+    set_redis(FakeRedis(decode_responses=True))
+    try:
+        l_worker_a: RateLimiter = RateLimiter("test", a_capacity=2, a_per_minute=1)
+        l_worker_b: RateLimiter = RateLimiter("test", a_capacity=2, a_per_minute=1)
+        assert await l_worker_a.take("10.0.0.1") == 0
+        assert await l_worker_b.take("10.0.0.1") == 0
+        assert 0 < await l_worker_a.take("10.0.0.1") <= 60
+        assert await l_worker_b.take("10.0.0.2") == 0
+    finally:
+        set_redis(None)
+
+
+async def test_falls_back_without_redis() -> None:
+    """Demonstrate that limits are still enforced per worker when Redis is down"""
+    set_redis(Redis(port=1, decode_responses=True))
+    try:
+        l_limiter: RateLimiter = RateLimiter("test", a_capacity=1, a_per_minute=1)
+        assert await l_limiter.take("10.0.0.1") == 0
+        assert await l_limiter.take("10.0.0.1") > 0
+    finally:
+        set_redis(None)
@@ -0,0 +1,33 @@
+"""
+Tests for the refresh token store
+"""
+import pytest
+from demo.core.redis_client import get_redis
+from demo.core.redis_client import set_redis
+from demo.core.refresh_tokens import RefreshTokenStore
+from demo.core.tokens import TokenError
+from fakeredis.aioredis import FakeRedis
+
+
+async def test_refresh_tokens_stored_as_digests() -> None:
+    """Demonstrate that refresh tokens are never stored in the clear and that a token
+    may only be redeemed once"""
+    set_redis(FakeRedis(decode_responses=True))
+    try:
+        l_store: RefreshTokenStore = RefreshTokenStore(
+            a_secret_key="secret", a_expire_minutes=5
+        )
+        l_token: str = await l_store.issue("5")
+        l_keys = [l_key async for l_key in get_redis().scan_iter()]
+        assert l_keys
+        assert not any(l_token in l_key for l_key in l_keys)
+
+        l_subject, l_replacement = await l_store.rotate(l_token)
+        assert l_subject == "5"
+        assert 0 < await get_redis().ttl(l_keys[0]) <= 300
+        with pytest.raises(TokenError):
+            await l_store.rotate(l_token)
+        with pytest.raises(TokenError):
+            await l_store.rotate("not-a-refresh-token")
+    finally:
+        set_redis(None)
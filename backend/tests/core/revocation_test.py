@@ -0,0 +1,68 @@
+"""
+Tests for the token revocation list
+"""
+from asyncio import sleep
+from time import time
+from uuid import uuid4
+
+from demo.core.redis_client import set_redis
+from demo.core.revocation import BloomFilter
+from demo.core.revocation import RevocationList
+from fakeredis.aioredis import FakeRedis
+
+
+def test_bloom_filter_error_rate() -> None:
+    """Demonstrate that the filter never misses a member and that false positives stay
+    near the configured rate"""
+    l_bloom: BloomFilter = BloomFilter(a_capacity=1000, a_error_rate=0.01)
+    l_members = [uuid4().hex for _ in range(1000)]
+    for l_member in l_members:
+        l_bloom.add(l_member)
+
+    assert all(l_member in l_bloom for l_member in l_members)
+    l_false_positives: int = sum(uuid4().hex in l_bloom for _ in range(10000))
+    assert l_false_positives < 300
+
+
+async def test_revocation_reaches_other_workers() -> None:
+    """Demonstrate that a revocation made by one worker is mirrored by another over
+    pub/sub without either checking Redis for unrevoked tokens"""
+    set_redis(FakeRedis(decode_responses=True))
+    l_worker_a: RevocationList = RevocationList(a_capacity=100, a_error_rate=0.001)
+    l_worker_b: RevocationList = RevocationList(a_capacity=100, a_error_rate=0.001)
+    l_worker_b.start()
+    try:
+        # Let worker B subscribe before anything is revoked
+        await sleep(0.1)
+        l_jti: str = uuid4().hex
+        await l_worker_a.revoke(l_jti, time() + 60)
+        await sleep(0.1)
+
+        assert await l_worker_a.is_revoked(l_jti)
+        assert await l_worker_b.is_revoked(l_jti)
+        assert not await l_worker_b.is_revoked(uuid4().hex)
+        assert not await l_worker_b.is_revoked(None)
+        assert l_worker_b.confirmations == 1
+    finally:
+        await l_worker_b.stop()
+        set_redis(None)
+
+
+async def test_rebuild_loads_existing_revocations() -> None:
+    """Demonstrate that a new worker learns of earlier revocations and that expired
+    tokens are never stored"""
+    set_redis(FakeRedis(decode_responses=True))
+    try:
+        l_worker_a: RevocationList = RevocationList(a_capacity=100, a_error_rate=0.001)
+        l_jti: str = uuid4().hex
+        l_expired_jti: str = uuid4().hex
+        await l_worker_a.revoke(l_jti, time() + 60)
+        await l_worker_a.revoke(l_expired_jti, time() - 60)
+        assert not await l_worker_a.is_revoked(l_expired_jti)
+
+        l_worker_b: RevocationList = RevocationList(a_capacity=100, a_error_rate=0.001)
+        assert not await l_worker_b.is_revoked(l_jti)
+        await l_worker_b.rebuild()
+        assert await l_worker_b.is_revoked(l_jti)
+    finally:
+        set_redis(None)
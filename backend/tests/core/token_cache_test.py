@@ -0,0 +1,49 @@
+"""
+Tests for the verified token cache
+"""
+from time import time
+
+from demo.core.token_cache import VerifiedTokenCache
+
+
+def test_cache_hits_and_lru_eviction() -> None:
+    """Demonstrate that the least recently used token is evicted first"""
+    l_cache: VerifiedTokenCache = VerifiedTokenCache(a_max_size=2)
+    l_expires_at: float = time() + 60
+    l_cache.put("token-a", "a", l_expires_at)
+    l_cache.put("token-b", "b", l_expires_at)
+
+    # Touch token-a so token-b becomes the least recently used entry
+    assert l_cache.get("token-a") == "a"
+    l_cache.put("token-c", "c", l_expires_at)
+
+    assert l_cache.get("token-b") is None
+    assert l_cache.get("token-a") == "a"
+    assert l_cache.get("token-c") == "c"
+    assert l_cache.stats() == {
+        "size": 2,
+        "max_size": 2,
+        "hits": 3,
+        "misses": 1,
+        "hit_ratio": 0.75,
+    }
+
+
+def test_cache_honors_expiration() -> None:
+    """Demonstrate that principals are never returned after the token's exp claim"""
+    l_cache: VerifiedTokenCache = VerifiedTokenCache(a_max_size=8)
+    l_cache.put("expired", "x", time() - 1)
+    assert l_cache.stats()["size"] == 0
+
+    l_cache.put("expiring", "y", time() + 60)
+    # Simulate the token expiring while cached
+    l_cache._entries[l_cache._key("expiring")] = (time() - 1, "y")
+    assert l_cache.get("expiring") is None
+    assert l_cache.stats()["size"] == 0
+
+
+def test_disabled_cache_stores_nothing() -> None:
+    """Demonstrate that a max size of 0 disables the cache"""
+    l_cache: VerifiedTokenCache = VerifiedTokenCache(a_max_size=0)
+    l_cache.put("token", "principal", time() + 60)
+    assert l_cache.get("token") is None
@@ -0,0 +1,151 @@
+"""
+Tests for the JSON Web Token codecs
+"""
+from datetime import datetime
+from datetime import timedelta
+from pathlib import Path
+from typing import Any
+from typing import Tuple
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from demo.core.config import CoreConfig
+from demo.core.config import TokenBackend
+from demo.core.tokens import create_token_codec
+from demo.core.tokens import generate_signing_key_pem
+from demo.core.tokens import JoseCodec
+from demo.core.tokens import KeyRing
+from demo.core.tokens import PyJWTCodec
+from demo.core.tokens import TokenError
+from pydantic import ValidationError
+from tests.conftest import random_password
+
+
+def generate_keys(a_algorithm: str) -> Tuple[Any, Any]:
+    """
+    Create throwaway key material for a_algorithm
+    Args:
+        a_algorithm: A JWS algorithm name
+
+    Returns: A (signing key, verifying key) tuple
+
+    """
+    if a_algorithm == "HS256":
+        l_secret: bytes = random_password(32).encode()
+        return l_secret, l_secret
+    if a_algorithm == "ES256":
+        l_private_key = ec.generate_private_key(ec.SECP256R1())
+    else:
+        l_private_key = ed25519.Ed25519PrivateKey.generate()
+    return l_private_key, l_private_key.public_key()
+
+
+codec_cases = [
+    (PyJWTCodec, "HS256"),
+    (PyJWTCodec, "ES256"),
+    (PyJWTCodec, "EdDSA"),
+    (JoseCodec, "HS256"),
+    (JoseCodec, "ES256"),
+]
+
+
+@pytest.mark.parametrize("a_codec_class,a_algorithm", codec_cases)
+def test_codec_round_trip(a_codec_class: type, a_algorithm: str) -> None:
+    """Demonstrate that each backend verifies its own tokens and rejects bad ones"""
+    l_codec = a_codec_class(KeyRing(a_algorithm, *generate_keys(a_algorithm)))
+    l_token: str = l_codec.encode(
+        {"sub": "1", "exp": datetime.utcnow() + timedelta(minutes=1)}
+    )
+    assert l_codec.decode(l_token)["sub"] == "1"
+
+    # A token signed with other keys must be rejected
+    l_imposter = a_codec_class(KeyRing(a_algorithm, *generate_keys(a_algorithm)))
+    with pytest.raises(TokenError):
+        l_codec.decode(l_imposter.encode({"sub": "1"}))
+
+    l_expired: str = l_codec.encode(
+        {"sub": "1", "exp": datetime.utcnow() - timedelta(minutes=1)}
+    )
+    with pytest.raises(TokenError):
+        l_codec.decode(l_expired)
+
+
+@pytest.mark.parametrize("a_algorithm", ["HS256", "ES256"])
+def test_backends_are_interchangeable(a_algorithm: str) -> None:
+    """Demonstrate that tokens from one backend verify with the other"""
+    l_key_ring: KeyRing = KeyRing(a_algorithm, *generate_keys(a_algorithm))
+    l_pyjwt: PyJWTCodec = PyJWTCodec(l_key_ring)
+    l_jose: JoseCodec = JoseCodec(l_key_ring)
+
+    assert l_jose.decode(l_pyjwt.encode({"sub": "2"}))["sub"] == "2"
+    assert l_pyjwt.decode(l_jose.encode({"sub": "3"}))["sub"] == "3"
+
+
+@pytest.mark.parametrize("a_codec_class", [PyJWTCodec, JoseCodec])
+def test_rotated_keys_keep_verifying(a_codec_class: type) -> None:
+    """Demonstrate that tokens signed by a retired key verify after rotation"""
+    l_old_private, l_old_public = generate_keys("ES256")
+    l_old_codec = a_codec_class(KeyRing("ES256", l_old_private, l_old_public))
+    l_old_token: str = l_old_codec.encode({"sub": "4"})
+
+    l_new_codec = a_codec_class(
+        KeyRing("ES256", *generate_keys("ES256"), a_retired_public_keys=[l_old_public])
+    )
+    assert l_new_codec.decode(l_old_token)["sub"] == "4"
+    assert l_new_codec.key_ring.kid != l_old_codec.key_ring.kid
+    assert [k["kid"] for k in l_new_codec.key_ring.jwks["keys"]] == [
+        l_new_codec.key_ring.kid,
+        l_old_codec.key_ring.kid,
+    ]
+
+    # Once the retired key is dropped its tokens are rejected by kid
+    l_newest_codec = a_codec_class(KeyRing("ES256", *generate_keys("ES256")))
+    with pytest.raises(TokenError):
+        l_newest_codec.decode(l_old_token)
+
+
+def test_jwks_verifies_tokens_downstream() -> None:
+    """Demonstrate that a downstream service can verify tokens using only the JWKS"""
+    l_codec: PyJWTCodec = PyJWTCodec(KeyRing("EdDSA", *generate_keys("EdDSA")))
+    l_token: str = l_codec.encode({"sub": "5"})
+
+    l_jwks = jwt.PyJWKSet.from_dict(l_codec.key_ring.jwks)
+    l_kid: str = jwt.get_unverified_header(l_token)["kid"]
+    l_key = next(k for k in l_jwks.keys if k.key_id == l_kid)
+    assert jwt.decode(l_token, l_key.key, algorithms=["EdDSA"])["sub"] == "5"
+
+
+def test_symmetric_keys_are_never_published() -> None:
+    """Demonstrate that HMAC secrets are absent from the JWKS and token headers"""
+    l_codec: PyJWTCodec = PyJWTCodec(KeyRing("HS256", *generate_keys("HS256")))
+    assert l_codec.key_ring.jwks == {"keys": []}
+    assert "kid" not in jwt.get_unverified_header(l_codec.encode({"sub": "6"}))
+
+
+def test_eddsa_defaults_to_pyjwt(tmp_path: Path) -> None:
+    """Demonstrate that a key from generate-signing-key's default EdDSA algorithm works
+    without choosing a TOKEN_BACKEND, and that choosing python-jose, which can't use
+    it, is rejected with the configuration
+
+    Args:
+        tmp_path (Path): A pytest fixture for a temporary directory
+    """
+    l_key_file: Path = tmp_path / "jwt_signing.pem"
+    l_key_file.write_bytes(generate_signing_key_pem("EdDSA")[0])
+
+    l_config: CoreConfig = CoreConfig(
+        HASH_ALGORITHM="EdDSA", JWT_PRIVATE_KEY_FILE=l_key_file
+    )
+    assert l_config.TOKEN_BACKEND == TokenBackend.pyjwt
+    l_codec = create_token_codec(l_config)
+    assert l_codec.decode(l_codec.encode({"sub": "4"}))["sub"] == "4"
+
+    with pytest.raises(ValidationError, match="TOKEN_BACKEND=pyjwt"):
+        CoreConfig(
+            HASH_ALGORITHM="EdDSA",
+            JWT_PRIVATE_KEY_FILE=l_key_file,
+            TOKEN_BACKEND=TokenBackend.jose,
+        )
+    assert CoreConfig(HASH_ALGORITHM="ES256").TOKEN_BACKEND == TokenBackend.jose
@@ -0,0 +1,221 @@
+"""
+Tests for the two tier user cache
+"""
+from asyncio import gather
+from asyncio import sleep
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from demo.core.cache import UserCache
+from demo.core.redis_client import set_redis
+from demo.schemas.users import UserSchema
+from fakeredis.aioredis import FakeRedis
+
+
+def make_user(a_id: int, a_username: str = "cached") -> UserSchema:
+    """
+    Build a user record without touching the database
+    """
+    return UserSchema.construct(
+        id=a_id,
+        username=a_username,
+        email=f"{a_username}@example.com",
+        is_active=True,
+        is_superuser=False,
+    )
+
+
+class CountingLoader:
+    """
+    Stand-in for the database which records each lookup
+    """
+
+    def __init__(self, a_user: Optional[UserSchema]):
+        self.user: Optional[UserSchema] = a_user
+        self.calls: List[int] = []
+
+    async def __call__(self) -> Optional[UserSchema]:
+        self.calls.append(1)
+        # Give concurrent lookups a chance to pile up behind this one
+        await sleep(0.05)
+        return self.user
+
+
+class CountingBatchLoader:
+    """
+    Stand-in for the database's batch lookup which records the IDs of each lookup
+    """
+
+    def __init__(self, a_users: List[UserSchema]):
+        self.users: Dict[int, UserSchema] = {l_user.id: l_user for l_user in a_users}
+        self.calls: List[List[int]] = []
+
+    async def __call__(self, a_ids: List[int]) -> Dict[int, UserSchema]:
+        self.calls.append(a_ids)
+        await sleep(0.05)
+        return {l_id: self.users[l_id] for l_id in a_ids if l_id in self.users}
+
+
+async def test_concurrent_misses_share_one_load() -> None:
+    """Demonstrate that simultaneous misses cause a single database read and that
+    later lookups are served by each tier in turn"""
+    set_redis(FakeRedis(decode_responses=True))
+    try:
+        l_cache: UserCache = UserCache(a_max_size=8, a_ttl_seconds=60)
+        l_loader: CountingLoader = CountingLoader(make_user(1))
+
+        l_users = await gather(*(l_cache.get(1, l_loader) for _ in range(10)))
+        assert all(l_user == make_user(1) for l_user in l_users)
+        assert len(l_loader.calls) == 1
+
+        assert await l_cache.get(1, l_loader) == make_user(1)
+        # A second worker finds the record in Redis
+        l_other: UserCache = UserCache(a_max_size=8, a_ttl_seconds=60)
+        assert await l_other.get(1, l_loader) == make_user(1)
+        assert len(l_loader.calls) == 1
+
+        assert l_cache.stats() == {
+            "size": 1,
+            "max_size": 8,
+            "l1_hits": 1,
+            "l2_hits": 0,
+            "coalesced": 9,
+            "misses": 1,
+            "l1_hit_ratio": 1 / 11,
+            "hit_ratio": 10 / 11,
+        }
+        assert l_other.stats()["l2_hits"] == 1
+
+        # Missing users aren't cached
+        l_missing: CountingLoader = CountingLoader(None)
+        assert await l_cache.get(2, l_missing) is None
+        assert await l_cache.get(2, l_missing) is None
+        assert len(l_missing.calls) == 2
+    finally:
+        set_redis(None)
+
+
+async def test_invalidation_reaches_other_workers() -> None:
+    """Demonstrate that invalidating a user drops every worker's copy and that a load
+    in progress during the invalidation isn't cached"""
+    set_redis(FakeRedis(decode_responses=True))
+    l_worker_a: UserCache = UserCache(a_max_size=8, a_ttl_seconds=60)
+    l_worker_b: UserCache = UserCache(a_max_size=8, a_ttl_seconds=60)
+    l_worker_b.start()
+    try:
+        # Let worker B subscribe before anything is cached
+        await sleep(0.1)
+        await l_worker_b.get(1, CountingLoader(make_user(1)))
+        assert l_worker_b.stats()["size"] == 1
+
+        await l_worker_a.invalidate(1)
+        await sleep(0.1)
+        l_renamed: CountingLoader = CountingLoader(make_user(1, "renamed"))
+        assert (await l_worker_b.get(1, l_renamed)).username == "renamed"
+        assert len(l_renamed.calls) == 1
+
+        # Invalidate while worker A is part way through loading the old record
+        l_stale: CountingLoader = CountingLoader(make_user(3, "stale"))
+        l_load = l_worker_a.get(3, l_stale)
+        l_invalidate = l_worker_a.invalidate(3)
+        await gather(l_load, l_invalidate)
+        l_fresh: CountingLoader = CountingLoader(make_user(3, "fresh"))
+        assert (await l_worker_a.get(3, l_fresh)).username == "fresh"
+    finally:
+        await l_worker_b.stop()
+        set_redis(None)
+
+
+async def test_get_many_reads_each_tier_once() -> None:
+    """Demonstrate that a batch is answered by this worker's LRU, then one Redis
+    MGET, then one database read for the rest, and that a single lookup already in
+    progress is joined rather than repeated"""
+    set_redis(FakeRedis(decode_responses=True))
+    try:
+        l_cache: UserCache = UserCache(a_max_size=8, a_ttl_seconds=60)
+        l_other: UserCache = UserCache(a_max_size=8, a_ttl_seconds=60)
+        await l_cache.get(1, CountingLoader(make_user(1)))
+        await l_other.get(2, CountingLoader(make_user(2)))
+        l_loader: CountingBatchLoader = CountingBatchLoader(
+            [make_user(l_id) for l_id in range(1, 6)]
+        )
+
+        l_single = l_cache.get(5, CountingLoader(make_user(5)))
+        l_batch = l_cache.get_many([4, 1, 2, 3, 4, 5, 9], l_loader)
+        _, l_users = await gather(l_single, l_batch)
+
+        assert l_users == {l_id: make_user(l_id) for l_id in range(1, 6)}
+        assert l_loader.calls == [[4, 3, 9]]
+        assert {
+            l_key: l_cache.stats()[l_key]
+            for l_key in ("l1_hits", "l2_hits", "coalesced", "misses")
+        } == {"l1_hits": 1, "l2_hits": 1, "coalesced": 1, "misses": 5}
+
+        # Every user found is now cached in both tiers
+        assert await l_cache.get_many([1, 2, 3, 4, 5], l_loader) == l_users
+        assert await l_other.get_many([3, 4], l_loader) == {
+            3: make_user(3),
+            4: make_user(4),
+        }
+        assert len(l_loader.calls) == 1
+    finally:
+        set_redis(None)
+
+
+async def test_get_many_skips_caching_after_invalidation() -> None:
+    """Demonstrate that a batch read while a user is invalidated is returned but not
+    cached"""
+    set_redis(FakeRedis(decode_responses=True))
+    try:
+        l_cache: UserCache = UserCache(a_max_size=8, a_ttl_seconds=60)
+        l_stale: CountingBatchLoader = CountingBatchLoader([make_user(1, "stale")])
+        await gather(l_cache.get_many([1], l_stale), l_cache.invalidate(1))
+
+        l_fresh: CountingBatchLoader = CountingBatchLoader([make_user(1, "fresh")])
+        assert (await l_cache.get_many([1], l_fresh))[1].username == "fresh"
+        assert len(l_fresh.calls) == 1
+    finally:
+        set_redis(None)
+
+
+async def test_invalidation_outlasts_loads_in_progress() -> None:
+    """Demonstrate that a worker which read a user before another worker invalidated
+    them, and hasn't heard the announcement, can't put its outdated copy in Redis"""
+    set_redis(FakeRedis(decode_responses=True))
+    try:
+        l_worker_a: UserCache = UserCache(a_max_size=8, a_ttl_seconds=60)
+        l_worker_b: UserCache = UserCache(a_max_size=8, a_ttl_seconds=60)
+        l_worker_c: UserCache = UserCache(a_max_size=8, a_ttl_seconds=60)
+
+        # Worker B writes while worker A is part way through reading the old record
+        l_load = l_worker_a.get(1, CountingLoader(make_user(1, "stale")))
+        l_batch = l_worker_a.get_many([2], CountingBatchLoader([make_user(2, "stale")]))
+        l_invalidate = gather(l_worker_b.invalidate(1), l_worker_b.invalidate(2))
+        await gather(l_load, l_batch, l_invalidate)
+
+        l_fresh: CountingLoader = CountingLoader(make_user(1, "fresh"))
+        assert (await l_worker_c.get(1, l_fresh)).username == "fresh"
+        assert len(l_fresh.calls) == 1
+        l_batch_fresh: CountingBatchLoader = CountingBatchLoader(
+            [make_user(2, "fresh")]
+        )
+        assert (await l_worker_c.get_many([2], l_batch_fresh))[2].username == "fresh"
+        assert l_batch_fresh.calls == [[2]]
+
+        # Reads outlasting half a tombstone's lifetime aren't put in Redis, as a
+        # tombstone written since they began may have expired
+        l_slow: UserCache = UserCache(
+            a_max_size=8, a_ttl_seconds=60, a_tombstone_seconds=0.05
+        )
+        await l_slow.get(3, CountingLoader(make_user(3)))
+        await l_slow.get_many([4], CountingBatchLoader([make_user(4)]))
+        l_other: CountingBatchLoader = CountingBatchLoader(
+            [make_user(3, "other"), make_user(4, "other")]
+        )
+        assert await l_worker_c.get_many([3, 4], l_other) == {
+            3: make_user(3, "other"),
+            4: make_user(4, "other"),
+        }
+    finally:
+        set_redis(None)
@@ -0,0 +1,104 @@
+"""
+Tests for per-request SQL instrumentation
+"""
+from typing import AsyncIterator
+from typing import Dict
+
+import pytest
+from _pytest.logging import LogCaptureFixture
+from asyncpg import PostgresError
+from demo.core.config import core_config
+from demo.database import async_database_url
+from demo.database import fetch_one
+from demo.database.instrumentation import QueryInstrumentation
+from demo.database.instrumentation import QueryInstrumentationMiddleware
+from demo.database.repository.users import SELECT_USER_BY_EMAIL
+from demo.database.repository.users import SELECT_USER_BY_ID
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from requests import Response
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+
+@pytest.fixture
+async def instrumented_db() -> AsyncIterator[AsyncEngine]:
+    """
+    An unpooled engine for the test database. Tests are skipped if it's unavailable.
+    """
+    l_db: AsyncEngine = create_async_engine(
+        async_database_url(core_config.DATABASE_URI), poolclass=NullPool
+    )
+    try:
+        async with l_db.connect():
+            pass
+    except (OSError, PostgresError, DBAPIError) as e:
+        pytest.skip(f"The test database is unavailable: {e}")
+    yield l_db
+    await l_db.dispose()
+
+
+async def test_statements_recorded_and_slow_ones_logged(
+    instrumented_db: AsyncEngine, caplog: LogCaptureFixture
+) -> None:
+    """Demonstrate that statements are counted only within record() and that slow
+    statements are logged without their parameter values"""
+    l_instrumentation = QueryInstrumentation(a_slow_query_ms=0)
+    l_instrumentation.instrument(instrumented_db)
+    l_instrumentation.instrument(instrumented_db)
+    try:
+        with l_instrumentation.record() as l_stats:
+            for _ in range(3):
+                await fetch_one(instrumented_db, SELECT_USER_BY_ID, {"id": 987654})
+            await fetch_one(
+                instrumented_db, SELECT_USER_BY_EMAIL, {"email": "secret@example.com"}
+            )
+        await fetch_one(instrumented_db, SELECT_USER_BY_ID, {"id": 987654})
+
+        assert l_stats.count == 4
+        assert l_stats.most_repeated()[1] == 3
+        assert 0 < l_stats.slowest_seconds <= l_stats.seconds
+        assert "slow query" in caplog.text
+        assert "1 parameters" in caplog.text
+        assert "987654" not in caplog.text
+        assert "secret@example.com" not in caplog.text
+    finally:
+        l_instrumentation.uninstrument(instrumented_db)
+
+    caplog.clear()
+    await fetch_one(instrumented_db, SELECT_USER_BY_ID, {"id": 987654})
+    assert "slow query" not in caplog.text
+
+
+def test_middleware_flags_repeated_statements(
+    instrumented_db: AsyncEngine, caplog: LogCaptureFixture
+) -> None:
+    """Demonstrate that the middleware reports a request's statements in a
+    Server-Timing header and warns when one statement is repeated"""
+    l_instrumentation = QueryInstrumentation(
+        a_slow_query_ms=60000, a_repeated_query_threshold=3
+    )
+    l_instrumentation.instrument(instrumented_db)
+    l_app = FastAPI()
+    l_app.add_middleware(
+        QueryInstrumentationMiddleware, a_instrumentation=l_instrumentation
+    )
+
+    @l_app.get("/users")
+    async def one_query_per_user() -> Dict[str, int]:
+        for l_id in range(3):
+            await fetch_one(instrumented_db, SELECT_USER_BY_ID, {"id": l_id})
+        return {"users": 3}
+
+    try:
+        with TestClient(l_app) as l_client:
+            response: Response = l_client.get("/users")
+    finally:
+        l_instrumentation.uninstrument(instrumented_db)
+
+    assert response.json() == {"users": 3}
+    assert 'desc="3 queries"' in response.headers["server-timing"]
+    assert "possible N+1 queries: GET /users ran the same statement 3" in caplog.text
+    assert "slow query" not in caplog.text
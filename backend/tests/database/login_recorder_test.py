@@ -0,0 +1,131 @@
+"""
+Tests for the write-behind login recorder
+"""
+from asyncio import sleep
+from typing import Any
+from typing import Dict
+
+from demo.database import fetch_one
+from demo.database.login_recorder import LoginRecorder
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+SELECT_BOOKKEEPING = text(
+    "SELECT last_login, login_count, "
+    "(SELECT count(*) FROM login_events WHERE user_id = users.id) AS events, "
+    "(SELECT count(*) FROM login_events WHERE user_id = users.id "
+    "AND ip_address = '203.0.113.7') AS from_ip "
+    "FROM users WHERE id = :id"
+)
+
+
+async def bookkeeping(a_db: AsyncEngine) -> Dict[str, Any]:
+    """
+    The default account's login bookkeeping
+    """
+    return dict(await fetch_one(a_db, SELECT_BOOKKEEPING, {"id": 1}))
+
+
+async def record_coalesced_logins(a_db: AsyncEngine) -> None:
+    """
+    Record three logins by the default account and stop the recorder
+    """
+    l_recorder = LoginRecorder(a_flush_seconds=3600)
+    l_before: Dict[str, Any] = await bookkeeping(a_db)
+    l_recorder.start(a_db)
+    for _ in range(3):
+        l_recorder.record(1, "203.0.113.7")
+    assert l_recorder.pending == 3
+    # Nothing is written until a flush
+    assert await bookkeeping(a_db) == l_before
+
+    # Stopping writes what's left
+    await l_recorder.stop()
+    l_after: Dict[str, Any] = await bookkeeping(a_db)
+    assert l_after["login_count"] == l_before["login_count"] + 3
+    assert l_after["events"] == l_before["events"] + 3
+    assert l_after["from_ip"] == l_before["from_ip"] + 3
+    assert (
+        l_before["last_login"] is None or l_after["last_login"] > l_before["last_login"]
+    )
+    assert (l_recorder.recorded, l_recorder.written, l_recorder.dropped) == (3, 3, 0)
+    assert l_recorder.pending == 0
+
+
+def test_logins_coalesced_and_written_on_stop(
+    client: TestClient, db: AsyncEngine
+) -> None:
+    """Demonstrate that buffered logins aren't written until a flush, which stop()
+    performs, and that a user's logins are coalesced into one update
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
+    """
+    client.portal.call(record_coalesced_logins, db)
+
+
+async def record_batches(a_db: AsyncEngine) -> None:
+    """
+    Record logins one at a time with a batch size of two
+    """
+    l_recorder = LoginRecorder(a_flush_seconds=3600, a_batch_size=2)
+    l_recorder.start(a_db)
+    try:
+        l_recorder.record(1)
+        await sleep(0.2)
+        assert l_recorder.written == 0
+        # A full batch wakes the background task without waiting for the timer
+        l_recorder.record(1)
+        for _ in range(50):
+            if l_recorder.written:
+                break
+            await sleep(0.1)
+        assert l_recorder.written == 2
+    finally:
+        await l_recorder.stop()
+
+
+def test_full_batch_written_early(client: TestClient, db: AsyncEngine) -> None:
+    """Demonstrate that batch_size waiting logins are written before flush_seconds
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
+    """
+    client.portal.call(record_batches, db)
+
+
+async def record_while_behind(a_db: AsyncEngine) -> None:
+    """
+    Record more logins than may be pending, then a batch which can't be written
+    """
+    l_recorder = LoginRecorder(a_flush_seconds=3600, a_max_pending=2)
+    l_recorder.start(a_db)
+    try:
+        for _ in range(5):
+            l_recorder.record(1)
+        assert (l_recorder.recorded, l_recorder.dropped) == (2, 3)
+        assert l_recorder.pending == 2
+        await l_recorder.flush()
+        assert l_recorder.written == 2
+
+        # A batch which can't be written, here for a user who doesn't exist, is
+        # dropped rather than retried
+        l_recorder.record(987654)
+        await l_recorder.flush()
+        assert (l_recorder.written, l_recorder.dropped, l_recorder.pending) == (2, 4, 0)
+    finally:
+        await l_recorder.stop()
+
+
+def test_logins_dropped_when_behind(client: TestClient, db: AsyncEngine) -> None:
+    """Demonstrate that memory stays bounded by dropping and counting logins beyond
+    max_pending and batches which fail to write
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
+    """
+    client.portal.call(record_while_behind, db)
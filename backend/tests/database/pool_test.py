@@ -0,0 +1,31 @@
+"""
+Tests for the connection pool budget
+"""
+from demo.database import engine
+from demo.database import pool_budget
+
+
+def test_pool_budget_stays_under_max_connections() -> None:
+    """Demonstrate that every worker's pool together never exceeds the budget"""
+    for l_workers in (1, 2, 3, 7, 16):
+        l_pool_size, l_max_overflow = pool_budget(60, l_workers)
+        assert l_pool_size >= 1
+        assert l_max_overflow >= 0
+        assert (l_pool_size + l_max_overflow) * l_workers <= 60
+
+
+def test_pool_budget_leaves_each_worker_a_connection() -> None:
+    """Demonstrate that more workers than connections still leaves a usable pool"""
+    assert pool_budget(4, 8) == (1, 0)
+
+
+def test_engine_uses_asyncpg() -> None:
+    """Demonstrate that the shared engine uses the asyncpg driver"""
+    assert engine.url.drivername == "postgresql+asyncpg"
+
+
+def test_pool_budget_keeps_pooler_connections_open() -> None:
+    """Demonstrate that behind a transaction pooler each worker's whole share is kept
+    open rather than left to overflow"""
+    assert pool_budget(60, 7, a_transaction_pooler=True) == (8, 0)
+    assert pool_budget(4, 8, a_transaction_pooler=True) == (1, 0)
@@ -0,0 +1,348 @@
+"""
+Tests for running behind a transaction pooler such as PgBouncer. A small proxy stands in
+for the pooler: like PgBouncer in transaction mode it hands clients a server connection
+for one transaction at a time, taking them round robin from a fixed set.
+"""
+from asyncio import create_task
+from asyncio import gather
+from asyncio import IncompleteReadError
+from asyncio import open_connection
+from asyncio import Queue
+from asyncio import start_server
+from asyncio import StreamReader
+from asyncio import StreamWriter
+from asyncio import Task
+from base64 import b64decode
+from base64 import b64encode
+from hashlib import md5
+from hashlib import pbkdf2_hmac
+from hashlib import sha256
+from hmac import digest
+from secrets import token_urlsafe
+from struct import pack
+from struct import unpack
+from typing import Any
+from typing import AsyncIterator
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import asyncpg.connection
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+from demo.core.config import core_config
+from demo.database import async_database_url
+from demo.database import connect_args
+from demo.database import fetch_one
+from demo.database.repository.users import SELECT_USER_BY_ID
+from sqlalchemy import text
+from sqlalchemy.engine import URL
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import create_async_engine
+
+# Codes sent in place of a protocol version to negotiate encryption or cancel a query
+SSL_REQUEST: int = 80877103
+GSSENC_REQUEST: int = 80877104
+CANCEL_REQUEST: int = 80877102
+PROTOCOL_VERSION: int = 196608
+
+Message = Tuple[bytes, bytes]
+Server = Tuple[StreamReader, StreamWriter]
+
+
+def message(a_type: bytes, a_body: bytes = b"") -> bytes:
+    """
+    :param a_type: The message type byte
+    :param a_body: The message contents
+    :return: The message as sent on the wire
+    """
+    return a_type + pack("!i", len(a_body) + 4) + a_body
+
+
+async def read_message(a_reader: StreamReader) -> Message:
+    """
+    :param a_reader: A client or server connection
+    :return: The type byte and contents of the next message
+    """
+    l_type: bytes = await a_reader.readexactly(1)
+    l_length: int = unpack("!i", await a_reader.readexactly(4))[0]
+    return l_type, await a_reader.readexactly(l_length - 4)
+
+
+class TransactionPooler:
+    """
+    Shares a few server connections between any number of clients, one transaction at
+    a time. Clients aren't asked for a password; server connections log in as
+    POSTGRES_USER.
+    """
+
+    def __init__(self, a_server_count: int):
+        self.server_count: int = a_server_count
+        # Idle server connections, handed out in the order they became idle
+        self._idle: Queue = Queue()
+        # ParameterStatus messages sent to each client as it connects
+        self._parameters: bytes = b""
+        self._server: Any = None
+
+    async def _authenticate(
+        self, a_reader: StreamReader, a_writer: StreamWriter
+    ) -> None:
+        """
+        Answer a server's password, MD5 or SCRAM-SHA-256 authentication request
+        :return: Nothing
+        """
+        l_user: str = core_config.POSTGRES_USER
+        l_password: bytes = core_config.POSTGRES_PASSWORD.get_secret_value().encode()
+        l_client_first: str = f"n=,r={token_urlsafe(18)}"
+        l_auth_message: str = ""
+        l_salted: bytes = b""
+        while True:
+            l_type, l_body = await read_message(a_reader)
+            if l_type == b"E":
+                raise ConnectionError(l_body.decode(errors="replace"))
+            l_code: int = unpack("!i", l_body[:4])[0]
+            if l_code == 0:
+                return
+            if l_code == 3:
+                a_writer.write(message(b"p", l_password + b"\0"))
+            elif l_code == 5:
+                l_inner: str = md5(l_password + l_user.encode()).hexdigest()
+                l_hash: str = md5(l_inner.encode() + l_body[4:8]).hexdigest()
+                a_writer.write(message(b"p", f"md5{l_hash}".encode() + b"\0"))
+            elif l_code == 10:
+                l_first: bytes = f"n,,{l_client_first}".encode()
+                a_writer.write(
+                    message(
+                        b"p",
+                        b"SCRAM-SHA-256\0" + pack("!i", len(l_first)) + l_first,
+                    )
+                )
+            elif l_code == 11:
+                l_server_first: str = l_body[4:].decode()
+                l_fields: Dict[str, str] = dict(
+                    l_field.split("=", 1) for l_field in l_server_first.split(",")
+                )
+                l_salted = pbkdf2_hmac(
+                    "sha256", l_password, b64decode(l_fields["s"]), int(l_fields["i"])
+                )
+                l_final: str = f"c=biws,r={l_fields['r']}"
+                l_auth_message = f"{l_client_first},{l_server_first},{l_final}"
+                l_client_key: bytes = digest(l_salted, b"Client Key", "sha256")
+                l_signature: bytes = digest(
+                    sha256(l_client_key).digest(), l_auth_message.encode(), "sha256"
+                )
+                l_proof: bytes = bytes(a ^ b for a, b in zip(l_client_key, l_signature))
+                a_writer.write(
+                    message(b"p", f"{l_final},p={b64encode(l_proof).decode()}".encode())
+                )
+            elif l_code != 12:
+                raise ConnectionError(f"Unsupported authentication request {l_code}")
+            await a_writer.drain()
+
+    async def _connect(self) -> Server:
+        """
+        :return: A new server connection, ready for queries
+        """
+        l_reader, l_writer = await open_connection(
+            core_config.POSTGRES_SERVER, int(core_config.POSTGRES_PORT)
+        )
+        l_parameters: bytes = b"".join(
+            f"{l_key}\0{l_value}\0".encode()
+            for l_key, l_value in (
+                ("user", core_config.POSTGRES_USER),
+                ("database", core_config.POSTGRES_DB),
+            )
+        )
+        l_startup: bytes = pack("!i", PROTOCOL_VERSION) + l_parameters + b"\0"
+        l_writer.write(pack("!i", len(l_startup) + 4) + l_startup)
+        await l_writer.drain()
+        await self._authenticate(l_reader, l_writer)
+        l_statuses: List[bytes] = []
+        while True:
+            l_type, l_body = await read_message(l_reader)
+            if l_type == b"S":
+                l_statuses.append(message(l_type, l_body))
+            elif l_type == b"Z":
+                break
+        self._parameters = b"".join(l_statuses)
+        return l_reader, l_writer
+
+    async def start(self) -> int:
+        """
+        Open the server connections and begin accepting clients
+        :return: The port clients connect to
+        """
+        for _ in range(self.server_count):
+            self._idle.put_nowait(await self._connect())
+        self._server = await start_server(self._serve, "127.0.0.1", 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        """
+        Stop accepting clients and close the idle server connections
+        :return: Nothing
+        """
+        self._server.close()
+        await self._server.wait_closed()
+        while not self._idle.empty():
+            _, l_writer = self._idle.get_nowait()
+            l_writer.write(message(b"X"))
+            l_writer.close()
+
+    async def _handshake(self, a_reader: StreamReader, a_writer: StreamWriter) -> bool:
+        """
+        Accept a client's startup message without asking for a password
+        :return: False if the client only wanted to cancel a query
+        """
+        while True:
+            l_length: int = unpack("!i", await a_reader.readexactly(4))[0]
+            l_body: bytes = await a_reader.readexactly(l_length - 4)
+            l_code: int = unpack("!i", l_body[:4])[0]
+            if l_code in (SSL_REQUEST, GSSENC_REQUEST):
+                a_writer.write(b"N")
+                await a_writer.drain()
+            elif l_code == CANCEL_REQUEST:
+                return False
+            else:
+                break
+        a_writer.write(
+            message(b"R", pack("!i", 0))
+            + self._parameters
+            + message(b"K", pack("!ii", 0, 0))
+            + message(b"Z", b"I")
+        )
+        await a_writer.drain()
+        return True
+
+    async def _serve(self, a_reader: StreamReader, a_writer: StreamWriter) -> None:
+        """
+        Relay one client's messages, taking a server connection when a transaction
+        begins and returning it once the server is idle and every Sync or Query the
+        client sent has been answered
+        :return: Nothing
+        """
+        l_server: Optional[Server] = None
+        l_relay: Optional[Task] = None
+        l_pending: List[int] = [0]
+
+        async def relay(a_server: Server) -> None:
+            nonlocal l_server
+            while True:
+                l_type, l_body = await read_message(a_server[0])
+                if l_type == b"Z":
+                    l_pending[0] -= 1
+                    if l_pending[0] == 0 and l_body == b"I":
+                        # Released before the client can send anything else
+                        l_server = None
+                        self._idle.put_nowait(a_server)
+                        a_writer.write(message(l_type, l_body))
+                        return
+                a_writer.write(message(l_type, l_body))
+
+        try:
+            if not await self._handshake(a_reader, a_writer):
+                return
+            while True:
+                l_type, l_body = await read_message(a_reader)
+                if l_type == b"X":
+                    break
+                if l_server is None:
+                    l_server = await self._idle.get()
+                    l_relay = create_task(relay(l_server))
+                if l_type in (b"S", b"Q"):
+                    l_pending[0] += 1
+                l_server[1].write(message(l_type, l_body))
+        except (IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if l_server is not None:
+                # The client left mid-transaction. Replace its server connection.
+                l_relay.cancel()
+                l_server[1].close()
+                self._idle.put_nowait(await self._connect())
+            a_writer.close()
+
+
+@pytest.fixture
+async def pooler_url(request: Any) -> AsyncIterator[URL]:
+    """
+    The test database's URL through a stand-in pooler with request.param server
+    connections. Tests are skipped if the test database is unavailable.
+    """
+    l_pooler = TransactionPooler(request.param)
+    try:
+        l_port: int = await l_pooler.start()
+    except (OSError, ConnectionError) as e:
+        pytest.skip(f"The test database is unavailable: {e}")
+    yield async_database_url(core_config.DATABASE_URI).set(
+        host="127.0.0.1", port=l_port
+    )
+    await l_pooler.stop()
+
+
+async def run_workers(
+    a_url: URL, a_connect_args: Dict[str, Any], a_monkeypatch: MonkeyPatch
+) -> None:
+    """
+    Run the same queries from two engines standing in for workers in separate
+    processes, whose asyncpg connections number statements from the same counter
+    """
+    l_uid: int = asyncpg.connection._uid
+    for _ in range(2):
+        a_monkeypatch.setattr(asyncpg.connection, "_uid", l_uid)
+        l_worker: AsyncEngine = create_async_engine(
+            a_url, pool_size=1, max_overflow=0, connect_args=a_connect_args
+        )
+        try:
+            for _ in range(3):
+                assert await fetch_one(l_worker, SELECT_USER_BY_ID, {"id": 0}) is None
+        finally:
+            await l_worker.dispose()
+
+
+@pytest.mark.parametrize("pooler_url", [2], indirect=True)
+async def test_stand_in_breaks_cached_statements(
+    pooler_url: URL, monkeypatch: MonkeyPatch
+) -> None:
+    """Demonstrate that the stand-in pooler fails like PgBouncer when a statement
+    prepared in one transaction is reused in the next"""
+    with pytest.raises(DBAPIError, match="prepared statement"):
+        await run_workers(pooler_url, {}, monkeypatch)
+
+
+@pytest.mark.parametrize("pooler_url", [1, 2], indirect=True)
+async def test_pooler_settings_survive_transaction_pooling(
+    pooler_url: URL, monkeypatch: MonkeyPatch
+) -> None:
+    """Demonstrate that engines using connect_args(True) work through the stand-in,
+    including concurrent and transaction scoped queries"""
+    await run_workers(pooler_url, connect_args(True), monkeypatch)
+
+    l_engines: List[AsyncEngine] = [
+        create_async_engine(pooler_url, pool_size=4, connect_args=connect_args(True))
+        for _ in range(2)
+    ]
+    try:
+        l_rows = await gather(
+            *(
+                fetch_one(l_engine, SELECT_USER_BY_ID, {"id": l_id})
+                for l_id in range(-20, 0)
+                for l_engine in l_engines
+            )
+        )
+        assert l_rows == [None] * 40
+
+        async with l_engines[0].connect() as l_connection:
+            l_connection = await l_connection.execution_options(
+                isolation_level="REPEATABLE READ"
+            )
+            async with l_connection.begin():
+                await l_connection.execute(text("SET TRANSACTION READ ONLY"))
+                assert (
+                    await l_connection.scalar(text("SHOW transaction_isolation"))
+                ) == "repeatable read"
+    finally:
+        for l_engine in l_engines:
+            await l_engine.dispose()
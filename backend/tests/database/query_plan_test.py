@@ -0,0 +1,196 @@
+"""
+Query plan regression tests for the users repository.
+
+The users table is seeded with enough rows that a sequential scan is the planner's
+last resort, then every repository query is run through EXPLAIN. Seeding happens in a
+transaction which is rolled back, so other tests never see the rows.
+"""
+from datetime import datetime
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+import pytest
+from demo.database.repository.users import list_users_query
+from demo.database.repository.users import RECORD_LOGINS
+from demo.database.repository.users import SELECT_USER_BY_EMAIL
+from demo.database.repository.users import SELECT_USER_BY_ID
+from demo.database.repository.users import SEARCH_USERS
+from demo.database.repository.users import SELECT_USER_BY_USERNAME
+from demo.database.repository.users import SELECT_USERS_BY_EMAILS
+from demo.database.repository.users import SELECT_USERS_BY_IDS
+from demo.database.repository.users import UPDATE_USER
+from demo.database.repository.users import UPDATE_USER_IF_VERSION
+from demo.database.repository.users import UPDATE_USER_PASSWORD
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.base import Executable
+from sqlalchemy.sql.elements import ClauseElement
+
+seed_rows: int = 100_000
+
+# 1 in 10 seeded users is inactive, 1 in 1000 is an administrator, and e-mails are
+# spread over 50 domains
+SEED_USERS = text(
+    """
+    INSERT INTO users
+        (email, username, password, is_active, is_superuser, time_created)
+    SELECT 'plan' || i || '@' || (i % 50) || '.example.com', 'plan' || i, 'x',
+        i % 10 <> 0, i % 1000 = 0, timestamp '2020-01-01' + i * interval '1 second'
+    FROM generate_series(1, :rows) AS i
+    """
+)
+# GIN indexes queue new entries in a pending list, which the planner costs as if it
+# were scanned in full. Autovacuum would normally have merged them into the index.
+MERGE_PENDING_ENTRIES = text(
+    "SELECT gin_clean_pending_list('ix_users_email_trgm'), "
+    "gin_clean_pending_list('ix_users_username_trgm')"
+)
+
+# Name, statement, and parameters of every query the repository runs by key. The bulk
+# import and export are excluded as they read their whole input by design.
+plan_cases: List[Tuple[str, Any, Dict[str, Any]]] = [
+    ("user_by_id", SELECT_USER_BY_ID, {"id": 5000}),
+    ("user_by_email", SELECT_USER_BY_EMAIL, {"email": "plan5000@0.example.com"}),
+    ("user_by_username", SELECT_USER_BY_USERNAME, {"username": "plan5000"}),
+    ("users_by_ids", SELECT_USERS_BY_IDS, {"ids": list(range(5000, 5500))}),
+    (
+        "users_by_emails",
+        SELECT_USERS_BY_EMAILS,
+        {"emails": [f"plan{i}@{i % 50}.example.com" for i in range(5000, 5500)]},
+    ),
+    (
+        "update_user",
+        UPDATE_USER,
+        {"id": 5000, "email": "a@example.com", "username": "a", "password": "x"},
+    ),
+    (
+        "update_user_if_version",
+        UPDATE_USER_IF_VERSION,
+        {
+            "id": 5000,
+            "email": "a@example.com",
+            "username": "a",
+            "password": "x",
+            "version": 1,
+        },
+    ),
+    (
+        "update_user_password",
+        UPDATE_USER_PASSWORD,
+        {"id": 5000, "password": "x", "old_hash": "y"},
+    ),
+    (
+        "record_logins",
+        RECORD_LOGINS,
+        {
+            "ids": [5000, 6000],
+            "last_logins": [datetime(2024, 1, 1), datetime(2024, 1, 2)],
+            "counts": [1, 2],
+        },
+    ),
+    ("list_first_page", list_users_query(500), {}),
+    (
+        "list_after_cursor",
+        list_users_query(500, (datetime(2020, 1, 1, 12), 43200)),
+        {},
+    ),
+    ("list_active", list_users_query(500, a_is_active=True), {}),
+    ("list_inactive", list_users_query(500, a_is_active=False), {}),
+    ("list_superusers", list_users_query(500, a_is_superuser=True), {}),
+    ("list_email_domain", list_users_query(500, a_email_domain="7.example.com"), {}),
+    ("list_sparse_fields", list_users_query(500, a_fields=frozenset({"email"})), {}),
+    (
+        "search_users",
+        SEARCH_USERS,
+        {
+            "term": "plan5000",
+            "pattern": "%plan5000%",
+            "candidates": 1000,
+            "limit": 50,
+        },
+    ),
+]
+
+
+class Explain(Executable, ClauseElement):
+    """
+    EXPLAIN (FORMAT JSON) of another statement, keeping its bind parameters
+    """
+
+    inherit_cache = False
+
+    def __init__(self, a_statement: Any):
+        self.statement: Any = a_statement
+
+
+@compiles(Explain)
+def compile_explain(a_element: Explain, a_compiler: Any, **kw: Any) -> str:
+    return f"EXPLAIN (FORMAT JSON) {a_compiler.process(a_element.statement, **kw)}"
+
+
+def plan_nodes(a_node: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Walk a JSON query plan depth first
+    """
+    yield a_node
+    for l_child in a_node.get("Plans", []):
+        yield from plan_nodes(l_child)
+
+
+async def explain_cases(a_db: AsyncEngine) -> Dict[str, Dict[str, Any]]:
+    """
+    Seed the users table, analyze it, and explain every plan case, all in one
+    transaction which is then rolled back
+    """
+    l_plans: Dict[str, Dict[str, Any]] = {}
+    async with a_db.connect() as l_connection:
+        l_transaction = await l_connection.begin()
+        try:
+            await l_connection.execute(SEED_USERS, {"rows": seed_rows})
+            await l_connection.execute(MERGE_PENDING_ENTRIES)
+            await l_connection.execute(text("ANALYZE users"))
+            for l_name, l_statement, l_params in plan_cases:
+                l_result = await l_connection.execute(Explain(l_statement), l_params)
+                l_plans[l_name] = l_result.scalar()[0]["Plan"]
+        finally:
+            await l_transaction.rollback()
+    return l_plans
+
+
+@pytest.fixture(scope="module")
+def query_plans(client: TestClient, db: AsyncEngine) -> Dict[str, Dict[str, Any]]:
+    """
+    The plan of each case in plan_cases by name
+    """
+    return client.portal.call(explain_cases, db)
+
+
+@pytest.mark.parametrize("a_name", [l_case[0] for l_case in plan_cases])
+def test_query_uses_an_index(
+    a_name: str, query_plans: Dict[str, Dict[str, Any]]
+) -> None:
+    """Demonstrate that a repository query reads users through an index rather than
+    scanning the whole table
+
+    Args:
+        a_name (str): The plan case to check
+        query_plans (Dict[str, Dict[str, Any]]): A pytest fixture of EXPLAIN output
+    """
+    l_scans: List[Dict[str, Any]] = [
+        l_node
+        for l_node in plan_nodes(query_plans[a_name])
+        if l_node.get("Relation Name") == "users"
+        or l_node["Node Type"] == "Bitmap Index Scan"
+    ]
+
+    assert l_scans, f"{a_name} doesn't read users"
+    assert all(l_node["Node Type"] != "Seq Scan" for l_node in l_scans), (
+        f"{a_name} scans the whole users table: "
+        f"{[l_node['Node Type'] for l_node in l_scans]}"
+    )
+    assert any("Index Name" in l_node for l_node in l_scans)
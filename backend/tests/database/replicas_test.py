@@ -0,0 +1,234 @@
+"""
+Tests for read replica routing. Two extra local databases stand in for replicas; each
+holds a different user so tests can tell which one served a read.
+"""
+from asyncio import run
+from asyncio import sleep
+from datetime import datetime
+from typing import Any
+from typing import Dict
+from typing import List
+
+import pytest
+from asyncpg import PostgresError
+from demo.api.v1.route_login import get_current_user_from_token
+from demo.api.v1.route_users import get_users_batch_route
+from demo.core.cache import user_cache
+from demo.core.config import core_config
+from demo.core.config import ReplicaSelection
+from demo.core.principal import Principal
+from demo.core.redis_client import get_redis
+from demo.core.redis_client import set_redis
+from demo.core.security import create_access_token
+from demo.database import Base
+from demo.database import engine
+from demo.database import execute
+from demo.database.replicas import ReplicaRouter
+from demo.database.repository.users import get_user_by_id_db
+from demo.database.repository.users import INSERT_USER
+from demo.schemas.users import UserBatchRequestSchema
+from fakeredis.aioredis import FakeRedis
+from fastapi.testclient import TestClient
+from pytest import MonkeyPatch
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from ujson import loads
+
+stand_in_count: int = 2
+
+
+async def create_stand_ins() -> List[str]:
+    """
+    Create the stand-in replica databases if necessary, each with a users table
+    holding one user named after the database
+    """
+    l_uris: List[str] = []
+    # Connect to the maintenance database as the stand-ins may not exist yet
+    l_server: AsyncEngine = create_async_engine(
+        f"{core_config.DATABASE_URI_GENERIC}/postgres".replace(
+            "postgresql://", "postgresql+asyncpg://", 1
+        ),
+        poolclass=NullPool,
+        isolation_level="AUTOCOMMIT",
+    )
+    try:
+        for i in range(stand_in_count):
+            l_name: str = f"{core_config.POSTGRES_DB}_replica_{i}"
+            async with l_server.connect() as l_connection:
+                l_exists = await l_connection.scalar(
+                    text("SELECT 1 FROM pg_database WHERE datname = :name"),
+                    {"name": l_name},
+                )
+                if not l_exists:
+                    await l_connection.execute(text(f'CREATE DATABASE "{l_name}"'))
+            l_uri: str = f"{core_config.DATABASE_URI_GENERIC}/{l_name}"
+            l_replica: AsyncEngine = create_async_engine(
+                l_uri.replace("postgresql://", "postgresql+asyncpg://", 1),
+                poolclass=NullPool,
+            )
+            try:
+                async with l_replica.begin() as l_connection:
+                    await l_connection.run_sync(Base.metadata.drop_all)
+                    await l_connection.run_sync(Base.metadata.create_all)
+                await execute(
+                    l_replica,
+                    INSERT_USER,
+                    {
+                        "email": f"{l_name}@example.com",
+                        "username": l_name,
+                        "password": "x",
+                        "is_active": True,
+                        "is_superuser": False,
+                        "time_created": datetime.now(),
+                    },
+                )
+            finally:
+                await l_replica.dispose()
+            l_uris.append(l_uri)
+    finally:
+        await l_server.dispose()
+    return l_uris
+
+
+@pytest.fixture(scope="module")
+def replica_uris() -> List[str]:
+    """
+    URIs of the stand-in replicas. Tests are skipped if Postgres is unavailable.
+    """
+    try:
+        return run(create_stand_ins())
+    except (OSError, PostgresError, DBAPIError) as e:
+        pytest.skip(f"The stand-in replicas are unavailable: {e}")
+
+
+async def test_reads_spread_over_replicas(replica_uris: List[str]) -> None:
+    """Demonstrate that reads alternate between replicas round robin, and that the
+    replica with the fewest connections in use is chosen otherwise"""
+    l_router: ReplicaRouter = ReplicaRouter(replica_uris)
+    try:
+        # Replicas aren't used until their lag is known
+        assert l_router.reader(engine) is engine
+        await l_router.measure_lag()
+        assert l_router.lag == [0.0, 0.0]
+
+        l_usernames: List[str] = [
+            (await get_user_by_id_db(1, l_router.reader(engine))).username
+            for _ in range(4)
+        ]
+        assert l_usernames == [
+            f"{core_config.POSTGRES_DB}_replica_{i}" for i in (0, 1, 0, 1)
+        ]
+
+        l_router.selection = ReplicaSelection.least_connections
+        async with l_router.replicas[0].connect():
+            assert l_router.reader(engine) is l_router.replicas[1]
+        async with l_router.replicas[1].connect():
+            assert l_router.reader(engine) is l_router.replicas[0]
+    finally:
+        await l_router.stop()
+
+
+async def test_lagging_replicas_fall_back_to_primary(replica_uris: List[str]) -> None:
+    """Demonstrate that replicas which lag or can't be reached aren't read from"""
+    l_router: ReplicaRouter = ReplicaRouter(
+        replica_uris + [replica_uris[0].replace(str(core_config.POSTGRES_PORT), "1")],
+        a_max_lag_seconds=5,
+    )
+    try:
+        await l_router.measure_lag()
+        assert l_router.lag[2] is None
+        assert l_router.available() == l_router.replicas[:2]
+
+        # Simulate replica 0 falling behind
+        l_router.lag[0] = 60.0
+        assert {l_router.reader(engine) for _ in range(4)} == {l_router.replicas[1]}
+        l_router.lag[1] = 60.0
+        assert l_router.reader(engine) is engine
+    finally:
+        await l_router.stop()
+
+
+async def test_writers_read_their_writes(replica_uris: List[str]) -> None:
+    """Demonstrate that a user who wrote reads from the primary in every worker until
+    the pin expires"""
+    set_redis(FakeRedis(decode_responses=True))
+    l_worker_a: ReplicaRouter = ReplicaRouter(replica_uris, a_pin_seconds=0.5)
+    l_worker_b: ReplicaRouter = ReplicaRouter(replica_uris, a_pin_seconds=0.5)
+    l_worker_b.start()
+    try:
+        await l_worker_a.measure_lag()
+        # Let worker B subscribe and measure its replicas
+        await sleep(0.2)
+        await l_worker_a.record_write(7)
+        await sleep(0.1)
+
+        for l_worker in (l_worker_a, l_worker_b):
+            assert l_worker.reader(engine, 7) is engine
+            assert l_worker.reader(engine, 8) is not engine
+            assert l_worker.reader(engine) is not engine
+        await sleep(0.5)
+        assert l_worker_a.reader(engine, 7) is not engine
+    finally:
+        await l_worker_a.stop()
+        await l_worker_b.stop()
+        set_redis(None)
+
+
+async def read_user_through_cache(a_db: AsyncEngine, a_router: ReplicaRouter) -> None:
+    """
+    Read the default account through the user cache, by token and by batch lookup,
+    while every replica holds an outdated user 1
+    """
+    await a_router.measure_lag()
+    assert a_router.reader(a_db) is not a_db
+    l_admin: Principal = Principal(
+        a_id=1, a_username="admin", a_email="a@example.com", a_is_superuser=True
+    )
+    try:
+        # As if the default account had just been updated and the update hadn't
+        # reached the replicas yet. Let this worker receive its own invalidation, which
+        # would stop a load in progress from being cached.
+        await user_cache.invalidate(1)
+        await sleep(0.1)
+        l_batch = await get_users_batch_route(
+            UserBatchRequestSchema(ids=[1]), l_admin, None, a_db
+        )
+        assert l_batch.ids[0].username == core_config.DEFAULT_USERNAME
+
+        await user_cache.invalidate(1)
+        await sleep(0.1)
+        # As if the tombstone the invalidation left had expired, so Redis is filled
+        await get_redis().delete(user_cache._key(1))
+        l_principal: Principal = await get_current_user_from_token(
+            create_access_token(data={"sub": "1"}), a_db
+        )
+        assert l_principal.username == core_config.DEFAULT_USERNAME
+        # What was cached for other workers came from the primary too
+        l_cached: Dict[str, Any] = loads(await get_redis().get(user_cache._key(1)))
+        assert l_cached["username"] == core_config.DEFAULT_USERNAME
+    finally:
+        await user_cache.invalidate(1)
+        await a_router.stop()
+
+
+def test_user_cache_ignores_stale_replicas(
+    client: TestClient,
+    db: AsyncEngine,
+    replica_uris: List[str],
+    monkeypatch: MonkeyPatch,
+) -> None:
+    """Demonstrate that user cache misses are read from the primary, so a lagging
+    replica can't cache an outdated record right after it was invalidated
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+        db (AsyncEngine): A pytest fixture for the application's database engine
+        replica_uris (List[str]): A pytest fixture for the stand-in replicas
+        monkeypatch (MonkeyPatch): A pytest fixture for replacing the replica router
+    """
+    l_router: ReplicaRouter = ReplicaRouter(replica_uris)
+    monkeypatch.setattr("demo.api.v1.route_users.replica_router", l_router)
+    client.portal.call(read_user_through_cache, db, l_router)
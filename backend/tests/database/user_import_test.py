@@ -0,0 +1,89 @@
+"""
+Tests for the bulk user import helpers
+"""
+from typing import AsyncIterator
+from typing import List
+from typing import Tuple
+
+import pytest
+from demo.database.repository.user_import import CSV_MAX_RECORD_LINES
+from demo.database.repository.user_import import ImportFormat
+from demo.database.repository.user_import import iter_lines
+from demo.database.repository.user_import import iter_records
+from demo.database.repository.user_import import parse_csv_header
+from demo.database.repository.user_import import parse_record
+
+
+async def test_iter_lines_splits_across_chunks() -> None:
+    """Demonstrate that lines and multi-byte characters split between chunks are
+    rejoined"""
+    l_body: bytes = "\ufeffname,émail\r\nzoë,z@example.com\nlast".encode()
+
+    async def chunks() -> AsyncIterator[bytes]:
+        for i in range(0, len(l_body), 3):
+            yield l_body[i : i + 3]
+
+    l_lines: List[str] = [l_line async for l_line in iter_lines(chunks())]
+
+    assert l_lines == ["name,émail", "zoë,z@example.com", "last"]
+
+
+def test_parse_csv_record() -> None:
+    """Demonstrate that quoted CSV values parse and empty cells are omitted"""
+    l_header: List[str] = parse_csv_header("Username, Email ,password,is_active")
+
+    assert parse_record('"a, b",a@example.com,"p""w",', ImportFormat.csv, l_header) == {
+        "username": "a, b",
+        "email": "a@example.com",
+        "password": 'p"w',
+    }
+    with pytest.raises(ValueError):
+        parse_csv_header("username,email")
+
+
+async def test_iter_records_joins_quoted_line_breaks() -> None:
+    """Demonstrate that a CSV record whose quoted fields span lines is read as one
+    record starting on its first line, and that a quote which is never closed is
+    reported rather than swallowing the rest of the file"""
+    l_header: List[str] = parse_csv_header("username,email,password")
+
+    async def lines(a_lines: List[str]) -> AsyncIterator[str]:
+        for l_line in a_lines:
+            yield l_line
+
+    l_records: List[Tuple[int, str]] = [
+        l_record
+        async for l_record in iter_records(
+            lines(['"a', "", 'b, c",a@example.com,pw', 'd,"d@example.com",pw']),
+            ImportFormat.csv,
+        )
+    ]
+    assert [l_line for l_line, _ in l_records] == [1, 4]
+    assert parse_record(l_records[0][1], ImportFormat.csv, l_header) == {
+        "username": "a\n\nb, c",
+        "email": "a@example.com",
+        "password": "pw",
+    }
+
+    l_unclosed: List[str] = ['"a,a@example.com,pw'] + ["x,x@example.com,pw"] * (
+        CSV_MAX_RECORD_LINES + 1
+    )
+    l_records = [
+        l_record async for l_record in iter_records(lines(l_unclosed), ImportFormat.csv)
+    ]
+    assert [l_line for l_line, _ in l_records] == [
+        1,
+        CSV_MAX_RECORD_LINES + 1,
+        CSV_MAX_RECORD_LINES + 2,
+    ]
+    with pytest.raises(ValueError, match="isn't closed"):
+        parse_record(l_records[0][1], ImportFormat.csv, l_header)
+
+    # NDJSON lines are records of their own
+    l_records = [
+        l_record
+        async for l_record in iter_records(
+            lines(['{"a": "\\""}', "{}"]), ImportFormat.ndjson
+        )
+    ]
+    assert l_records == [(1, '{"a": "\\""}'), (2, "{}")]
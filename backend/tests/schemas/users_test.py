@@ -0,0 +1,37 @@
+"""
+Tests for User Pydantic Schemas
+"""
+from asyncio import gather
+
+import pytest
+from demo.core.hashing import Hasher
+from demo.schemas import SecretPassword
+from demo.schemas.users import UserLoginSchema
+from pydantic import ValidationError
+from tests.conftest import random_password
+
+
+async def test_secret_password_is_sealed_and_hashed_once() -> None:
+    """Demonstrate that parsing keeps the plaintext sealed and hashing happens once"""
+    l_password: str = random_password()
+    l_login: UserLoginSchema = UserLoginSchema(
+        username="someone", password=f"  {l_password} "
+    )
+
+    assert isinstance(l_login.password, SecretPassword)
+    assert l_login.password.get_secret_value() == l_password
+    assert l_password not in repr(l_login)
+    assert l_password not in l_login.json()
+
+    # bcrypt salts every hash so identical results prove a single hash was computed
+    l_hashes = await gather(l_login.password.get_hash(), l_login.password.get_hash())
+    assert l_hashes[0] == l_hashes[1]
+    assert Hasher.verify_password(l_password, l_hashes[0])
+    assert await l_login.password.verify(l_hashes[0])
+
+
+@pytest.mark.parametrize("a_password", ["ab", "x" * 65])
+def test_secret_password_length_constraints(a_password: str) -> None:
+    """Demonstrate that SecretPassword keeps the generic_str length constraints"""
+    with pytest.raises(ValidationError):
+        UserLoginSchema(username="someone", password=a_password)
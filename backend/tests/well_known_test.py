@@ -0,0 +1,26 @@
+"""
+Tests for the well-known discovery routes
+"""
+from demo.core.tokens import token_codec
+from fastapi import status
+from fastapi.testclient import TestClient
+from requests import Response
+
+
+def test_jwks(client: TestClient) -> None:
+    """Demonstrate that the JWKS is published with cache validators
+
+    Args:
+        client (TestClient): A pytest fixture for a FastAPI TestClient
+    """
+    response: Response = client.get("/.well-known/jwks.json")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == token_codec.key_ring.jwks
+    assert "max-age" in response.headers["Cache-Control"]
+
+    response = client.get(
+        "/.well-known/jwks.json",
+        headers={"If-None-Match": response.headers["ETag"]},
+    )
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED